@@ -1,5 +1,6 @@
 from .camera import CameraManager
 from .face_recognition import  load_face_database
+from .gallery import FaceGallery
 from .database import setup_database
 from .attendance import log_attendance, can_record_attendance
 
@@ -7,6 +8,7 @@ __all__ = [
     'CameraManager',
     'process_frame',
     'load_face_database',
+    'FaceGallery',
     'setup_database',
     'log_attendance',
     'can_record_attendance'
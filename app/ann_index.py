@@ -0,0 +1,240 @@
+import os
+import threading
+import numpy as np
+from .config import (ANN_ENABLED, ANN_MIN_GALLERY_SIZE, ANN_N_LISTS, ANN_N_PROBE, ANN_TRAIN_ITERATIONS,
+                     ANN_TRAIN_SAMPLE_SIZE, ANN_INDEX_PATH, ANN_INDEX_SAVE_DELAY_SECONDS, FACE_MODEL_NAME)
+from .gallery import StringTable
+
+# Số hàng xử lý mỗi lần khi gán cụm, để giới hạn bộ nhớ tạm
+_ASSIGN_CHUNK_SIZE = 65536
+
+# Dấu vân tay của mỗi hàng: hình chiếu lên vài hướng ngẫu nhiên cố định. Hàng có dấu vân tay lệch quá
+# ngưỡng so với lúc được gán cụm (embedding trung bình đã đổi) sẽ được gán cụm lại khi nạp chỉ mục đã lưu.
+_FINGERPRINT_DIRECTIONS = 4
+_FINGERPRINT_TOLERANCE = 1e-4
+
+
+def _fingerprints(vectors):
+    """Dấu vân tay (số hàng, _FINGERPRINT_DIRECTIONS) của các vector đã chuẩn hóa"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    directions = np.random.default_rng(0).standard_normal((vectors.shape[1], _FINGERPRINT_DIRECTIONS))
+    directions = (directions / np.linalg.norm(directions, axis=0)).astype(np.float32)
+    fingerprints = np.empty((len(vectors), _FINGERPRINT_DIRECTIONS), dtype=np.float32)
+    for start in range(0, len(vectors), _ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start:start + _ASSIGN_CHUNK_SIZE]
+        fingerprints[start:start + len(chunk)] = chunk @ directions
+    return fingerprints
+
+
+def _assign(vectors, centroids):
+    """Gán mỗi vector (đã chuẩn hóa) vào cụm có tâm gần nhất theo cosine"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start:start + _ASSIGN_CHUNK_SIZE]
+        labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Chỉ mục IVF (inverted file) dùng k-means cầu, viết thuần NumPy
+
+    assignments song song với các hàng của ma trận gallery: assignments[i] là cụm của hàng i, fingerprints[i]
+    là dấu vân tay của embedding lúc được gán cụm (None nếu không rõ, ví dụ file lưu bởi phiên bản cũ).
+    Giống FaceGallery, đối tượng không bị sửa sau khi tạo; appended/subset trả về chỉ mục mới.
+    """
+
+    def __init__(self, centroids, assignments, n_probe=ANN_N_PROBE, fingerprints=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.n_probe = n_probe
+        self.fingerprints = fingerprints
+        # Danh sách đảo: các hàng được sắp theo cụm, offsets[c]:offsets[c + 1] là các hàng của cụm c
+        self._order = np.argsort(self.assignments, kind='stable')
+        self._offsets = np.searchsorted(self.assignments[self._order], np.arange(len(self.centroids) + 1))
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, matrix, n_lists=ANN_N_LISTS, n_probe=ANN_N_PROBE, iterations=ANN_TRAIN_ITERATIONS,
+              sample_size=ANN_TRAIN_SAMPLE_SIZE, seed=0):
+        """Huấn luyện tâm cụm bằng k-means cầu trên một mẫu của gallery rồi gán toàn bộ hàng"""
+        n = len(matrix)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+        rng = np.random.default_rng(seed)
+        sample = matrix[np.sort(rng.choice(n, min(n, max(sample_size, n_lists)), replace=False))]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = _assign(sample, centroids)
+            order = np.argsort(labels, kind='stable')
+            counts = np.bincount(labels, minlength=n_lists)
+            non_empty = np.flatnonzero(counts)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+            centroids[non_empty] = np.add.reduceat(sample[order], starts, axis=0)
+            # Cụm rỗng được khởi tạo lại bằng một điểm ngẫu nhiên
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+
+        return cls(centroids, _assign(matrix, centroids), n_probe, _fingerprints(matrix))
+
+    def assign(self, vectors):
+        """Tìm cụm cho các vector mới"""
+        return _assign(np.asarray(vectors, dtype=np.float32), self.centroids)
+
+    def appended(self, vectors):
+        """Trả về chỉ mục mới có thêm các hàng ở cuối gallery"""
+        fingerprints = None
+        if self.fingerprints is not None:
+            fingerprints = np.concatenate([self.fingerprints, _fingerprints(vectors)])
+        return IVFIndex(self.centroids, np.concatenate([self.assignments, self.assign(vectors)]), self.n_probe,
+                        fingerprints)
+
+    def subset(self, keep):
+        """Trả về chỉ mục mới chỉ giữ các hàng trong keep"""
+        fingerprints = self.fingerprints[keep] if self.fingerprints is not None else None
+        return IVFIndex(self.centroids, self.assignments[keep], self.n_probe, fingerprints)
+
+    def search(self, matrix, queries, top_k=1, n_probe=None):
+        """Tìm top-k trong các cụm gần nhất, trả về (indices, scores) cùng dạng với FaceGallery.match"""
+        n_probe = max(1, min(n_probe or self.n_probe, self.n_lists))
+        k = min(top_k, len(matrix))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probes[i]])
+            if len(candidates) < k:
+                # Quá ít ứng viên: quét toàn bộ cho truy vấn này
+                candidates = np.arange(len(matrix))
+            candidate_scores = matrix[candidates] @ query
+            best = np.argpartition(-candidate_scores, k - 1)[:k]
+            best = best[np.argsort(-candidate_scores[best], kind='stable')]
+            indices[i] = candidates[best]
+            scores[i] = candidate_scores[best]
+        return indices, scores
+
+
+def save_index(index, keys, path=ANN_INDEX_PATH):
+    """Lưu chỉ mục ra đĩa (ghi file tạm rồi đổi tên để không để lại file hỏng)
+
+    keys là StringTable (gallery.key_table()) hoặc danh sách chuỗi; được lưu dạng mảng byte + offset.
+    """
+    if not isinstance(keys, StringTable):
+        keys = StringTable(keys)
+    tmp_path = f"{path}.tmp.npz"
+    extra = {"fingerprints": index.fingerprints} if index.fingerprints is not None else {}
+    np.savez(tmp_path, centroids=index.centroids, assignments=index.assignments, key_data=keys.data,
+             key_offsets=keys.offsets, model_name=FACE_MODEL_NAME, **extra)
+    os.replace(tmp_path, path)
+
+
+def load_index(path=ANN_INDEX_PATH):
+    """Đọc chỉ mục đã lưu, trả về (index, keys) hoặc None nếu không có hoặc khác model"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if str(data["model_name"]) != FACE_MODEL_NAME:
+                return None
+            fingerprints = data["fingerprints"] if "fingerprints" in data.files else None
+            if "key_data" in data.files:
+                keys = list(StringTable.from_arrays(data["key_data"], data["key_offsets"]))
+            else:
+                keys = [str(key) for key in data["keys"]]  # File lưu bởi phiên bản cũ
+            return IVFIndex(data["centroids"], data["assignments"], fingerprints=fingerprints), keys
+    except Exception as e:
+        print(f"Không thể đọc chỉ mục ANN tại {path}: {e}")
+        return None
+
+
+def build_gallery_index(gallery, path=ANN_INDEX_PATH, save=True):
+    """Gắn chỉ mục IVF vào gallery nếu gallery đủ lớn
+
+    Tâm cụm được lấy từ file đã lưu nếu có; chỉ những người dùng chưa có trong file hoặc có embedding
+    đã thay đổi (so dấu vân tay, ví dụ sau rebuild-embeddings hay thêm ảnh khi server tắt) mới cần gán
+    cụm lại, nên khởi động không phải huấn luyện lại k-means. save=False: không ghi lại file.
+    """
+    if not ANN_ENABLED or len(gallery) < ANN_MIN_GALLERY_SIZE:
+        return gallery.with_index(None)
+
+    saved = load_index(path)
+    if saved is not None and saved[0].centroids.shape[1] == gallery.dim:
+        saved_index, saved_keys = saved
+        position = {key: i for i, key in enumerate(saved_keys)}
+        saved_rows = np.fromiter((position.get(key, -1) for key in gallery.keys), dtype=np.int64, count=len(gallery))
+        found = saved_rows >= 0
+        assignments = np.empty(len(gallery), dtype=np.int32)
+        assignments[found] = saved_index.assignments[saved_rows[found]]
+        fingerprints = _fingerprints(gallery.matrix)
+        if saved_index.fingerprints is not None:
+            drift = np.abs(fingerprints[found] - saved_index.fingerprints[saved_rows[found]]).max(axis=1)
+            found[np.flatnonzero(found)[drift > _FINGERPRINT_TOLERANCE]] = False
+        else:
+            found[:] = False  # File cũ không có dấu vân tay: giữ tâm cụm nhưng gán cụm lại toàn bộ
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            print(f"Gán cụm lại {len(missing)} người dùng mới hoặc có embedding đã thay đổi")
+            assignments[missing] = saved_index.assign(gallery.matrix[missing])
+        index = IVFIndex(saved_index.centroids, assignments, fingerprints=fingerprints)
+    else:
+        print(f"Đang huấn luyện chỉ mục ANN cho {len(gallery)} người dùng...")
+        index = IVFIndex.train(gallery.matrix)
+
+    if save:
+        save_index(index, gallery.key_table(), path)
+    return gallery.with_index(index)
+
+
+class IndexSaver:
+    """Ghi chỉ mục của gallery ra đĩa sau một khoảng trễ
+
+    Mỗi lần ghi là O(số người dùng) (toàn bộ assignments và keys), nên các thay đổi liên tiếp (đăng ký,
+    xóa người dùng) chỉ hẹn một lần ghi sau delay giây với gallery mới nhất. flush() ghi ngay phần còn
+    chờ, gọi khi ứng dụng tắt.
+    """
+
+    def __init__(self, delay=ANN_INDEX_SAVE_DELAY_SECONDS, path=ANN_INDEX_PATH):
+        self.delay = delay
+        self.path = path
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = None
+        self._timer = None
+        self.saves = 0
+
+    def schedule(self, gallery):
+        """Hẹn ghi chỉ mục của gallery (thay cho gallery đang chờ ghi, nếu có)"""
+        with self._lock:
+            self._pending = gallery
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def save(self, gallery):
+        """Ghi ngay chỉ mục của gallery, bỏ lần ghi đang chờ"""
+        with self._lock:
+            self._pending = gallery
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            gallery, self._pending = self._pending, None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if gallery is None or gallery.index is None:
+            return
+        with self._write_lock:
+            save_index(gallery.index, gallery.key_table(), self.path)
+            self.saves += 1
@@ -1,27 +1,162 @@
 import csv
+import io
+import json
 import os
+import queue
+import zlib
+import threading
+import time
 from datetime import datetime, timedelta
-from .config import ATTENDANCE_DIR, ATTENDANCE_INTERVAL_MINUTES
+from .config import (ATTENDANCE_DIR, ATTENDANCE_INTERVAL_MINUTES, ATTENDANCE_FLUSH_INTERVAL_SECONDS, ATTENDANCE_FLUSH_MAX_BATCH,
+                     EXPORT_PAGE_SIZE, EXPORT_CHUNK_BYTES)
+from .metrics import STAGE_SECONDS, ATTENDANCE_RECORDS
+from .database import (write_attendance_batch, get_attendance_events, get_imported_attendance_files,
+                       import_attendance_events, get_attendance_summary, rebuild_attendance_summary)
 
 # Từ điển lưu thời gian điểm danh gần nhất của mỗi người
 last_attendance_time = {}
 
-def log_attendance(name, user_id, event_type):
-    """Ghi nhận điểm danh"""
-    today = datetime.now().strftime("%Y-%m-%d")
-    csv_path = os.path.join(ATTENDANCE_DIR, f"attendance_{today}.csv")
+def append_attendance_rows(date, rows):
+    """Ghi nhiều dòng [name, user_id, time, event, camera] vào file CSV của ngày date (mở file một lần)"""
+    csv_path = os.path.join(ATTENDANCE_DIR, f"attendance_{date}.csv")
     
     # Tạo file CSV với header nếu chưa tồn tại
-    if not os.path.exists(csv_path):
-        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['Name', 'User ID', 'Time', 'Event'])
-    
-    # Ghi thông tin điểm danh
-    current_time = datetime.now().strftime("%H:%M:%S")
+    write_header = not os.path.exists(csv_path)
     with open(csv_path, 'a', newline='', encoding='utf-8') as file:
         writer = csv.writer(file)
-        writer.writerow([name, user_id, current_time, event_type])
+        if write_header:
+            writer.writerow(['Name', 'User ID', 'Time', 'Event', 'Camera'])
+        writer.writerows(rows)
+
+def log_attendance(name, user_id, event_type, camera_id=None):
+    """Ghi nhận điểm danh (camera_id: camera đã nhận diện người này)"""
+    now = datetime.now()
+    append_attendance_rows(now.strftime("%Y-%m-%d"),
+                           [[name, user_id, now.strftime("%H:%M:%S"), event_type, camera_id or ""]])
+
+class AttendanceWriter:
+    """Ghi điểm danh bất đồng bộ ở luồng nền
+
+    Luồng video chỉ đưa bản ghi vào hàng đợi trong bộ nhớ; luồng nền gom các bản ghi và ghi theo
+    chu kỳ: mỗi file CSV được mở một lần cho cả lô, trạng thái trong SQLite được cập nhật trong
+    một transaction.
+    """
+
+    def __init__(self, flush_interval=ATTENDANCE_FLUSH_INTERVAL_SECONDS, max_batch=ATTENDANCE_FLUSH_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.events_written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._total_flush_seconds = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Khởi động luồng ghi nền"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Dừng luồng ghi nền sau khi đã ghi hết các bản ghi còn trong hàng đợi"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        # Ghi nốt những bản ghi đến sau khi luồng đã thoát
+        self._flush(self._drain())
+
+    def submit(self, name, user_id, event_type, camera_id=None, timestamp=None):
+        """Đưa một bản ghi điểm danh vào hàng đợi (không chặn)"""
+        self._queue.put((name, user_id, event_type, camera_id, timestamp or datetime.now()))
+
+    def _drain(self):
+        events = []
+        while len(events) < self.max_batch:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._stop_event.wait(self.flush_interval)
+            events = self._drain()
+            while events:
+                self._flush(events)
+                events = self._drain()
+
+    def _flush(self, events):
+        """Ghi một lô bản ghi xuống CSV và SQLite"""
+        if not events:
+            return
+        start = time.perf_counter()
+        try:
+            rows_by_date = {}
+            event_rows = []
+            statuses = {}
+            for name, user_id, event_type, camera_id, timestamp in events:
+                date, time_str = timestamp.strftime("%Y-%m-%d"), timestamp.strftime("%H:%M:%S")
+                rows_by_date.setdefault(date, []).append([name, user_id, time_str, event_type, camera_id or ""])
+                event_rows.append((user_id, name, date, time_str, event_type, camera_id or ""))
+                statuses[user_id] = (user_id, event_type, timestamp)
+            with STAGE_SECONDS.labels("csv_write", "").time():
+                for date, rows in rows_by_date.items():
+                    append_attendance_rows(date, rows)
+            with STAGE_SECONDS.labels("db_write", "").time():
+                write_attendance_batch(event_rows, list(statuses.values()))
+            self.events_written += len(events)
+        except Exception as e:
+            self.failed_flushes += 1
+            print(f"Lỗi ghi điểm danh: {e}")
+        elapsed = time.perf_counter() - start
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self._total_flush_seconds += elapsed
+
+    def stats(self):
+        """Độ dài hàng đợi và thời gian ghi"""
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "events_written": self.events_written,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 2),
+            "avg_flush_ms": round(self._total_flush_seconds * 1000 / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 2)
+        }
+
+# Bộ ghi điểm danh dùng chung, được khởi động/dừng trong lifespan của ứng dụng
+attendance_writer = AttendanceWriter()
+
+def record_attendance(name, user_id, event_type, camera_id=None):
+    """Ghi nhận điểm danh: đưa vào bộ ghi nền nếu đang chạy, ngược lại ghi trực tiếp"""
+    ATTENDANCE_RECORDS.labels(camera_id or "").inc()
+    if attendance_writer.running:
+        attendance_writer.submit(name, user_id, event_type, camera_id)
+    else:
+        now = datetime.now()
+        with STAGE_SECONDS.labels("csv_write", "").time():
+            log_attendance(name, user_id, event_type, camera_id)
+        with STAGE_SECONDS.labels("db_write", "").time():
+            write_attendance_batch(
+                [(user_id, name, now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), event_type, camera_id or "")],
+                [(user_id, event_type, now)]
+            )
 
 def can_record_attendance(user_id):
     """Kiểm tra thời gian giữa 2 lần điểm danh"""
@@ -39,28 +174,151 @@ def can_record_attendance(user_id):
     last_attendance_time[user_id] = current_time
     return True
 
+def _event_to_record(row, include_date=False):
+    """Chuyển một dòng attendance_events thành bản ghi trả về cho API"""
+    _, user_id, name, date, time_str, event, camera_id = row
+    record = {
+        "name": name,
+        "user_id": user_id,
+        "time": time_str,
+        "event": event,
+        "camera_id": camera_id or None
+    }
+    if include_date:
+        record["date"] = date
+    return record
+
 def get_attendance_records(date=None):
     """Lấy dữ liệu điểm danh theo ngày"""
     if date is None:
         date = datetime.now().strftime("%Y-%m-%d")
-        
-    csv_path = os.path.join(ATTENDANCE_DIR, f"attendance_{date}.csv")
     
-    if not os.path.exists(csv_path):
-        return []
+    return [_event_to_record(row) for row in get_attendance_events(start_date=date, end_date=date)]
+
+def get_attendance_summary_records(start_date=None, end_date=None, user_id=None):
+    """Lấy tổng hợp theo ngày (giờ xuất hiện đầu/cuối, số lần ghi nhận) từ bảng đã tính sẵn"""
+    return [{
+        "date": date,
+        "user_id": user_id,
+        "name": name,
+        "first_seen": first_seen,
+        "last_seen": last_seen,
+        "sightings": sightings
+    } for date, user_id, name, first_seen, last_seen, sightings in get_attendance_summary(start_date, end_date, user_id)]
+
+def encode_cursor(row):
+    """Tạo cursor phân trang từ dòng cuối của trang (khóa date, time, id)"""
+    return f"{row[3]},{row[4]},{row[0]}"
+
+def decode_cursor(cursor):
+    """Đọc cursor phân trang, trả về (date, time, id); ném ValueError nếu không hợp lệ"""
+    date, time_str, event_id = cursor.split(",")
+    return date, time_str, int(event_id)
+
+def query_attendance(start_date=None, end_date=None, user_id=None, cursor=None, limit=100):
+    """Truy vấn điểm danh theo khoảng ngày/người dùng với phân trang keyset
     
-    records = []
-    with open(csv_path, 'r', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        next(reader)  # Bỏ qua header
-        
-        for row in reader:
-            if len(row) >= 4:
-                records.append({
-                    "name": row[0],
-                    "user_id": row[1],
-                    "time": row[2],
-                    "event": row[3]
-                })
+    Trả về (danh sách bản ghi, cursor của trang tiếp theo hoặc None).
+    """
+    after = decode_cursor(cursor) if cursor else None
+    rows = get_attendance_events(start_date, end_date, user_id, after=after, limit=limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [_event_to_record(row, include_date=True) for row in rows[:limit]], next_cursor
+
+def iter_attendance_events(start_date=None, end_date=None, user_id=None, cursor=None, page_size=EXPORT_PAGE_SIZE):
+    """Duyệt lần lượt các sự kiện điểm danh theo từng trang keyset, bộ nhớ không phụ thuộc số bản ghi"""
+    after = decode_cursor(cursor) if cursor else None
+    while True:
+        rows = get_attendance_events(start_date, end_date, user_id, after=after, limit=page_size)
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        after = (rows[-1][3], rows[-1][4], rows[-1][0])
+
+EXPORT_FIELDS = ["date", "time", "user_id", "name", "event", "camera_id", "cursor"]
+
+def _format_csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        event_id, user_id, name, date, time_str, event, camera_id = row
+        writer.writerow([date, time_str, user_id, name, event, camera_id, encode_cursor(row)])
+        yield buffer.getvalue()
+
+def _format_ndjson_lines(rows):
+    for row in rows:
+        event_id, user_id, name, date, time_str, event, camera_id = row
+        yield json.dumps({
+            "date": date,
+            "time": time_str,
+            "user_id": user_id,
+            "name": name,
+            "event": event,
+            "camera_id": camera_id or None,
+            "cursor": encode_cursor(row)
+        }, ensure_ascii=False) + "\n"
+
+def export_attendance(start_date, end_date, user_id=None, export_format="csv", compress=False, cursor=None):
+    """Generator xuất điểm danh dạng CSV hoặc NDJSON (có thể nén gzip) theo từng khối bytes
+    
+    Mỗi dòng có cột cursor: nếu tải bị gián đoạn, gọi lại với cursor của dòng cuối đã nhận để tiếp tục.
+    """
+    rows = iter_attendance_events(start_date, end_date, user_id, cursor)
+    lines = _format_ndjson_lines(rows) if export_format == "ndjson" else _format_csv_lines(rows)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: định dạng gzip
     
-    return records
\ No newline at end of file
+    chunk = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        chunk.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            data = b"".join(chunk)
+            chunk, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b"".join(chunk)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+def migrate_attendance_csv():
+    """Nhập các file attendance_YYYY-MM-DD.csv trong ATTENDANCE_DIR vào bảng attendance_events
+    
+    Chỉ đọc lại file mới hoặc có kích thước thay đổi; bản ghi trùng được bỏ qua nên chạy nhiều lần vẫn an toàn.
+    Trả về số bản ghi mới được nhập.
+    """
+    imported = get_imported_attendance_files()
+    total = 0
+    for file_name in sorted(os.listdir(ATTENDANCE_DIR)):
+        if not (file_name.startswith("attendance_") and file_name.endswith(".csv")):
+            continue
+        csv_path = os.path.join(ATTENDANCE_DIR, file_name)
+        file_size = os.path.getsize(csv_path)
+        if imported.get(file_name) == file_size:
+            continue
+        
+        date = file_name[len("attendance_"):-len(".csv")]
+        events = []
+        with open(csv_path, 'r', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            next(reader, None)  # Bỏ qua header
+            for row in reader:
+                if len(row) >= 4:
+                    camera_id = row[4] if len(row) >= 5 else ""
+                    events.append((row[1], row[0], date, row[2], row[3], camera_id))
+        total += import_attendance_events(file_name, file_size, events)
+    return total
+
+def backfill_attendance_summary():
+    """Nhập các file CSV chưa nhập rồi tính lại toàn bộ bảng tổng hợp, trả về (số sự kiện mới, số dòng tổng hợp)"""
+    imported = migrate_attendance_csv()
+    return imported, rebuild_attendance_summary()
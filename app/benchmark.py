@@ -0,0 +1,333 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from .config import ANN_MIN_GALLERY_SIZE, FACE_MODEL_NAME
+from .gallery import FaceGallery, l2_normalize
+
+# Kích thước gallery mặc định cho bộ benchmark (--quick chỉ chạy đến 10.000)
+DEFAULT_GALLERY_SIZES = (10, 1000, 10000, 100000, 500000)
+QUICK_GALLERY_SIZES = (10, 1000, 10000)
+
+# 5 điểm mốc chuẩn của ArcFace trên ảnh 112x112 (mắt trái, mắt phải, mũi, mép trái, mép phải)
+_ARCFACE_TEMPLATE = np.array([[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366],
+                              [41.5493, 92.3655], [70.7299, 92.2041]], dtype=np.float32)
+
+
+def synthetic_gallery(size, dim=512, n_clusters=1000, seed=0, chunk_size=50000):
+    """Tạo gallery giả có cấu trúc cụm, gần với phân bố embedding thật hơn nhiễu đều
+
+    Sinh theo từng khối để gallery lớn (hàng trăm nghìn người) không cần bộ nhớ tạm gấp nhiều lần.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((min(n_clusters, size), dim)).astype(np.float32)
+    matrix = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, chunk_size):
+        count = min(chunk_size, size - start)
+        block = centers[rng.integers(0, len(centers), count)]
+        block += 0.8 * rng.standard_normal((count, dim)).astype(np.float32)
+        matrix[start:start + count] = l2_normalize(block)
+    gallery = FaceGallery(dim=dim)
+    gallery.keys = [f"user{i}_user{i}" for i in range(size)]
+    gallery.infos = [{"user_id": f"user{i}", "name": f"user{i}"} for i in range(size)]
+    gallery.matrix = matrix
+    return gallery
+
+
+def synthetic_queries(gallery, count, noise=0.6, seed=1):
+    """Truy vấn = embedding trong gallery cộng nhiễu, mô phỏng ảnh chụp mới của người đã đăng ký"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(gallery), count)
+    perturbation = rng.standard_normal((count, gallery.dim)).astype(np.float32)
+    return l2_normalize(gallery.matrix[rows] + noise * perturbation / np.sqrt(gallery.dim))
+
+
+class StubDetector:
+    """Thay det_model: luôn trả về cùng các bbox/keypoint, không chạy mô hình"""
+
+    def __init__(self, bboxes, kpss):
+        self.bboxes = bboxes
+        self.kpss = kpss
+
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        return self.bboxes.copy(), self.kpss.copy()
+
+
+class StubRecognition:
+    """Thay mô hình ArcFace: trả về embedding có sẵn theo thứ tự khuôn mặt"""
+
+    input_size = (112, 112)
+
+    def __init__(self, embeddings):
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    def get_feat(self, imgs):
+        count = len(imgs) if isinstance(imgs, list) else 1
+        return self.embeddings[np.arange(count) % len(self.embeddings)]
+
+
+class StubAnalyzer:
+    """FaceAnalysis giả cho benchmark/kiểm thử tải: không cần camera, GPU hay tải mô hình"""
+
+    def __init__(self, n_faces, embeddings, frame_size=(480, 640)):
+        height, width = frame_size
+        bboxes = []
+        kpss = []
+        face_size = min(120, width // max(1, n_faces))
+        for i in range(n_faces):
+            left, top = (i * face_size) % max(1, width - face_size), height // 3
+            bboxes.append([left, top, left + face_size, top + face_size, 0.99])
+            kpss.append(_ARCFACE_TEMPLATE * (face_size / 112) + np.array([left, top], dtype=np.float32))
+        self.det_model = StubDetector(np.array(bboxes, dtype=np.float32).reshape(-1, 5),
+                                      np.array(kpss, dtype=np.float32).reshape(-1, 5, 2))
+        self.models = {'detection': self.det_model, 'recognition': StubRecognition(embeddings)}
+
+    def get(self, img, max_num=0):
+        from .face_recognition import detect_face_boxes, embed_faces
+        faces = detect_face_boxes(self, img)
+        embed_faces(self, img, faces)
+        return faces
+
+
+def _summarize(samples):
+    samples = np.asarray(samples, dtype=np.float64)
+    return {
+        "n": int(samples.size),
+        "mean": float(samples.mean()),
+        "p50": float(np.percentile(samples, 50)),
+        "p95": float(np.percentile(samples, 95)),
+        "min": float(samples.min())
+    }
+
+
+def measure(fn, min_seconds=0.5, min_runs=5, max_runs=10000):
+    """Chạy fn lặp lại (sau một lần chạy làm nóng) đến khi đủ thời gian/số lần, trả về thống kê giây mỗi lần"""
+    fn()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_runs and (len(samples) < min_runs or time.perf_counter() - started < min_seconds):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return _summarize(samples)
+
+
+def bench_matcher(sizes, faces_per_call=(1, 16), min_seconds=0.5):
+    """Thông lượng so khớp của FaceGallery.recognize (quét toàn bộ và ANN với gallery lớn)"""
+    from .ann_index import IVFIndex
+
+    results = []
+    for size in sizes:
+        gallery = synthetic_gallery(size)
+        for faces in faces_per_call:
+            queries = list(synthetic_queries(gallery, faces))
+            stats = measure(lambda: gallery.recognize(queries), min_seconds)
+            results.append({"name": "matcher.exact", "params": {"gallery_size": size, "faces": faces},
+                            "unit": "s/call", "value": stats["mean"], "stats": stats,
+                            "faces_per_second": faces / stats["mean"]})
+        if size >= ANN_MIN_GALLERY_SIZE:
+            start = time.perf_counter()
+            indexed = gallery.with_index(IVFIndex.train(gallery.matrix))
+            train_seconds = time.perf_counter() - start
+            for faces in faces_per_call:
+                queries = list(synthetic_queries(indexed, faces))
+                stats = measure(lambda: indexed.recognize(queries), min_seconds)
+                results.append({"name": "matcher.ann", "params": {"gallery_size": size, "faces": faces},
+                                "unit": "s/call", "value": stats["mean"], "stats": stats,
+                                "faces_per_second": faces / stats["mean"], "train_seconds": train_seconds})
+        del gallery
+    return results
+
+
+def bench_gallery_load(sizes, images_per_user=2):
+    """Thời gian load_face_database khi mọi embedding đã có trong cache (khởi động lại server)
+
+    Ảnh giả là file nhỏ (vẫn được đọc và băm như ảnh thật); không ảnh nào phải chạy mô hình.
+    """
+    from .database import add_enrollment_batch, get_user_face_data, execute
+    from .face_recognition import load_face_database, compute_content_hash, embedding_to_bytes
+
+    results = []
+    rng = np.random.default_rng(2)
+    for size in sizes:
+        execute("DELETE FROM face_images")
+        execute("DELETE FROM face_embeddings")
+        execute("DELETE FROM users")
+        shutil.rmtree("dataset", ignore_errors=True)
+        users, face_images, embeddings = [], [], []
+        for i in range(size):
+            folder = os.path.join("dataset", f"user{i}_user{i}")
+            os.makedirs(folder, exist_ok=True)
+            users.append((f"user{i}", f"user{i}"))
+            for j in range(images_per_user):
+                path = os.path.join(folder, f"user{i}_{j:04d}.jpg")
+                data = rng.bytes(2048)
+                with open(path, "wb") as file:
+                    file.write(data)
+                face_images.append((f"user{i}", path))
+                embedding = l2_normalize(rng.standard_normal((1, 512)).astype(np.float32))[0]
+                embeddings.append((path, FACE_MODEL_NAME, compute_content_hash(data), embedding_to_bytes(embedding)))
+        add_enrollment_batch(users, face_images, embeddings)
+
+        start = time.perf_counter()
+        face_data = get_user_face_data()
+        face_db = load_face_database(face_data)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        FaceGallery.from_face_database(face_db)
+        build_seconds = time.perf_counter() - start
+        results.append({"name": "gallery.load_cached", "params": {"users": size, "images_per_user": images_per_user},
+                        "unit": "s", "value": load_seconds})
+        results.append({"name": "gallery.build_matrix", "params": {"users": size},
+                        "unit": "s", "value": build_seconds})
+    return results
+
+
+def bench_process_frame(faces_per_frame=(0, 1, 5, 15), gallery_size=1000, min_seconds=0.5):
+    """Chi phí mỗi frame của process_frame (ngoài mô hình) với analyzer giả, có/không tracker và vẽ"""
+    # Căn chỉnh khuôn mặt dùng insightface (không cần tải mô hình); process_frame tự bắt lỗi nên kiểm tra trước
+    from insightface.utils import face_align  # noqa: F401
+    from .compact_gallery import STORAGE_TYPES, CompactGallery
+    from .face_recognition import process_frame
+    from .tracking import FaceTracker
+
+    gallery = synthetic_gallery(gallery_size)
+    frame = np.random.default_rng(3).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    results = []
+    for faces in faces_per_frame:
+        analyzer = StubAnalyzer(faces, synthetic_queries(gallery, max(1, faces)))
+        variants = [
+            ("process_frame", gallery, {}, True),
+            ("process_frame.no_draw", gallery, {}, False),
+            ("process_frame.tracker", gallery, {"tracker": FaceTracker()}, True),
+        ]
+        # Gallery lượng tử hóa (GALLERY_STORAGE=float16/int8) đi qua cùng đường xử lý
+        variants += [(f"process_frame.{storage}", CompactGallery.from_gallery(gallery, storage), {}, True)
+                     for storage in STORAGE_TYPES]
+        for name, face_database, kwargs, draw in variants:
+            # process_frame tự bắt lỗi và trả về danh sách rỗng: kiểm tra mọi khuôn mặt đều được nhận diện
+            _, recognized = process_frame(frame, face_database, analyzer=analyzer, camera_id="bench", draw=draw,
+                                          **kwargs)
+            if sum(user["user_id"] is not None for user in recognized) != faces:
+                raise RuntimeError(f"{name}: chỉ nhận diện được {len(recognized)}/{faces} khuôn mặt")
+            stats = measure(lambda: process_frame(frame, face_database, analyzer=analyzer, camera_id="bench",
+                                                  draw=draw, **kwargs), min_seconds)
+            results.append({"name": name, "params": {"faces": faces, "gallery_size": gallery_size},
+                            "unit": "s/frame", "value": stats["mean"], "stats": stats})
+    return results
+
+
+def bench_attendance(events=2000):
+    """Chi phí ghi điểm danh: ghi trực tiếp từng bản ghi (CSV + SQLite) và ghi theo lô qua AttendanceWriter"""
+    from .attendance import AttendanceWriter, log_attendance
+    from .database import write_attendance_batch
+
+    results = []
+    direct = min(events, 200)
+    start = time.perf_counter()
+    for i in range(direct):
+        now = datetime.now()
+        log_attendance(f"user{i}", f"user{i}", "check", "bench")
+        write_attendance_batch([(f"user{i}", f"user{i}", now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S.%f"),
+                                 "check", "bench")], [(f"user{i}", "check", now)])
+    elapsed = time.perf_counter() - start
+    results.append({"name": "attendance.direct", "params": {"events": direct},
+                    "unit": "s/event", "value": elapsed / direct})
+
+    writer = AttendanceWriter()
+    start = time.perf_counter()
+    for i in range(events):
+        writer.submit(f"user{i}", f"user{i}", "check", "bench")
+    submit_seconds = time.perf_counter() - start
+    # Ghi ngay trong luồng hiện tại (như luồng nền làm mỗi chu kỳ) để không tính thời gian chờ chu kỳ
+    start = time.perf_counter()
+    batch = writer._drain()
+    while batch:
+        writer._flush(batch)
+        batch = writer._drain()
+    flush_seconds = time.perf_counter() - start
+    results.append({"name": "attendance.submit", "params": {"events": events},
+                    "unit": "s/event", "value": submit_seconds / events})
+    results.append({"name": "attendance.batched_flush", "params": {"events": events},
+                    "unit": "s/event", "value": flush_seconds / events})
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def run_suite(sizes=DEFAULT_GALLERY_SIZES, load_sizes=(10, 1000, 10000), min_seconds=0.5, only=None):
+    """Chạy bộ benchmark trong thư mục tạm (CSDL, CSV, ảnh giả không ảnh hưởng dữ liệu thật)
+
+    only: danh sách nhóm cần chạy (matcher, gallery_load, process_frame, attendance), None = tất cả.
+    """
+    from .database import setup_database, close_connection
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "results": [],
+        "skipped": {}
+    }
+    groups = (
+        ("matcher", lambda: bench_matcher(sizes, min_seconds=min_seconds)),
+        ("gallery_load", lambda: bench_gallery_load(load_sizes)),
+        ("process_frame", lambda: bench_process_frame(min_seconds=min_seconds)),
+        ("attendance", lambda: bench_attendance()),
+    )
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="attendance_bench_")
+    try:
+        os.chdir(work_dir)
+        os.makedirs("attendance_logs", exist_ok=True)
+        os.makedirs("dataset", exist_ok=True)
+        close_connection()
+        setup_database()
+        for name, run in groups:
+            if only and name not in only:
+                continue
+            print(f"Đang chạy nhóm {name}...")
+            try:
+                report["results"].extend(run())
+            except ImportError as e:
+                # Ví dụ process_frame cần insightface (căn chỉnh khuôn mặt) dù không tải mô hình
+                report["skipped"][name] = str(e)
+                print(f"Bỏ qua nhóm {name}: {e}")
+    finally:
+        close_connection()
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def _result_key(result):
+    return result["name"] + json.dumps(result.get("params", {}), sort_keys=True)
+
+
+def compare_reports(baseline, current):
+    """So sánh hai file kết quả, trả về danh sách (tên, tham số, giá trị cũ, giá trị mới, tỉ lệ mới/cũ)"""
+    old = {_result_key(result): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        previous = old.get(_result_key(result))
+        if previous is None or not previous["value"]:
+            continue
+        rows.append((result["name"], result.get("params", {}), previous["value"], result["value"],
+                     result["value"] / previous["value"]))
+    return rows
@@ -0,0 +1,201 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .config import DATASET_DIR, FACE_MODEL_NAME, BULK_IMPORT_WORKERS, BULK_IMPORT_BATCH_SIZE
+from .database import setup_database, add_enrollment_batch, get_processed_image_paths
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Phiên FaceAnalysis của từng tiến trình con
+_worker_analyzer = None
+
+
+def _init_worker():
+    """Khởi tạo mô hình một lần cho mỗi tiến trình con"""
+    global _worker_analyzer
+    from .face_recognition import get_face_analyzer
+    _worker_analyzer = get_face_analyzer()
+
+
+def _analyze_image(source_path, dest_path):
+    """Chạy trong tiến trình con: đọc, nhận diện và (nếu hợp lệ) chép ảnh vào DATASET_DIR
+
+    Trả về (dest_path, content_hash, embedding_bytes, lý do từ chối hoặc None).
+    """
+    import cv2
+    import numpy as np
+    from .face_recognition import compute_content_hash, embedding_to_bytes
+
+    try:
+        with open(source_path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return dest_path, None, None, "unreadable"
+    content_hash = compute_content_hash(data)
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return dest_path, content_hash, None, "undecodable"
+
+    faces = _worker_analyzer.get(img)
+    if not faces:
+        return dest_path, content_hash, None, "no_face"
+    if len(faces) > 1:
+        return dest_path, content_hash, None, "multiple_faces"
+
+    if os.path.abspath(source_path) != os.path.abspath(dest_path):
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.copyfile(source_path, dest_path)
+    return dest_path, content_hash, embedding_to_bytes(faces[0].normed_embedding), None
+
+
+def scan_dataset(root):
+    """Duyệt thư mục dạng {user_id}_{name}/*.jpg, trả về danh sách (user_id, name, đường dẫn nguồn, đường dẫn đích)"""
+    items = []
+    for folder in sorted(os.listdir(root)):
+        folder_path = os.path.join(root, folder)
+        if not os.path.isdir(folder_path) or "_" not in folder:
+            continue
+        user_id, name = folder.split("_", 1)
+        for filename in sorted(os.listdir(folder_path)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                items.append((user_id, name, os.path.join(folder_path, filename),
+                              os.path.join(DATASET_DIR, folder, filename)))
+    return items
+
+
+def extract_archive(archive_path, dest_dir):
+    """Giải nén file zip vào dest_dir, trả về thư mục chứa các thư mục {user_id}_{name}
+
+    Từ chối các đường dẫn thoát ra ngoài thư mục đích; nếu zip bọc mọi thứ trong một thư mục
+    duy nhất thì trả về thư mục đó.
+    """
+    dest_root = os.path.abspath(dest_dir)
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.namelist():
+            target = os.path.abspath(os.path.join(dest_root, member))
+            if not target.startswith(dest_root + os.sep):
+                raise ValueError(f"Đường dẫn không hợp lệ trong file zip: {member}")
+        archive.extractall(dest_root)
+    entries = os.listdir(dest_root)
+    if len(entries) == 1 and "_" not in entries[0] and os.path.isdir(os.path.join(dest_root, entries[0])):
+        return os.path.join(dest_root, entries[0])
+    return dest_root
+
+
+class ImportJob:
+    """Một lượt nhập hàng loạt, có thể chạy lại để tiếp tục sau khi bị gián đoạn
+
+    Ảnh đã có trong face_images hoặc face_embeddings được bỏ qua, nên chạy lại cùng thư mục
+    chỉ xử lý phần còn dở (ảnh bị loại sẽ được kiểm tra lại).
+    """
+
+    def __init__(self, root, workers=BULK_IMPORT_WORKERS, batch_size=BULK_IMPORT_BATCH_SIZE):
+        self.job_id = uuid.uuid4().hex
+        self.root = root
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.status = "pending"
+        self.error = None
+        self.total = 0
+        self.skipped = 0
+        self.processed = 0
+        self.accepted = 0
+        self.rejected = {}
+        self.users = set()
+        self.started_at = None
+        self.finished_at = None
+
+    def progress(self):
+        """Tiến độ và tốc độ xử lý hiện tại"""
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        throughput = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.skipped - self.processed
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "total_images": self.total,
+            "skipped_images": self.skipped,
+            "processed_images": self.processed,
+            "accepted_images": self.accepted,
+            "rejected_images": dict(self.rejected),
+            "users": len(self.users),
+            "elapsed_seconds": round(elapsed, 1),
+            "images_per_second": round(throughput, 2),
+            "eta_seconds": round(remaining / throughput, 1) if throughput > 0 else None
+        }
+
+    def run(self, on_progress=None):
+        """Chạy toàn bộ lượt nhập (chặn đến khi xong)"""
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            setup_database()
+            if not os.path.isdir(self.root):
+                raise ValueError(f"Không tìm thấy thư mục {self.root}")
+            items = scan_dataset(self.root)
+            self.total = len(items)
+            done = get_processed_image_paths()
+            pending = [item for item in items if item[3] not in done]
+            self.skipped = self.total - len(pending)
+
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                     initializer=_init_worker) as executor:
+                for start in range(0, len(pending), self.batch_size):
+                    batch = pending[start:start + self.batch_size]
+                    results = executor.map(_analyze_image, [item[2] for item in batch], [item[3] for item in batch])
+                    self._write_batch(batch, list(results))
+                    if on_progress:
+                        on_progress(self)
+            self.status = "completed"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"Nhập hàng loạt thất bại: {e}")
+        finally:
+            self.finished_at = time.time()
+
+    def _write_batch(self, batch, results):
+        """Ghi kết quả một lô trong một transaction"""
+        users = []
+        face_images = []
+        embeddings = []
+        for (user_id, name, _, _), (dest_path, content_hash, embedding, reason) in zip(batch, results):
+            self.processed += 1
+            if reason is not None:
+                # Ảnh bị loại không được chép vào DATASET_DIR nên không ghi cache cho dest_path
+                self.rejected[reason] = self.rejected.get(reason, 0) + 1
+                continue
+            users.append((user_id, name))
+            face_images.append((user_id, dest_path))
+            embeddings.append((dest_path, FACE_MODEL_NAME, content_hash, embedding))
+            self.users.add(user_id)
+            self.accepted += 1
+        add_enrollment_batch(list(dict.fromkeys(users)), face_images, embeddings)
+
+
+# Các lượt nhập chạy nền từ API, theo job_id
+import_jobs = {}
+
+
+def start_import_job(root, on_complete=None, cleanup_path=None):
+    """Chạy lượt nhập trong luồng nền, trả về ImportJob để theo dõi tiến độ"""
+    job = ImportJob(root)
+    import_jobs[job.job_id] = job
+
+    def run():
+        job.run()
+        if cleanup_path:
+            shutil.rmtree(cleanup_path, ignore_errors=True)
+        if on_complete and job.status == "completed":
+            on_complete(job)
+
+    threading.Thread(target=run, name=f"bulk-import-{job.job_id[:8]}", daemon=True).start()
+    return job
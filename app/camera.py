@@ -1,11 +1,97 @@
 import cv2
+import glob
+import os
 import threading
+import time
+from .config import CAMERA_SOURCES, DEFAULT_CAMERA_ID, LOOP_VIDEO_FILES, FILE_SOURCE_FPS
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class FramePacer:
+    """Giữ nhịp đọc frame của nguồn file như camera thật (fps <= 0: không giới hạn)"""
+
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self._next = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next is None or now - self._next > self.interval:
+            # Lần đọc đầu hoặc bên đọc bị chậm: tính nhịp lại từ bây giờ thay vì đọc dồn để đuổi kịp
+            self._next = now
+        elif self._next > now:
+            time.sleep(self._next - now)
+        self._next += self.interval
+
+class LoopingVideoCapture:
+    """Bọc cv2.VideoCapture của file video, tự phát lại từ đầu khi hết file"""
+
+    def __init__(self, path, fps=FILE_SOURCE_FPS):
+        self.path = path
+        self._capture = cv2.VideoCapture(path)
+        if fps is None:
+            fps = self._capture.get(cv2.CAP_PROP_FPS) or 25
+        self._pacer = FramePacer(fps)
+
+    def read(self):
+        self._pacer.wait()
+        success, frame = self._capture.read()
+        if not success:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self._capture.read()
+        return success, frame
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def release(self):
+        self._capture.release()
+
+class ImageSequenceCapture:
+    """Nguồn giả từ chuỗi ảnh (thư mục hoặc mẫu glob), phát lặp lại theo thứ tự tên file
+
+    Ảnh được giải mã một lần khi mở nên việc đọc đĩa không ảnh hưởng kết quả kiểm thử tải.
+    """
+
+    def __init__(self, pattern, fps=FILE_SOURCE_FPS):
+        self.pattern = pattern
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            paths = glob.glob(pattern)
+        paths = sorted(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+        self._frames = [frame for frame in (cv2.imread(path) for path in paths) if frame is not None]
+        self._index = 0
+        self._pacer = FramePacer(25 if fps is None else fps)
+
+    def read(self):
+        if not self._frames:
+            return False, None
+        self._pacer.wait()
+        frame = self._frames[self._index]
+        self._index = (self._index + 1) % len(self._frames)
+        # Trả bản sao vì bước vẽ kết quả ghi trực tiếp lên frame
+        return True, frame.copy()
+
+    def isOpened(self):
+        return bool(self._frames)
+
+    def release(self):
+        self._frames = []
+
+def is_image_sequence(source):
+    """Nguồn là thư mục ảnh hoặc mẫu glob (ví dụ "frames/*.jpg")"""
+    if not isinstance(source, str) or "://" in source:
+        return False  # URL có thể chứa "?" nhưng không phải mẫu glob
+    return os.path.isdir(source) or glob.has_magic(source)
 
 class CameraManager:
     _instance = None
     _camera = None
     _lock = threading.Lock()
-    
+
     @classmethod
     def get_instance(cls):
         """Lấy instance của CameraManager (Singleton pattern)"""
@@ -14,22 +100,57 @@ class CameraManager:
                 if cls._instance is None:
                     cls._instance = cls()
         return cls._instance
-    
+
     def __init__(self):
-        """Khởi tạo CameraManager"""
+        """Khởi tạo CameraManager với danh sách nguồn trong CAMERA_SOURCES"""
         if CameraManager._instance is not None:
             raise Exception("Singleton class - sử dụng get_instance()")
-        self._camera = None
-    
-    def get_camera(self):
+        self._sources = dict(CAMERA_SOURCES)
+        self._cameras = {}
+        self._cameras_lock = threading.Lock()
+
+    @property
+    def camera_ids(self):
+        """Danh sách tên camera đã đăng ký"""
+        return list(self._sources)
+
+    def has_camera(self, camera_id):
+        return camera_id in self._sources
+
+    def get_source(self, camera_id):
+        return self._sources[camera_id]
+
+    def register_source(self, camera_id, source):
+        """Đăng ký (hoặc thay đổi) nguồn cho một camera; source có thể là hàm không tham số trả về đối tượng có read()/release()"""
+        self.release_camera(camera_id)
+        self._sources[camera_id] = source
+
+    def _open_source(self, source):
+        """Mở nguồn video: chỉ số thiết bị, URL, file video, chuỗi ảnh hoặc hàm tạo capture (nguồn giả khi kiểm thử)"""
+        if callable(source):
+            return source()
+        if is_image_sequence(source):
+            return ImageSequenceCapture(source)
+        if isinstance(source, str) and os.path.isfile(source) and LOOP_VIDEO_FILES:
+            return LoopingVideoCapture(source)
+        return cv2.VideoCapture(source)
+
+    def get_camera(self, camera_id=DEFAULT_CAMERA_ID):
         """Lấy camera, khởi tạo nếu chưa có"""
-        if self._camera is None:
-            self._camera = cv2.VideoCapture(0)
-        return self._camera
-    
-    def release_camera(self):
+        with self._cameras_lock:
+            if camera_id not in self._cameras:
+                self._cameras[camera_id] = self._open_source(self._sources[camera_id])
+            return self._cameras[camera_id]
+
+    def release_camera(self, camera_id=DEFAULT_CAMERA_ID):
         """Giải phóng tài nguyên camera"""
-        if self._camera is not None:
-            self._camera.release()
-            self._camera = None
-            print("Camera đã được giải phóng")
\ No newline at end of file
+        with self._cameras_lock:
+            camera = self._cameras.pop(camera_id, None)
+        if camera is not None:
+            camera.release()
+            print(f"Camera '{camera_id}' đã được giải phóng")
+
+    def release_all(self):
+        """Giải phóng tất cả camera đang mở"""
+        for camera_id in list(self._cameras):
+            self.release_camera(camera_id)
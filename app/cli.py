@@ -0,0 +1,367 @@
+import argparse
+import time
+import numpy as np
+
+from .config import DEFAULT_CAMERA_ID, GALLERY_RERANK_CANDIDATES, GALLERY_STORAGE_TYPES
+from .database import setup_database, get_user_face_data, clear_face_embeddings
+
+
+def rebuild_embeddings(args):
+    """Tính lại toàn bộ embedding (dùng khi nâng cấp model)"""
+    from .face_recognition import load_face_database
+
+    setup_database()
+    clear_face_embeddings()
+    start = time.time()
+    user_face_data = get_user_face_data()
+    face_db = load_face_database(user_face_data, force_rebuild=True)
+    elapsed = time.time() - start
+    print(f"Đã tính lại embedding cho {len(user_face_data)} ảnh của {len(face_db)} người dùng trong {elapsed:.1f}s")
+
+
+def import_dataset(args):
+    """Nhập hàng loạt người dùng từ thư mục hoặc file zip dạng {user_id}_{name}/*.jpg"""
+    import os
+    import tempfile
+    from .bulk_import import ImportJob, extract_archive
+
+    staging_dir = None
+    root = args.path
+    if os.path.isfile(root) and root.lower().endswith(".zip"):
+        staging_dir = tempfile.mkdtemp(prefix="bulk_import_")
+        root = extract_archive(args.path, staging_dir)
+
+    def report(job):
+        progress = job.progress()
+        print(f"{progress['skipped_images'] + progress['processed_images']}/{progress['total_images']} ảnh, "
+              f"{progress['images_per_second']:.1f} ảnh/s, còn khoảng {progress['eta_seconds']}s")
+
+    try:
+        job = ImportJob(root, workers=args.workers, batch_size=args.batch_size)
+        job.run(on_progress=report)
+    finally:
+        if staging_dir:
+            import shutil
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    progress = job.progress()
+    print(f"Trạng thái: {progress['status']}" + (f" ({progress['error']})" if progress['error'] else ""))
+    print(f"Đã thêm {progress['accepted_images']} ảnh của {progress['users']} người dùng, "
+          f"bỏ qua {progress['skipped_images']} ảnh đã nhập trước đó, loại {progress['rejected_images']}")
+    print("Khởi động lại server hoặc gọi POST /gallery/reload để nạp người dùng mới vào gallery")
+
+
+def migrate_attendance(args):
+    """Nhập các file CSV điểm danh cũ vào bảng attendance_events"""
+    from .attendance import migrate_attendance_csv
+
+    setup_database()
+    start = time.time()
+    imported = migrate_attendance_csv()
+    print(f"Đã nhập {imported} bản ghi điểm danh trong {time.time() - start:.1f}s")
+
+
+def rebuild_summary(args):
+    """Tính lại bảng tổng hợp điểm danh theo ngày từ các file CSV và attendance_events"""
+    from .attendance import backfill_attendance_summary
+
+    setup_database()
+    start = time.time()
+    imported, rows = backfill_attendance_summary()
+    print(f"Đã nhập {imported} bản ghi từ CSV, tính lại {rows} dòng tổng hợp trong {time.time() - start:.1f}s")
+
+
+def ann_report(args):
+    """So sánh recall và độ trễ của chỉ mục ANN với tìm kiếm chính xác"""
+    from .ann_index import IVFIndex
+    from .gallery import l2_normalize
+
+    if args.synthetic:
+        from .benchmark import synthetic_gallery
+        gallery = synthetic_gallery(args.synthetic)
+    else:
+        from .face_recognition import load_face_database
+        from .gallery import FaceGallery
+        setup_database()
+        gallery = FaceGallery.from_face_database(load_face_database(get_user_face_data()))
+    if len(gallery) == 0:
+        print("Gallery rỗng, không có gì để đánh giá")
+        return
+
+    # Truy vấn = embedding trong gallery cộng nhiễu, mô phỏng ảnh chụp mới của người đã đăng ký
+    rng = np.random.default_rng(1)
+    rows = rng.integers(0, len(gallery), args.queries)
+    noise = rng.standard_normal((args.queries, gallery.dim)).astype(np.float32)
+    queries = l2_normalize(gallery.matrix[rows] + args.noise * noise / np.sqrt(gallery.dim))
+
+    start = time.perf_counter()
+    exact_indices, _ = gallery.with_index(None).match(queries, top_k=1)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    index = IVFIndex.train(gallery.matrix, n_lists=args.n_lists)
+    train_s = time.perf_counter() - start
+
+    print(f"Gallery: {len(gallery)} người dùng, {index.n_lists} cụm (huấn luyện {train_s:.1f}s), {len(queries)} truy vấn")
+    print(f"{'n_probe':>8} {'recall@1':>9} {'ms/truy vấn':>12} {'tăng tốc':>9}")
+    print(f"{'exact':>8} {1.0:>9.4f} {exact_ms:>12.3f} {1.0:>8.1f}x")
+    for n_probe in args.n_probe:
+        start = time.perf_counter()
+        indices, _ = index.search(gallery.matrix, queries, top_k=1, n_probe=n_probe)
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = float(np.mean(indices[:, 0] == exact_indices[:, 0]))
+        print(f"{n_probe:>8} {recall:>9.4f} {ann_ms:>12.3f} {exact_ms / ann_ms:>8.1f}x")
+
+
+def gallery_report(args):
+    """So sánh bộ nhớ mỗi người dùng, độ chính xác và độ trễ của gallery lượng tử hóa với gallery float32"""
+    from .benchmark import synthetic_gallery, synthetic_queries
+    from .compact_gallery import STORAGE_TYPES, CompactGallery, gallery_memory_usage
+    from .config import FACE_RECOGNITION_THRESHOLD
+
+    if args.synthetic:
+        gallery = synthetic_gallery(args.synthetic)
+    else:
+        from .face_recognition import load_face_database
+        from .gallery import FaceGallery
+        setup_database()
+        gallery = FaceGallery.from_face_database(load_face_database(get_user_face_data()))
+    if len(gallery) == 0:
+        print("Gallery rỗng, không có gì để đánh giá")
+        return
+
+    queries = synthetic_queries(gallery, args.queries, noise=args.noise)
+    top_k = 5
+    variants = [("float32", gallery)]
+    for storage in STORAGE_TYPES:
+        variants.append((storage, CompactGallery.from_gallery(gallery, storage)))
+        if args.rerank:
+            # Bản chính xác là ma trận float32 gốc, như file gallery dùng chung đã memory-map
+            variants.append((f"{storage}+rerank{args.rerank}",
+                             CompactGallery.from_gallery(gallery, storage, exact=gallery.matrix, rerank=args.rerank)))
+
+    print(f"Gallery: {len(gallery)} người dùng, {len(queries)} truy vấn (nhiễu {args.noise}), "
+          f"ngưỡng {FACE_RECOGNITION_THRESHOLD}")
+    print(f"{'lưu trữ':<18} {'B/người':>8} {'embedding':>10} {'id/tên':>8} {'top-1':>7} {'recall@5':>9} "
+          f"{'quyết định':>10} {'|Δ điểm| tb':>11} {'|Δ điểm| max':>12} {'ms/truy vấn':>12}")
+    reference_indices, reference_scores = gallery.match(queries, top_k=top_k)
+    reference_accept = reference_scores[:, 0] > FACE_RECOGNITION_THRESHOLD
+    for label, variant in variants:
+        start = time.perf_counter()
+        indices, scores = variant.match(queries, top_k=top_k)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        usage = gallery_memory_usage(variant)
+        # top-1: cùng người với gallery float32; recall@5: top-5 chứa top-1 của float32;
+        # quyết định: cùng kết quả nhận/từ chối theo ngưỡng và cùng người khi nhận
+        same_top1 = indices[:, 0] == reference_indices[:, 0]
+        recall = np.mean((indices == reference_indices[:, :1]).any(axis=1))
+        accept = scores[:, 0] > FACE_RECOGNITION_THRESHOLD
+        decision = np.mean((accept == reference_accept) & (~accept | same_top1))
+        # Độ lệch điểm top-1 so với float32 (trên các truy vấn có cùng kết quả top-1)
+        delta = np.abs(scores[:, 0] - reference_scores[:, 0])[same_top1]
+        print(f"{label:<18} {usage['total'] / len(variant):>8.0f} {usage['embeddings'] / len(variant):>10.0f} "
+              f"{usage['ids_names'] / len(variant):>8.0f} {np.mean(same_top1):>7.4f} {recall:>9.4f} "
+              f"{decision:>10.4f} {delta.mean() if len(delta) else 0:>11.5f} {delta.max() if len(delta) else 0:>12.5f} "
+              f"{elapsed_ms:>12.3f}")
+
+
+def detection_report(args):
+    """Đo độ trễ và recall của bước phát hiện ở từng kích thước đầu vào, trong ROI của camera"""
+    import cv2
+    from .config import CAMERA_SOURCES, DETECTION_ROI, DETECTION_SIZES
+    from .detection import detect_in_region, roi_to_pixels
+    from .face_recognition import get_face_analyzer
+    from .tracking import bbox_iou
+
+    source = args.source if args.source is not None else CAMERA_SOURCES[args.camera]
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    roi = DETECTION_ROI.get(args.camera)
+    face_analyzer = get_face_analyzer()
+    sizes = sorted(args.sizes or DETECTION_SIZES)
+    capture = cv2.VideoCapture(source)
+    frames = []
+    frame_index = 0
+    while len(frames) < args.frames:
+        success, frame = capture.read()
+        if not success:
+            break
+        if frame_index % max(1, args.stride) == 0:
+            frames.append(frame)
+        frame_index += 1
+    capture.release()
+    if not frames:
+        print(f"Không đọc được frame nào từ nguồn {source}")
+        return
+
+    # Mốc so sánh: phát hiện trên toàn frame ở kích thước lớn nhất, chỉ tính khuôn mặt có tâm nằm trong ROI
+    reference = []
+    outside_roi = 0
+    for frame in frames:
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = roi_to_pixels(roi, width, height)
+        faces = detect_in_region(face_analyzer, frame, None, args.reference_size)
+        inside = [face for face in faces
+                  if x0 <= (face.bbox[0] + face.bbox[2]) / 2 < x1 and y0 <= (face.bbox[1] + face.bbox[3]) / 2 < y1]
+        outside_roi += len(faces) - len(inside)
+        reference.append(inside)
+    total = sum(len(faces) for faces in reference)
+
+    print(f"Camera '{args.camera}', nguồn {source}, {len(frames)} frame, ROI {roi or 'toàn frame'}")
+    print(f"Mốc: {total} khuôn mặt trong ROI ở kích thước {args.reference_size} (toàn frame), {outside_roi} khuôn mặt ngoài ROI")
+    print(f"{'kích thước':>10} {'ms/frame':>9} {'p95 ms':>8} {'recall':>7}")
+    for size in sizes:
+        latencies = []
+        found = 0
+        for frame, expected in zip(frames, reference):
+            start = time.perf_counter()
+            faces = detect_in_region(face_analyzer, frame, roi, size)
+            latencies.append((time.perf_counter() - start) * 1000)
+            for face in expected:
+                if any(bbox_iou(face.bbox, other.bbox) >= 0.5 for other in faces):
+                    found += 1
+        recall = found / total if total else float('nan')
+        print(f"{size:>10} {np.mean(latencies):>9.2f} {np.percentile(latencies, 95):>8.2f} {recall:>7.3f}")
+
+
+def benchmark(args):
+    """Chạy bộ benchmark offline (không cần camera, GPU hay mô hình) và ghi kết quả ra file JSON"""
+    import json
+    from .benchmark import run_suite, compare_reports, DEFAULT_GALLERY_SIZES, QUICK_GALLERY_SIZES
+
+    sizes = args.sizes or (QUICK_GALLERY_SIZES if args.quick else DEFAULT_GALLERY_SIZES)
+    load_sizes = args.load_sizes or ((10, 1000) if args.quick else (10, 1000, 10000))
+    report = run_suite(sizes, load_sizes, min_seconds=0.2 if args.quick else 0.5, only=args.only)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for result in report["results"]:
+        params = ", ".join(f"{key}={value}" for key, value in result.get("params", {}).items())
+        print(f"{result['name']:<28} {params:<40} {result['value'] * 1000:>12.4f} ms")
+    print(f"Đã ghi kết quả vào {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"So với {args.compare} (tỉ lệ < 1 là nhanh hơn):")
+        for name, params, old, new, ratio in compare_reports(baseline, report):
+            params = ", ".join(f"{key}={value}" for key, value in params.items())
+            print(f"{name:<28} {params:<40} {old * 1000:>10.4f} -> {new * 1000:>10.4f} ms  x{ratio:.2f}")
+
+
+def loadtest(args):
+    """Kiểm thử tải toàn bộ API với nguồn camera giả và in FPS, độ trễ endpoint, độ trễ event loop"""
+    import json
+    from .loadtest import run_load_test
+
+    report = run_load_test(source=args.source, cameras=args.cameras, viewers=args.viewers,
+                           registrations=args.registrations, queries=args.queries, duration=args.duration,
+                           stub=not args.real_model, faces=args.faces, gallery_size=args.gallery_size,
+                           upload_count=args.upload_images, think_seconds=args.think, fps=args.fps,
+                           storage=args.storage)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+
+    print("Người xem video:")
+    for client in report["video_clients"]:
+        gap = client["frame_gap"]
+        print(f"  {client['client']:<28} {client['fps']:>6.2f} FPS  {client['frames']:>6} frame  "
+              f"khoảng cách p95 {gap.get('p95_ms', 0):>8.1f} ms" + (f"  lỗi: {client['error']}" if client["error"] else ""))
+    print("Độ trễ endpoint (ms):")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"  {endpoint:<28} n={stats['n']:<6} p50 {stats['p50_ms']:>8.1f}  p95 {stats['p95_ms']:>8.1f}  "
+              f"p99 {stats['p99_ms']:>8.1f}  {stats['requests_per_second']:>7.2f} req/s  {stats['status']}")
+    lag = report["event_loop_lag"]
+    if lag["n"]:
+        print(f"Độ trễ event loop: p50 {lag['p50_ms']:.1f} ms, p95 {lag['p95_ms']:.1f} ms, "
+              f"p99 {lag['p99_ms']:.1f} ms, lớn nhất {lag['max_ms']:.1f} ms")
+    if report["request_errors"]:
+        print(f"Số yêu cầu lỗi kết nối: {report['request_errors']}")
+    # Với analyzer giả, mọi khuôn mặt đều thuộc gallery: không có bản ghi điểm danh nào nghĩa là nhận diện bị lỗi
+    print(f"Bản ghi điểm danh đã ghi: {report['attendance_writer'].get('events_written', 0)}")
+    print(f"Đã ghi kết quả vào {args.output}")
+
+
+def main(argv=None):
+    """Điểm vào dòng lệnh: python -m app.cli <lệnh>"""
+    parser = argparse.ArgumentParser(description="Công cụ quản trị hệ thống điểm danh")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild-embeddings", help="Tính lại toàn bộ embedding khuôn mặt")
+    rebuild_parser.set_defaults(func=rebuild_embeddings)
+
+    import_parser = subparsers.add_parser("import-dataset", help="Nhập hàng loạt người dùng từ thư mục hoặc file zip")
+    import_parser.add_argument("path", help="Thư mục hoặc file zip chứa các thư mục {user_id}_{name}/*.jpg")
+    import_parser.add_argument("--workers", type=int, default=None, help="Số tiến trình xử lý ảnh")
+    import_parser.add_argument("--batch-size", type=int, default=256, help="Số ảnh mỗi transaction")
+    import_parser.set_defaults(func=import_dataset)
+
+    migrate_parser = subparsers.add_parser("migrate-attendance", help="Nhập các file CSV điểm danh vào SQLite")
+    migrate_parser.set_defaults(func=migrate_attendance)
+
+    summary_parser = subparsers.add_parser("rebuild-summary", help="Tính lại bảng tổng hợp điểm danh theo ngày")
+    summary_parser.set_defaults(func=rebuild_summary)
+
+    ann_parser = subparsers.add_parser("ann-report", help="Đo recall/độ trễ của chỉ mục ANN so với tìm kiếm chính xác")
+    ann_parser.add_argument("--synthetic", type=int, default=0, help="Dùng gallery giả với số người dùng này thay vì CSDL")
+    ann_parser.add_argument("--queries", type=int, default=1000)
+    ann_parser.add_argument("--noise", type=float, default=0.6, help="Độ lớn nhiễu thêm vào truy vấn")
+    ann_parser.add_argument("--n-lists", type=int, default=None)
+    ann_parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    ann_parser.set_defaults(func=ann_report)
+
+    gallery_parser = subparsers.add_parser("gallery-report",
+                                           help="So sánh bộ nhớ/độ chính xác của gallery float16, int8 với float32")
+    gallery_parser.add_argument("--synthetic", type=int, default=0, help="Dùng gallery giả với số người dùng này thay vì CSDL")
+    gallery_parser.add_argument("--queries", type=int, default=1000)
+    gallery_parser.add_argument("--noise", type=float, default=0.6, help="Độ lớn nhiễu thêm vào truy vấn")
+    gallery_parser.add_argument("--rerank", type=int, default=GALLERY_RERANK_CANDIDATES,
+                                help="Số ứng viên chấm lại bằng float32, 0 = không đo chế độ chấm lại")
+    gallery_parser.set_defaults(func=gallery_report)
+
+    detection_parser = subparsers.add_parser("detection-report", help="Đo độ trễ/recall của bước phát hiện theo kích thước đầu vào")
+    detection_parser.add_argument("--camera", default=DEFAULT_CAMERA_ID, help="Tên camera (lấy nguồn và ROI trong cấu hình)")
+    detection_parser.add_argument("--source", default=None, help="Nguồn thay thế: file video, URL hoặc chỉ số thiết bị")
+    detection_parser.add_argument("--frames", type=int, default=200, help="Số frame dùng để đo")
+    detection_parser.add_argument("--stride", type=int, default=1, help="Lấy một frame mỗi N frame của nguồn")
+    detection_parser.add_argument("--sizes", type=int, nargs="+", default=None, help="Các kích thước cần đo (bội số của 32)")
+    detection_parser.add_argument("--reference-size", type=int, default=640, help="Kích thước dùng làm mốc tính recall")
+    detection_parser.set_defaults(func=detection_report)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Chạy bộ benchmark offline và ghi kết quả JSON")
+    benchmark_parser.add_argument("--output", default="benchmark_results.json", help="File kết quả")
+    benchmark_parser.add_argument("--compare", default=None, help="File kết quả của phiên bản trước để so sánh")
+    benchmark_parser.add_argument("--quick", action="store_true", help="Chỉ chạy gallery nhỏ, thời gian đo ngắn")
+    benchmark_parser.add_argument("--sizes", type=int, nargs="+", default=None, help="Kích thước gallery cho phần so khớp")
+    benchmark_parser.add_argument("--load-sizes", type=int, nargs="+", default=None, help="Số người dùng cho phần nạp gallery")
+    benchmark_parser.add_argument("--only", nargs="+", default=None,
+                                  choices=["matcher", "gallery_load", "process_frame", "attendance"])
+    benchmark_parser.set_defaults(func=benchmark)
+
+    loadtest_parser = subparsers.add_parser("loadtest", help="Kiểm thử tải API với nguồn camera giả (chạy offline)")
+    loadtest_parser.add_argument("--source", default=None,
+                                 help="File video hoặc chuỗi ảnh (thư mục, mẫu 'frames/*.jpg') phát lặp lại; mặc định sinh frame giả")
+    loadtest_parser.add_argument("--cameras", type=int, default=1, help="Số camera dùng chung nguồn")
+    loadtest_parser.add_argument("--viewers", type=int, default=1, help="Số người xem /video_feed mỗi camera")
+    loadtest_parser.add_argument("--registrations", type=int, default=0, help="Số client gửi /register_face liên tục")
+    loadtest_parser.add_argument("--queries", type=int, default=1, help="Số client tra cứu điểm danh liên tục")
+    loadtest_parser.add_argument("--duration", type=float, default=30, help="Thời gian đo (giây)")
+    loadtest_parser.add_argument("--think", type=float, default=0.0, help="Thời gian nghỉ giữa hai yêu cầu của một client (giây)")
+    loadtest_parser.add_argument("--fps", type=float, default=None,
+                                 help="FPS của nguồn (0 = không giới hạn), mặc định theo file video hoặc 25")
+    loadtest_parser.add_argument("--faces", type=int, default=1, help="Số khuôn mặt mỗi frame (analyzer giả)")
+    loadtest_parser.add_argument("--gallery-size", type=int, default=1000, help="Số người dùng trong gallery giả")
+    loadtest_parser.add_argument("--upload-images", type=int, default=3, help="Số ảnh mỗi yêu cầu đăng ký")
+    loadtest_parser.add_argument("--real-model", action="store_true",
+                                 help="Dùng mô hình InsightFace thật thay cho analyzer giả (cần file mô hình có sẵn)")
+    loadtest_parser.add_argument("--storage", choices=GALLERY_STORAGE_TYPES, default="float32",
+                                 help="Kiểu lưu trữ gallery (như GALLERY_STORAGE)")
+    loadtest_parser.add_argument("--output", default="loadtest_results.json", help="File kết quả")
+    loadtest_parser.set_defaults(func=loadtest)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
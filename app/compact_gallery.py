@@ -0,0 +1,270 @@
+import sys
+import numpy as np
+from .config import FACE_RECOGNITION_THRESHOLD, GALLERY_STORAGE, GALLERY_RERANK_CANDIDATES
+from .gallery import StringTable, _ranges, l2_normalize
+
+# Số hàng giải lượng tử hóa mỗi lần khi chấm điểm, để giới hạn bộ nhớ tạm (khoảng 32MB float32 với dim 512)
+_SCORE_CHUNK_SIZE = 16384
+
+STORAGE_TYPES = ("float16", "int8")
+
+
+def quantize(matrix, storage, scale=None):
+    """Lượng tử hóa ma trận embedding (đã chuẩn hóa), trả về (codes, scale) với embedding ≈ codes * scale
+
+    int8 dùng một thang đo cho mỗi chiều (max |x| của chiều đó / 127) để các chiều có biên độ nhỏ
+    không mất độ chính xác; float16 không cần thang đo (scale = 1). Chiều có thang đo 0 (gallery rỗng
+    hoặc mọi giá trị bằng 0) được mã hóa thành 0.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if storage == "float16":
+        return matrix.astype(np.float16), np.ones(matrix.shape[1], dtype=np.float32)
+    if storage != "int8":
+        raise ValueError(f"Kiểu lưu trữ không hỗ trợ: {storage}")
+    if scale is None:
+        scale = np.abs(matrix).max(axis=0) / 127 if len(matrix) else np.zeros(matrix.shape[1])
+        scale = scale.astype(np.float32)
+    divisor = np.where(scale > 0, scale, 1)
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    for start in range(0, len(matrix), _SCORE_CHUNK_SIZE):
+        chunk = matrix[start:start + _SCORE_CHUNK_SIZE]
+        codes[start:start + len(chunk)] = np.clip(np.rint(chunk / divisor), -127, 127)
+    return codes, scale
+
+
+def _top_k(scores, k):
+    """Chỉ số k cột điểm cao nhất của mỗi hàng (chưa sắp xếp) và điểm tương ứng"""
+    if k >= scores.shape[1]:
+        indices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    elif k == 1:
+        indices = np.argmax(scores, axis=1)[:, None]
+    else:
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return indices, np.take_along_axis(scores, indices, axis=1)
+
+
+class _DequantizedRows:
+    """Cho IVFIndex.search đọc các hàng ứng viên của gallery lượng tử hóa như một ma trận float32"""
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def __len__(self):
+        return len(self.gallery)
+
+    def __getitem__(self, rows):
+        return self.gallery.codes[rows].astype(np.float32) * self.gallery.scale
+
+
+class CompactGallery:
+    """Gallery lượng tử hóa cho hàng trăm nghìn người dùng, cùng giao diện với FaceGallery
+
+    Embedding lưu trong một mảng float16 hoặc int8 (codes * scale ≈ embedding đã chuẩn hóa); user_id
+    lưu trong StringTable, tên được gộp (mỗi tên khác nhau lưu một lần) và tham chiếu bằng name_ids.
+    keys/infos chỉ được tạo khi cần (xây chỉ mục ANN, công bố gallery dùng chung).
+
+    exact là ma trận float32 gốc nếu có (thường là file gallery dùng chung đã memory-map, chỉ những
+    trang chứa ứng viên được đọc): rerank ứng viên tốt nhất theo điểm lượng tử hóa được chấm lại
+    chính xác trên ma trận này.
+    """
+
+    def __init__(self, codes, scale, user_ids, names, name_ids, exact=None, rerank=GALLERY_RERANK_CANDIDATES):
+        self.codes = codes
+        self.scale = scale
+        self.user_ids = user_ids
+        self.names = names
+        self.name_ids = name_ids
+        self.exact = exact
+        self.rerank = rerank
+        self.dim = codes.shape[1]
+        # Chỉ mục ANN tùy chọn (xem ann_index.py); None = quét toàn bộ
+        self.index = None
+
+    @property
+    def storage(self):
+        return "float16" if self.codes.dtype == np.float16 else "int8"
+
+    @classmethod
+    def from_gallery(cls, gallery, storage=GALLERY_STORAGE, exact=None, rerank=GALLERY_RERANK_CANDIDATES):
+        """Lượng tử hóa một FaceGallery (giữ nguyên chỉ mục ANN đã gắn)"""
+        if isinstance(gallery, CompactGallery) and gallery.storage == storage:
+            return gallery
+        codes, scale = quantize(gallery.matrix, storage)
+        position = {}
+        name_ids = np.fromiter((position.setdefault(info["name"], len(position)) for info in gallery.infos),
+                               dtype=np.int32, count=len(gallery))
+        new = cls(codes, scale, StringTable(info["user_id"] for info in gallery.infos), StringTable(position),
+                  name_ids, exact, rerank)
+        new.index = gallery.index
+        return new
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def matrix(self):
+        """Ma trận float32 (bản chính xác nếu có, nếu không thì giải lượng tử hóa toàn bộ, chỉ dùng khi
+        xây chỉ mục ANN hoặc công bố gallery dùng chung)"""
+        if self.exact is not None:
+            return self.exact
+        return _DequantizedRows(self)[slice(None)]
+
+    @property
+    def keys(self):
+        return [f"{user_id}_{self.names[name_id]}" for user_id, name_id in zip(self.user_ids, self.name_ids)]
+
+    def key_table(self):
+        """keys (f"{user_id}_{name}") dưới dạng StringTable, ghép trực tiếp trên mảng byte không giải mã từng chuỗi"""
+        id_lengths = np.diff(self.user_ids.offsets)
+        name_starts = self.names.offsets[self.name_ids]
+        name_lengths = self.names.offsets[self.name_ids + 1] - name_starts
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(id_lengths + 1 + name_lengths, out=offsets[1:])
+        data = np.empty(offsets[-1], dtype=np.uint8)
+        data[_ranges(offsets[:-1], id_lengths)] = self.user_ids.data
+        data[offsets[:-1] + id_lengths] = ord("_")
+        data[_ranges(offsets[:-1] + id_lengths + 1, name_lengths)] = self.names.data[_ranges(name_starts, name_lengths)]
+        return StringTable.from_arrays(data, offsets)
+
+    @property
+    def infos(self):
+        return [self.info(i) for i in range(len(self))]
+
+    def info(self, i):
+        return {"name": self.names[self.name_ids[i]], "user_id": self.user_ids[i]}
+
+    def _scan(self, queries, k):
+        """Quét toàn bộ theo từng khối: giải lượng tử hóa khối, nhân ma trận, gộp top-k"""
+        scaled = queries * self.scale
+        best_indices = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self), _SCORE_CHUNK_SIZE):
+            scores = scaled @ self.codes[start:start + _SCORE_CHUNK_SIZE].astype(np.float32).T
+            indices, scores = _top_k(scores, k)
+            best_indices = np.concatenate([best_indices, indices + start], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_indices.shape[1] > k:
+                keep, best_scores = _top_k(best_scores, k)
+                best_indices = np.take_along_axis(best_indices, keep, axis=1)
+        return best_indices, best_scores
+
+    def match(self, embeddings, top_k=1):
+        """So khớp như FaceGallery.match, trên dữ liệu lượng tử hóa (chấm lại bằng float32 nếu có exact)"""
+        queries = l2_normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        if len(self) == 0 or len(queries) == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        k = min(top_k, len(self))
+        rerank = self.exact is not None and self.rerank > 0
+        candidates = min(max(k, self.rerank), len(self)) if rerank else k
+        if self.index is not None:
+            indices, scores = self.index.search(_DequantizedRows(self), queries, candidates)
+        else:
+            indices, scores = self._scan(queries, candidates)
+        if rerank:
+            scores = np.einsum("qcd,qd->qc", self.exact[indices], queries)
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def recognize(self, embeddings, threshold=FACE_RECOGNITION_THRESHOLD):
+        """Nhận diện nhiều khuôn mặt, trả về danh sách (match_info, similarity) như FaceGallery.recognize"""
+        indices, scores = self.match(embeddings, top_k=1)
+        results = []
+        for row_indices, row_scores in zip(indices, scores):
+            if len(row_indices) == 0:
+                results.append((None, -1))
+                continue
+            similarity = row_scores[0]
+            match_info = self.info(row_indices[0]) if similarity > threshold else None
+            results.append((match_info, similarity))
+        return results
+
+    def _replace(self, **changes):
+        fields = dict(codes=self.codes, scale=self.scale, user_ids=self.user_ids, names=self.names,
+                      name_ids=self.name_ids, exact=self.exact, rerank=self.rerank)
+        fields.update(changes)
+        index = fields.pop("index", self.index)
+        new = CompactGallery(**fields)
+        new.index = index
+        return new
+
+    def with_index(self, index):
+        """Trả về gallery dùng chung dữ liệu nhưng với chỉ mục ANN khác (None để quét toàn bộ)"""
+        return self._replace(index=index)
+
+    def with_user(self, key, info, embedding):
+        """Trả về gallery mới đã thay thế mọi mục của info["user_id"] bằng embedding mới
+
+        key luôn là f"{user_id}_{name}" nên không cần lưu riêng. Với int8, nếu embedding mới vượt thang
+        đo của một chiều thì thang đo được nới ra và toàn bộ gallery được lượng tử hóa lại.
+        """
+        gallery = self.without_user(info["user_id"])
+        row = l2_normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+        codes, scale = gallery.codes, gallery.scale
+        if self.storage == "int8" and np.any(np.abs(row[0]) > scale * 127):
+            scale = np.maximum(scale, np.abs(row[0]) / 127).astype(np.float32)
+            codes, _ = quantize(_DequantizedRows(gallery)[slice(None)], "int8", scale)
+        row_codes, _ = quantize(row, self.storage, scale)
+
+        names, name_ids = gallery.names, gallery.name_ids
+        found = names.find(info["name"])
+        if len(found):
+            name_id = found[0]
+        else:
+            name_id = len(names)
+            names = names.appended(info["name"])
+        return gallery._replace(
+            codes=np.concatenate([codes, row_codes]), scale=scale,
+            user_ids=gallery.user_ids.appended(info["user_id"]), names=names,
+            name_ids=np.append(name_ids, np.int32(name_id)),
+            exact=np.concatenate([gallery.exact, row]) if gallery.exact is not None else None,
+            index=gallery.index.appended(row) if gallery.index is not None else None)
+
+    def without_user(self, user_id):
+        """Trả về gallery mới không còn các mục của user_id"""
+        removed = self.user_ids.find(user_id)
+        if len(removed) == 0:
+            return self
+        keep = np.setdiff1d(np.arange(len(self)), removed)
+        return self._replace(
+            codes=self.codes[keep], user_ids=self.user_ids.take(keep), name_ids=self.name_ids[keep],
+            exact=np.ascontiguousarray(self.exact[keep]) if self.exact is not None else None,
+            index=self.index.subset(keep) if self.index is not None else None)
+
+    def memory_usage(self):
+        """Số byte trong bộ nhớ tiến trình (không tính exact: nằm trong page cache dùng chung)"""
+        usage = {
+            "embeddings": self.codes.nbytes + self.scale.nbytes,
+            "ids_names": self.user_ids.nbytes + self.names.nbytes + self.name_ids.nbytes,
+            "index": self.index.assignments.nbytes + self.index.centroids.nbytes if self.index is not None else 0
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
+
+def gallery_memory_usage(gallery):
+    """Số byte của một gallery (FaceGallery hoặc CompactGallery), chia theo thành phần
+
+    Với FaceGallery tính cả các đối tượng Python của keys/infos (list, dict, str); mỗi đối tượng chỉ đếm một lần.
+    """
+    if isinstance(gallery, CompactGallery):
+        return gallery.memory_usage()
+    seen = set()
+
+    def size(obj):
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        return sys.getsizeof(obj)
+
+    ids_names = size(gallery.keys) + size(gallery.infos) + sum(size(key) for key in gallery.keys)
+    for info in gallery.infos:
+        ids_names += size(info) + sum(size(value) for value in info.values())
+    usage = {
+        "embeddings": gallery.matrix.nbytes,
+        "ids_names": ids_names,
+        "index": gallery.index.assignments.nbytes + gallery.index.centroids.nbytes if gallery.index is not None else 0
+    }
+    usage["total"] = sum(usage.values())
+    return usage
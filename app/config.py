@@ -3,11 +3,119 @@ import os
 # Thiết lập tham số 
 FACE_RECOGNITION_THRESHOLD = 0.5
 ATTENDANCE_INTERVAL_MINUTES = 5
+ATTENDANCE_FLUSH_INTERVAL_SECONDS = 1.0  # Chu kỳ ghi dồn các bản ghi điểm danh xuống CSV/SQLite
+ATTENDANCE_FLUSH_MAX_BATCH = 500         # Số bản ghi tối đa mỗi lần ghi
+EXPORT_PAGE_SIZE = 5000                  # Số bản ghi đọc từ SQLite mỗi lần khi xuất dữ liệu
+EXPORT_CHUNK_BYTES = 64 * 1024           # Kích thước mỗi khối dữ liệu gửi về khi xuất
+
+# Cấu hình mô hình nhận diện (đổi tên model sẽ làm mất hiệu lực cache embedding)
+FACE_MODEL_NAME = "buffalo_l"
+FACE_MODEL_MODULES = ['detection', 'recognition']  # Chỉ tải các module cần dùng (bỏ genderage, landmark 2D/3D)
+MODEL_WARMUP = True  # Chạy thử mô hình khi khởi động để lần nhận diện đầu tiên không bị chậm
+
+# Cấu hình chỉ mục ANN (IVF) cho gallery lớn
+ANN_ENABLED = True
+ANN_MIN_GALLERY_SIZE = 50000  # Dùng ANN khi gallery có từ chừng này người trở lên, nhỏ hơn thì quét toàn bộ
+ANN_N_LISTS = None            # Số cụm k-means, None = tự chọn theo kích thước gallery (~4*sqrt(N))
+ANN_N_PROBE = 16              # Số cụm được quét cho mỗi truy vấn (tăng để tăng recall, giảm để nhanh hơn)
+ANN_TRAIN_ITERATIONS = 10
+ANN_TRAIN_SAMPLE_SIZE = 100000
+ANN_INDEX_SAVE_DELAY_SECONDS = 30  # Gộp các lần ghi chỉ mục ra đĩa sau đăng ký/xóa người dùng (ghi nốt khi tắt)
+
+# Lưu trữ gallery gọn cho gallery rất lớn: "float32" (mặc định, chính xác), "float16" (1/2 bộ nhớ embedding)
+# hoặc "int8" (1/4, mỗi chiều có thang đo riêng); user_id/tên lưu trong mảng byte thay vì dict cho mỗi người
+GALLERY_STORAGE_TYPES = ("float32", "float16", "int8")
+GALLERY_STORAGE = os.environ.get("GALLERY_STORAGE", "float32").strip().lower()
+if GALLERY_STORAGE not in GALLERY_STORAGE_TYPES:
+    raise ValueError(f"GALLERY_STORAGE không hợp lệ: {GALLERY_STORAGE!r} (chọn một trong {', '.join(GALLERY_STORAGE_TYPES)})")
+GALLERY_RERANK_CANDIDATES = 32  # Số ứng viên chấm lại bằng float32 chính xác (cần gallery dùng chung đã memory-map), 0 = tắt
+
+# Cấu hình camera: tên camera -> nguồn (chỉ số thiết bị, URL RTSP/HTTP, đường dẫn file video hoặc chuỗi ảnh)
+# Có thể ghi đè bằng biến môi trường, ví dụ: CAMERA_SOURCES="cong_chinh=0,sanh=rtsp://10.0.0.5/stream,thu=./samples/lobby.mp4"
+DEFAULT_CAMERA_ID = "default"
+CAMERA_SOURCES = {DEFAULT_CAMERA_ID: 0}
+if os.environ.get("CAMERA_SOURCES"):
+    CAMERA_SOURCES = {}
+    for item in os.environ["CAMERA_SOURCES"].split(","):
+        camera_id, _, source = item.partition("=")
+        CAMERA_SOURCES[camera_id.strip()] = int(source) if source.strip().isdigit() else source.strip()
+    DEFAULT_CAMERA_ID = next(iter(CAMERA_SOURCES))
+LOOP_VIDEO_FILES = True  # Phát lại file video từ đầu khi hết (dùng file video thay camera khi kiểm thử)
+# Nguồn là file video hoặc chuỗi ảnh (thư mục hay mẫu dạng "frames/*.jpg") được phát đúng tốc độ như camera thật:
+# None = theo FPS ghi trong file video (chuỗi ảnh: 25 FPS), 0 = đọc nhanh nhất có thể
+FILE_SOURCE_FPS = None
+CAMERA_STALE_SECONDS = 5  # Camera bị coi là không khỏe nếu quá thời gian này không có frame mới
+
+# Số phiên mô hình dùng chung cho các camera, None = min(số nhân CPU, số camera)
+MODEL_POOL_SIZE = None
+
+# Cấu hình theo dõi khuôn mặt (tracking) trong stream
+TRACKING_ENABLED = True
+TRACK_DETECT_INTERVAL = 5      # Chạy phát hiện khuôn mặt mỗi N frame
+TRACK_REVERIFY_INTERVAL = 90   # Nhận diện lại một track sau chừng này frame
+TRACK_IOU_THRESHOLD = 0.3      # IoU tối thiểu để ghép khuôn mặt với track
+TRACK_MAX_MISSED = 2           # Số lần phát hiện liên tiếp không thấy trước khi xóa track
+
+# Cấu hình lọc chuyển động: bỏ qua nhận diện khi khung hình gần như không đổi
+MOTION_GATING_ENABLED = True
+MOTION_DOWNSCALE_WIDTH = 160        # Chiều rộng ảnh thu nhỏ dùng để so sánh
+MOTION_PIXEL_THRESHOLD = 25         # Chênh lệch mức xám tối thiểu để coi một điểm ảnh là thay đổi
+MOTION_MIN_CHANGED_RATIO = 0.002    # Độ nhạy: tỉ lệ điểm ảnh thay đổi tối thiểu để chạy nhận diện
+MOTION_FORCE_DETECT_INTERVAL = 30   # Bắt buộc nhận diện lại sau chừng này frame liên tiếp bị bỏ qua
+MOTION_ROI = {}                     # Vùng theo dõi cho từng camera: camera_id -> (left, top, right, bottom) theo tỉ lệ 0..1
+
+# Cấu hình phát hiện khuôn mặt theo từng camera
+DETECTION_ROI = {}                  # Vùng phát hiện: camera_id -> (left, top, right, bottom) theo tỉ lệ 0..1, thiếu = toàn frame
+DETECTION_MODE = {}                 # camera_id -> "adaptive" hoặc kích thước cố định (vd 480), thiếu = DETECTION_DEFAULT_MODE
+DETECTION_DEFAULT_MODE = "adaptive"
+DETECTION_SIZES = (320, 480, 640)   # Các kích thước đầu vào detector được chọn ở chế độ thích ứng (bội số của 32)
+DETECTION_SMALL_FACE_PX = 32        # Khuôn mặt nhỏ hơn (trong ảnh đầu vào detector) thì tăng kích thước
+DETECTION_LARGE_FACE_PX = 96        # Khuôn mặt lớn hơn thì có thể giảm kích thước
+DETECTION_STEP_DOWN_AFTER = 5       # Số lần phát hiện liên tiếp thấy khuôn mặt lớn trước khi giảm kích thước
+
+# Cấu hình trích xuất embedding theo lô
+EMBED_BATCH_SIZE = 32                # Số khuôn mặt tối đa mỗi lần chạy mô hình nhận diện
+EMBED_CROSS_CAMERA_BATCHING = len(CAMERA_SOURCES) > 1  # Gộp khuôn mặt của nhiều camera vào cùng một lô
+EMBED_MAX_WAIT_MS = 5                # Thời gian tối đa chờ thêm khuôn mặt từ camera khác trước khi chạy lô
+EMBED_RESULT_TIMEOUT_SECONDS = 10    # Thời gian tối đa một camera chờ kết quả của lô trước khi báo lỗi
+
+# Cấu hình đăng ký khuôn mặt
+REGISTRATION_WORKERS = 4            # Số luồng xử lý ảnh đăng ký (giải mã, nhận diện, ghi file)
+MAX_CONCURRENT_REGISTRATIONS = 2    # Số yêu cầu đăng ký được xử lý cùng lúc, các yêu cầu khác phải chờ
+
+# Cấu hình nhập hàng loạt
+BULK_IMPORT_WORKERS = None      # Số tiến trình xử lý ảnh, None = số nhân CPU
+BULK_IMPORT_BATCH_SIZE = 256    # Số ảnh ghi vào SQLite trong mỗi transaction
+
+# Cấu hình pipeline stream video
+STREAM_QUEUE_SIZE = 1  # Số frame tối đa chờ giữa các giai đoạn (1 = chỉ giữ frame mới nhất)
+RESULT_HISTORY_SIZE = 100       # Số frame kết quả gần nhất giữ lại cho client nhận sự kiện (/events)
+EVENT_POLL_INTERVAL_SECONDS = 0.05
+EVENT_HEARTBEAT_SECONDS = 15    # Gửi dòng giữ kết nối SSE khi không có sự kiện
+
+# Profiler lấy mẫu (bật/tắt qua /debug/profiler)
+PROFILER_INTERVAL_MS = 10    # Chu kỳ lấy mẫu call stack
+PROFILER_MAX_SECONDS = 300   # Tự tắt sau chừng này giây
+
+# Gallery dùng chung giữa các worker (uvicorn main:app --workers N): ma trận embedding nằm trong file được
+# memory-map chỉ đọc nên bộ nhớ không tăng theo số worker; đăng ký ở worker nào cũng tạo phiên bản mới cho mọi worker.
+# Tự bật khi WEB_CONCURRENCY > 1 (uvicorn đọc biến này làm số worker) hoặc SHARED_GALLERY=1
+SHARED_GALLERY_ENABLED = os.environ.get("SHARED_GALLERY") == "1" or int(os.environ.get("WEB_CONCURRENCY", "1")) > 1
+SHARED_GALLERY_DIR = "shared_gallery"
+SHARED_GALLERY_POLL_SECONDS = 1.0  # Chu kỳ kiểm tra phiên bản mới = độ trễ tối đa để worker khác thấy thay đổi
+SHARED_GALLERY_KEEP_VERSIONS = 3   # Số phiên bản cũ giữ lại trên đĩa cho worker chưa kịp chuyển
 
 # Cấu hình đường dẫn
 DB_PATH = "attendance.db"
 DATASET_DIR = "./dataset"
 ATTENDANCE_DIR = "./attendance_logs"
+ANN_INDEX_PATH = "ann_index.npz"
+MODEL_PROVIDER_CACHE_PATH = "model_provider.json"  # Ghi nhớ provider đã chọn để lần sau không phải thử lại
+
+# Tinh chỉnh SQLite
+DB_BUSY_TIMEOUT_MS = 5000           # Thời gian chờ khóa trước khi báo lỗi "database is locked"
+DB_CACHE_SIZE_KB = 20000            # Bộ nhớ đệm trang cho mỗi kết nối
+DB_MMAP_SIZE = 256 * 1024 * 1024    # Đọc file CSDL qua memory-map
 
 # Tạo thư mục nếu chưa tồn tại
 os.makedirs(DATASET_DIR, exist_ok=True)
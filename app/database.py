@@ -1,124 +1,425 @@
 import sqlite3
 import os
-from .config import DB_PATH
+import threading
+from contextlib import contextmanager
+from .config import DB_PATH, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE
 from datetime import datetime
 
+# Mỗi luồng giữ một kết nối SQLite riêng, mở một lần và dùng lại
+_local = threading.local()
+
+def _open_connection():
+    """Mở kết nối mới với các pragma đã tinh chỉnh"""
+    # isolation_level=None: tự quản lý transaction bằng transaction(), câu lệnh đơn lẻ được tự commit
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    # WAL cho phép nhiều luồng đọc (/users, /attendance) song song với luồng ghi (camera)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def get_connection():
+    """Lấy kết nối SQLite của luồng hiện tại, mở nếu chưa có"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.depth = 0
+    return conn
+
+def close_connection():
+    """Đóng kết nối của luồng hiện tại (nếu có)"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaction():
+    """Gom các câu lệnh trong khối with vào một transaction, rollback nếu có lỗi
+    
+    Có thể lồng nhau: khối trong tham gia transaction của khối ngoài.
+    """
+    conn = get_connection()
+    outermost = _local.depth == 0
+    if outermost:
+        conn.execute("BEGIN IMMEDIATE")
+    _local.depth += 1
+    try:
+        yield conn.cursor()
+    except BaseException:
+        _local.depth -= 1
+        if outermost:
+            conn.rollback()
+        raise
+    _local.depth -= 1
+    if outermost:
+        conn.commit()
+
+def execute(query, params=()):
+    """Chạy một câu lệnh (tự commit nếu không nằm trong transaction), trả về cursor"""
+    return get_connection().execute(query, params)
+
+def executemany(query, rows):
+    """Chạy một câu lệnh cho nhiều dòng trong cùng một transaction"""
+    rows = list(rows)
+    if not rows:
+        return
+    with transaction() as cursor:
+        cursor.executemany(query, rows)
+
+def fetchone(query, params=()):
+    return execute(query, params).fetchone()
+
+def fetchall(query, params=()):
+    return execute(query, params).fetchall()
+
 def setup_database():
     """Thiết lập cơ sở dữ liệu"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with transaction() as cursor:
+        # Tạo bảng users với id dạng UUID string
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
     
-    # Tạo bảng users với id dạng UUID string
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
+        # Tạo bảng face_images
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
     
-    # Tạo bảng face_images
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS face_images (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        image_path TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
+        # Tạo bảng cache embedding cho từng ảnh khuôn mặt
+        # embedding = NULL nghĩa là ảnh đã được xử lý nhưng không tìm thấy khuôn mặt
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_embeddings (
+            image_path TEXT PRIMARY KEY,
+            model_name TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            embedding BLOB,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
     
-    # Thêm bảng để lưu trạng thái điểm danh gần nhất
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS attendance_status (
-        user_id TEXT PRIMARY KEY,
-        last_event TEXT NOT NULL,
-        last_time TIMESTAMP NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
+        # Thêm bảng để lưu trạng thái điểm danh gần nhất
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_status (
+            user_id TEXT PRIMARY KEY,
+            last_event TEXT NOT NULL,
+            last_time TIMESTAMP NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
+    
+        # Bảng sự kiện điểm danh (nguồn chính cho truy vấn theo khoảng ngày / theo người dùng)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            event TEXT NOT NULL,
+            camera_id TEXT NOT NULL DEFAULT ''
+        )
+        ''')
+        # Chỉ mục (date, time) cũng chống trùng khi nhập lại file CSV cũ
+        cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_events_date_time
+        ON attendance_events (date, time, user_id, event, camera_id)
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_events_user_time
+        ON attendance_events (user_id, date, time)
+        ''')
+    
+        # Tổng hợp điểm danh theo người dùng/ngày, được trigger cập nhật mỗi khi có sự kiện mới
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_daily_summary (
+            date TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            sightings INTEGER NOT NULL,
+            PRIMARY KEY (date, user_id)
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_daily_summary_user
+        ON attendance_daily_summary (user_id, date)
+        ''')
+        # Trigger chỉ chạy với bản ghi thực sự được thêm (bản ghi trùng bị INSERT OR IGNORE bỏ qua)
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_attendance_events_summary
+        AFTER INSERT ON attendance_events
+        BEGIN
+            INSERT INTO attendance_daily_summary (date, user_id, name, first_seen, last_seen, sightings)
+            VALUES (NEW.date, NEW.user_id, NEW.name, NEW.time, NEW.time, 1)
+            ON CONFLICT (date, user_id) DO UPDATE SET
+                name = CASE WHEN excluded.last_seen >= last_seen THEN excluded.name ELSE name END,
+                first_seen = MIN(first_seen, excluded.first_seen),
+                last_seen = MAX(last_seen, excluded.last_seen),
+                sightings = sightings + 1;
+        END
+        ''')
+        # CSDL cũ đã có sự kiện nhưng chưa có bảng tổng hợp: tính một lần
+        if (cursor.execute("SELECT 1 FROM attendance_daily_summary LIMIT 1").fetchone() is None
+                and cursor.execute("SELECT 1 FROM attendance_events LIMIT 1").fetchone() is not None):
+            rebuild_attendance_summary()
     
-    conn.commit()
-    conn.close()
+        # Bộ đếm thay đổi dữ liệu gallery (người dùng, ảnh, embedding), tăng qua trigger; gallery dùng chung
+        # giữa các worker ghi lại giá trị này để biết khi khởi động có cần tính lại từ CSDL hay không
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gallery_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO gallery_generation (id, generation) VALUES (1, 0)")
+        for table in ("users", "face_images", "face_embeddings"):
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_gallery_generation
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE gallery_generation SET generation = generation + 1 WHERE id = 1;
+                END
+                ''')
+    
+        # Ghi nhận các file CSV điểm danh đã nhập vào attendance_events
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_csv_imports (
+            file_name TEXT PRIMARY KEY,
+            file_size INTEGER NOT NULL,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+def get_gallery_generation():
+    """Bộ đếm thay đổi của users/face_images/face_embeddings (tăng mỗi khi dữ liệu gallery trong CSDL đổi)"""
+    row = fetchone("SELECT generation FROM gallery_generation WHERE id = 1")
+    return row[0] if row else 0
 
 def check_user_exists(user_id):
     """Kiểm tra user_id đã tồn tại chưa"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return fetchone("SELECT id FROM users WHERE id = ?", (user_id,)) is not None
 
 def add_user(user_id, name):
     """Thêm người dùng mới"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO users (id, name) VALUES (?, ?)",
-        (user_id, name)
-    )
-    conn.commit()
-    conn.close()
+    execute("INSERT INTO users (id, name) VALUES (?, ?)", (user_id, name))
 
 def add_face_image(user_id, image_path):
     """Lưu đường dẫn ảnh vào database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO face_images (user_id, image_path) VALUES (?, ?)",
-        (user_id, image_path)
-    )
-    conn.commit()
-    conn.close()
+    execute("INSERT INTO face_images (user_id, image_path) VALUES (?, ?)", (user_id, image_path))
+
+def add_face_images(rows):
+    """Lưu nhiều đường dẫn ảnh (danh sách (user_id, image_path)) trong một transaction"""
+    executemany("INSERT INTO face_images (user_id, image_path) VALUES (?, ?)", rows)
+
+def get_user(user_id):
+    """Lấy thông tin một người dùng, None nếu không tồn tại"""
+    row = fetchone("SELECT id, name FROM users WHERE id = ?", (user_id,))
+    return {"id": row[0], "name": row[1]} if row else None
+
+def delete_user(user_id):
+    """Xóa người dùng cùng ảnh khuôn mặt và cache embedding, trả về danh sách ảnh đã xóa"""
+    with transaction() as cursor:
+        cursor.execute("SELECT image_path FROM face_images WHERE user_id = ?", (user_id,))
+        image_paths = [row[0] for row in cursor.fetchall()]
+        cursor.executemany("DELETE FROM face_embeddings WHERE image_path = ?", [(path,) for path in image_paths])
+        cursor.execute("DELETE FROM face_images WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM attendance_status WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    return image_paths
+
+def add_enrollment_batch(users, face_images, embeddings):
+    """Ghi một lô người dùng, ảnh khuôn mặt và embedding trong cùng một transaction
+    
+    users: danh sách (user_id, name), người dùng đã tồn tại được bỏ qua
+    face_images: danh sách (user_id, image_path)
+    embeddings: danh sách (image_path, model_name, content_hash, embedding_bytes hoặc None)
+    """
+    with transaction() as cursor:
+        cursor.executemany("INSERT OR IGNORE INTO users (id, name) VALUES (?, ?)", users)
+        cursor.executemany("INSERT INTO face_images (user_id, image_path) VALUES (?, ?)", face_images)
+        cursor.executemany("""
+        INSERT OR REPLACE INTO face_embeddings (image_path, model_name, content_hash, embedding, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, embeddings)
+
+def get_processed_image_paths():
+    """Lấy tập đường dẫn ảnh đã có trong face_images hoặc đã có embedding trong cache"""
+    rows = fetchall("SELECT image_path FROM face_images UNION SELECT image_path FROM face_embeddings")
+    return {row[0] for row in rows}
 
 def get_all_users():
     """Lấy danh sách tất cả người dùng"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM users")
-    users = [{"id": row[0], "name": row[1]} for row in cursor.fetchall()]
-    conn.close()
-    return users
+    return [{"id": row[0], "name": row[1]} for row in fetchall("SELECT id, name FROM users")]
 
 def get_user_face_images(user_id):
     """Lấy danh sách ảnh khuôn mặt của người dùng"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT image_path FROM face_images WHERE user_id = ?", (user_id,))
-    face_images = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return face_images
+    return [row[0] for row in fetchall("SELECT image_path FROM face_images WHERE user_id = ?", (user_id,))]
 
 def get_user_face_data():
     """Lấy thông tin người dùng và đường dẫn ảnh khuôn mặt"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
+    return fetchall('''
     SELECT u.id, u.name, f.image_path 
     FROM users u
     JOIN face_images f ON u.id = f.user_id
     ''')
-    results = cursor.fetchall()
-    conn.close()
-    return results
+
+def get_face_embedding_cache():
+    """Lấy cache embedding theo đường dẫn ảnh"""
+    rows = fetchall("SELECT image_path, model_name, content_hash, embedding FROM face_embeddings")
+    return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+def save_face_embeddings(rows):
+    """Lưu nhiều embedding vào cache trong một transaction
+    
+    rows: danh sách (image_path, model_name, content_hash, embedding_bytes hoặc None)
+    """
+    executemany("""
+    INSERT OR REPLACE INTO face_embeddings (image_path, model_name, content_hash, embedding, updated_at)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, rows)
+
+def get_user_face_embeddings(user_id, model_name):
+    """Lấy các embedding đã cache của một người dùng với model chỉ định"""
+    rows = fetchall("""
+    SELECT e.embedding
+    FROM face_images f
+    JOIN face_embeddings e ON e.image_path = f.image_path
+    WHERE f.user_id = ? AND e.model_name = ? AND e.embedding IS NOT NULL
+    """, (user_id, model_name))
+    return [row[0] for row in rows]
+
+def clear_face_embeddings():
+    """Xóa toàn bộ cache embedding"""
+    execute("DELETE FROM face_embeddings")
 
 def get_last_attendance_status(user_id):
     """Lấy trạng thái điểm danh gần nhất của người dùng"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT last_event, last_time FROM attendance_status WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result  # Trả về (last_event, last_time) hoặc None nếu chưa có
+    # Trả về (last_event, last_time) hoặc None nếu chưa có
+    return fetchone("SELECT last_event, last_time FROM attendance_status WHERE user_id = ?", (user_id,))
 
 def update_attendance_status(user_id, event, timestamp):
     """Cập nhật trạng thái điểm danh gần nhất"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+    execute("""
     INSERT OR REPLACE INTO attendance_status (user_id, last_event, last_time)
     VALUES (?, ?, ?)
     """, (user_id, event, timestamp))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+
+def write_attendance_batch(events, statuses):
+    """Ghi sự kiện điểm danh và trạng thái gần nhất trong một transaction
+    
+    events: danh sách (user_id, name, date, time, event, camera_id)
+    statuses: danh sách (user_id, event, timestamp)
+    """
+    with transaction() as cursor:
+        cursor.executemany("""
+        INSERT OR IGNORE INTO attendance_events (user_id, name, date, time, event, camera_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, events)
+        cursor.executemany("""
+        INSERT OR REPLACE INTO attendance_status (user_id, last_event, last_time)
+        VALUES (?, ?, ?)
+        """, statuses)
+
+def get_attendance_events(start_date=None, end_date=None, user_id=None, after=None, limit=None):
+    """Truy vấn sự kiện điểm danh theo khoảng ngày và/hoặc người dùng, sắp xếp theo (date, time, id)
+    
+    after: khóa (date, time, id) của bản ghi cuối trang trước (phân trang keyset).
+    Trả về danh sách (id, user_id, name, date, time, event, camera_id).
+    """
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= ?")
+        params.append(end_date)
+    if user_id:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if after:
+        conditions.append("(date, time, id) > (?, ?, ?)")
+        params.extend(after)
+    query = "SELECT id, user_id, name, date, time, event, camera_id FROM attendance_events"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY date, time, id"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return fetchall(query, params)
+
+def rebuild_attendance_summary():
+    """Tính lại toàn bộ bảng tổng hợp theo ngày từ attendance_events, trả về số dòng tổng hợp"""
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM attendance_daily_summary")
+        # name lấy theo sự kiện mới nhất trong ngày
+        cursor.execute("""
+        INSERT INTO attendance_daily_summary (date, user_id, name, first_seen, last_seen, sightings)
+        SELECT date, user_id,
+               (SELECT e.name FROM attendance_events e
+                WHERE e.user_id = a.user_id AND e.date = a.date
+                ORDER BY e.time DESC, e.id DESC LIMIT 1),
+               MIN(time), MAX(time), COUNT(*)
+        FROM attendance_events a
+        GROUP BY date, user_id
+        """)
+        return cursor.execute("SELECT COUNT(*) FROM attendance_daily_summary").fetchone()[0]
+
+def get_attendance_summary(start_date=None, end_date=None, user_id=None):
+    """Đọc bảng tổng hợp theo khoảng ngày và/hoặc người dùng
+    
+    Trả về danh sách (date, user_id, name, first_seen, last_seen, sightings) sắp xếp theo (date, user_id).
+    """
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= ?")
+        params.append(end_date)
+    if user_id:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    query = "SELECT date, user_id, name, first_seen, last_seen, sightings FROM attendance_daily_summary"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY date, user_id"
+    return fetchall(query, params)
+
+def get_imported_attendance_files():
+    """Lấy {tên file: kích thước} của các file CSV đã nhập"""
+    return {row[0]: row[1] for row in fetchall("SELECT file_name, file_size FROM attendance_csv_imports")}
+
+def import_attendance_events(file_name, file_size, events):
+    """Nhập các sự kiện từ một file CSV (bỏ qua bản ghi trùng) và ghi nhận file đã nhập, trả về số bản ghi mới"""
+    with transaction() as cursor:
+        cursor.executemany("""
+        INSERT OR IGNORE INTO attendance_events (user_id, name, date, time, event, camera_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, events)
+        # rowcount chỉ đếm dòng của chính câu INSERT (total_changes còn cộng cả dòng do trigger tổng hợp ghi)
+        inserted = max(cursor.rowcount, 0)
+        cursor.execute("""
+        INSERT OR REPLACE INTO attendance_csv_imports (file_name, file_size, imported_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        """, (file_name, file_size))
+    return inserted
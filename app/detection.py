@@ -0,0 +1,103 @@
+import time
+import numpy as np
+from .config import (DETECTION_SIZES, DETECTION_SMALL_FACE_PX, DETECTION_LARGE_FACE_PX, DETECTION_STEP_DOWN_AFTER)
+
+
+def roi_to_pixels(roi, width, height):
+    """Đổi ROI (left, top, right, bottom) theo tỉ lệ 0..1 thành tọa độ điểm ảnh, None = toàn frame"""
+    if roi is None:
+        return 0, 0, width, height
+    left, top, right, bottom = roi
+    return int(left * width), int(top * height), int(right * width), int(bottom * height)
+
+
+def detect_in_region(analyzer, frame, roi=None, det_size=None):
+    """Phát hiện khuôn mặt trong vùng ROI với kích thước đầu vào det_size
+
+    Bbox và keypoint được đổi về tọa độ của frame gốc để vẽ, theo dõi và căn chỉnh khuôn mặt.
+    """
+    from insightface.app.common import Face
+    
+    height, width = frame.shape[:2]
+    x0, y0, x1, y1 = roi_to_pixels(roi, width, height)
+    region = frame[y0:y1, x0:x1]
+    input_size = (det_size, det_size) if det_size else None
+    bboxes, kpss = analyzer.det_model.detect(region, input_size=input_size, max_num=0, metric='default')
+    offset = np.array([x0, y0], dtype=np.float32)
+    faces = []
+    for i in range(bboxes.shape[0]):
+        bbox = bboxes[i, 0:4] + np.tile(offset, 2)
+        kps = kpss[i] + offset if kpss is not None else None
+        faces.append(Face(bbox=bbox, kps=kps, det_score=bboxes[i, 4]))
+    return faces
+
+
+class AdaptiveDetector:
+    """Bộ phát hiện khuôn mặt của một camera: cắt theo ROI và tự chọn kích thước đầu vào
+
+    Ở chế độ thích ứng, kích thước bắt đầu từ mức lớn nhất; nếu khuôn mặt nhỏ nhất (quy đổi sang ảnh
+    đầu vào của detector) lớn hơn large_face_px trong step_down_after lần liên tiếp thì giảm một mức,
+    nếu nhỏ hơn small_face_px hoặc không thấy khuôn mặt nào thì tăng một mức (có thể đang bỏ sót
+    khuôn mặt nhỏ). mode là "adaptive" hoặc một kích thước cố định (bội số của 32).
+    """
+
+    def __init__(self, roi=None, mode="adaptive", sizes=DETECTION_SIZES, small_face_px=DETECTION_SMALL_FACE_PX,
+                 large_face_px=DETECTION_LARGE_FACE_PX, step_down_after=DETECTION_STEP_DOWN_AFTER):
+        self.roi = roi
+        self.adaptive = mode == "adaptive"
+        self.sizes = sorted(sizes) if self.adaptive else [int(mode)]
+        self.small_face_px = small_face_px
+        self.large_face_px = large_face_px
+        self.step_down_after = step_down_after
+        self._level = len(self.sizes) - 1
+        self._large_streak = 0
+        self._latency = {size: [0, 0.0] for size in self.sizes}  # size -> [số lần, tổng thời gian]
+
+    @property
+    def det_size(self):
+        return self.sizes[self._level]
+
+    def detect(self, analyzer, frame):
+        """Phát hiện khuôn mặt, trả về danh sách Face theo tọa độ frame gốc"""
+        size = self.det_size
+        start = time.perf_counter()
+        faces = detect_in_region(analyzer, frame, self.roi, size)
+        counter = self._latency[size]
+        counter[0] += 1
+        counter[1] += time.perf_counter() - start
+        if self.adaptive:
+            self._adapt(frame, faces, size)
+        return faces
+
+    def _adapt(self, frame, faces, size):
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = roi_to_pixels(self.roi, width, height)
+        # Detector giữ tỉ lệ khung hình, cạnh dài của vùng được co về size
+        scale = size / max(1, x1 - x0, y1 - y0)
+        if not faces:
+            smallest = 0.0
+        else:
+            smallest = min(face.bbox[3] - face.bbox[1] for face in faces) * scale
+
+        if smallest < self.small_face_px:
+            self._large_streak = 0
+            self._level = min(self._level + 1, len(self.sizes) - 1)
+        elif smallest > self.large_face_px:
+            self._large_streak += 1
+            if self._large_streak >= self.step_down_after and self._level > 0:
+                self._level -= 1
+                self._large_streak = 0
+        else:
+            self._large_streak = 0
+
+    def stats(self):
+        """Kích thước hiện tại, ROI và độ trễ trung bình theo từng kích thước"""
+        return {
+            "mode": "adaptive" if self.adaptive else "fixed",
+            "det_size": self.det_size,
+            "roi": list(self.roi) if self.roi is not None else None,
+            "detections": {
+                str(size): {"count": count, "avg_ms": round(total * 1000 / count, 2) if count else None}
+                for size, (count, total) in self._latency.items()
+            }
+        }
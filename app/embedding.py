@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+import numpy as np
+from .config import EMBED_BATCH_SIZE, EMBED_MAX_WAIT_MS, EMBED_RESULT_TIMEOUT_SECONDS
+
+
+def align_faces(image, faces, image_size=112):
+    """Căn chỉnh (theo 5 keypoint) và cắt các khuôn mặt về ảnh image_size x image_size cho mô hình ArcFace"""
+    from insightface.utils import face_align
+    return [face_align.norm_crop(image, landmark=face.kps, image_size=image_size) for face in faces]
+
+
+def embed_crops(recognition_model, crops, batch_size=EMBED_BATCH_SIZE):
+    """Trích xuất embedding (chưa chuẩn hóa) cho các ảnh đã căn chỉnh, mỗi lô tối đa batch_size ảnh một lần chạy mô hình
+
+    Tiền xử lý giống hệt ArcFaceONNX.get (cùng get_feat), chỉ khác là chạy nhiều ảnh một lần.
+    """
+    if not crops:
+        return []
+    features = [recognition_model.get_feat(crops[start:start + batch_size])
+                for start in range(0, len(crops), batch_size)]
+    return list(np.concatenate(features, axis=0))
+
+
+class EmbeddingBatcher:
+    """Gộp ảnh khuôn mặt từ nhiều camera thành lô để chạy mô hình nhận diện một lần
+
+    Luồng nền lấy yêu cầu đầu tiên rồi chờ thêm tối đa max_wait_ms (hoặc đến khi đủ batch_size ảnh),
+    chạy một lần get_feat cho cả lô và trả kết quả về từng camera.
+    """
+
+    def __init__(self, get_recognition_model, batch_size=EMBED_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS,
+                 result_timeout=EMBED_RESULT_TIMEOUT_SECONDS):
+        """get_recognition_model() -> mô hình recognition (ArcFaceONNX) dùng chung"""
+        self.get_recognition_model = get_recognition_model
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.result_timeout = result_timeout
+        self._queue = queue.Queue()
+        # Giữ khi đưa yêu cầu vào hàng đợi và khi dừng: sau stop() không còn yêu cầu nào bị bỏ lại trong hàng đợi
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.batches = 0
+        self.crops = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and not self._stop_event.is_set()
+
+    def start(self):
+        """Khởi động luồng gộp lô"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Dừng luồng gộp lô; các yêu cầu còn lại vẫn được xử lý"""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._stop_event.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def embed(self, crops):
+        """Gửi các ảnh đã căn chỉnh và chờ embedding (chặn luồng gọi)
+
+        Nếu luồng gộp lô đã dừng, ảnh được xử lý ngay trong luồng gọi; nếu quá result_timeout giây
+        mà lô chưa chạy thì yêu cầu bị hủy và báo TimeoutError.
+        """
+        if not crops:
+            return []
+        future = Future()
+        with self._lock:
+            queued = self.running
+            if queued:
+                self._queue.put((crops, future))
+        if not queued:
+            return embed_crops(self.get_recognition_model(), crops, self.batch_size)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except TimeoutError:
+            # Lô đã bắt đầu chạy thì không hủy được nữa: chờ kết quả
+            if not future.cancel():
+                return future.result()
+            raise TimeoutError(f"Quá {self.result_timeout} giây chờ trích xuất embedding theo lô")
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            try:
+                requests = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            count = len(requests[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                count += len(request[0])
+            self._process(requests)
+
+    def _process(self, requests):
+        # Bỏ các yêu cầu đã bị hủy do quá thời gian chờ; các yêu cầu còn lại không thể hủy được nữa
+        requests = [request for request in requests if request[1].set_running_or_notify_cancel()]
+        if not requests:
+            return
+        crops = [crop for request_crops, _ in requests for crop in request_crops]
+        try:
+            features = embed_crops(self.get_recognition_model(), crops, self.batch_size)
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.crops += len(crops)
+        offset = 0
+        for request_crops, future in requests:
+            future.set_result(features[offset:offset + len(request_crops)])
+            offset += len(request_crops)
+
+    def stats(self):
+        """Số lô đã chạy và số ảnh trung bình mỗi lô"""
+        return {
+            "running": self.running,
+            "batches": self.batches,
+            "faces": self.crops,
+            "avg_batch_size": round(self.crops / self.batches, 2) if self.batches else 0.0,
+            "queue_depth": self._queue.qsize()
+        }
@@ -1,12 +1,24 @@
 import cv2
 import numpy as np
 import os
-from insightface.app import FaceAnalysis
-from sklearn.metrics.pairwise import cosine_similarity
-from .config import FACE_RECOGNITION_THRESHOLD
-from .database import get_last_attendance_status, update_attendance_status
-from .attendance import can_record_attendance, log_attendance
-from datetime import datetime
+import json
+import time
+import hashlib
+from .config import (FACE_RECOGNITION_THRESHOLD, FACE_MODEL_NAME, FACE_MODEL_MODULES, MODEL_POOL_SIZE, CAMERA_SOURCES,
+                     MODEL_PROVIDER_CACHE_PATH, SHARED_GALLERY_ENABLED, GALLERY_STORAGE)
+from .database import (get_last_attendance_status, get_face_embedding_cache, save_face_embeddings, get_user_face_embeddings,
+                       get_user_face_data, get_gallery_generation)
+from .attendance import can_record_attendance, record_attendance
+from .gallery import FaceGallery
+from .ann_index import IndexSaver, build_gallery_index
+from .compact_gallery import CompactGallery
+from .detection import detect_in_region
+from .embedding import EmbeddingBatcher, align_faces, embed_crops
+from .metrics import STAGE_SECONDS, FACES_PER_FRAME, MATCH_SCORE
+from .shared_gallery import SharedGalleryStore
+import threading
+import queue
+from contextlib import contextmanager
 
 # Danh sách provider theo thứ tự ưu tiên
 PROVIDER_LIST = [
@@ -15,51 +27,236 @@ PROVIDER_LIST = [
     'CPUExecutionProvider'    # Fallback cuối cùng cho CPU
 ]
 
+# Mô hình chỉ được tạo khi cần lần đầu (get_face_analyzer), import module không tải mô hình
+_face_analyzer = None
+_face_analyzer_lock = threading.Lock()
+_selected_provider = None
+_model_ready = threading.Event()
+
+# Thời gian khởi động (giây) để theo dõi: tải mô hình, warm-up, nạp gallery...
+startup_timings = {}
+
+def _load_cached_provider():
+    """Đọc provider đã chọn ở lần chạy trước (None nếu chưa có hoặc khác model)"""
+    try:
+        with open(MODEL_PROVIDER_CACHE_PATH) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return cached.get("provider") if cached.get("model_name") == FACE_MODEL_NAME else None
+
+def _save_cached_provider(provider):
+    try:
+        with open(MODEL_PROVIDER_CACHE_PATH, "w") as file:
+            json.dump({"model_name": FACE_MODEL_NAME, "provider": provider}, file)
+    except OSError as e:
+        print(f"Không lưu được provider đã chọn: {e}")
+
+def _candidate_providers():
+    """Provider cần thử: provider đã chọn trước đó, sau đó các provider onnxruntime hỗ trợ theo thứ tự ưu tiên"""
+    try:
+        import onnxruntime
+        available = set(onnxruntime.get_available_providers())
+    except Exception:
+        available = set(PROVIDER_LIST)
+    candidates = [provider for provider in PROVIDER_LIST if provider in available]
+    cached = _selected_provider or _load_cached_provider()
+    if cached in candidates:
+        candidates.remove(cached)
+        candidates.insert(0, cached)
+    return candidates or ['CPUExecutionProvider']
+
 # Hàm khởi tạo FaceAnalysis với fallback
 def initialize_face_analyzer():
-    """Khởi tạo FaceAnalysis với fallback qua các provider"""
-    for provider in PROVIDER_LIST:
+    """Khởi tạo một phiên FaceAnalysis mới (chỉ các module trong FACE_MODEL_MODULES) với fallback qua các provider"""
+    global _selected_provider
+    from insightface.app import FaceAnalysis
+    
+    for provider in _candidate_providers():
         try:
             print(f"Attempting to initialize FaceAnalysis with {provider}...")
-            face_analyzer = FaceAnalysis(name='buffalo_l', providers=[provider])
+            face_analyzer = FaceAnalysis(name=FACE_MODEL_NAME, providers=[provider], allowed_modules=FACE_MODEL_MODULES)
             face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
             print(f"Successfully initialized with {provider}")
+            if provider != _selected_provider:
+                _selected_provider = provider
+                _save_cached_provider(provider)
             return face_analyzer
         except Exception as e:
             print(f"Failed to initialize with {provider}: {str(e)}")
     raise RuntimeError("Failed to initialize FaceAnalysis with any provider")
 
-# Khởi tạo mô hình nhận diện khuôn mặt với fallback
-face_analyzer = initialize_face_analyzer()
+def get_face_analyzer():
+    """Lấy phiên FaceAnalysis dùng chung, tạo ở lần gọi đầu tiên"""
+    global _face_analyzer
+    if _face_analyzer is None:
+        with _face_analyzer_lock:
+            if _face_analyzer is None:
+                start = time.perf_counter()
+                _face_analyzer = initialize_face_analyzer()
+                startup_timings["model_load_seconds"] = round(time.perf_counter() - start, 3)
+    return _face_analyzer
+
+def set_face_analyzer(analyzer):
+    """Dùng analyzer có sẵn thay cho mô hình InsightFace (ví dụ analyzer giả khi kiểm thử tải)
+
+    Gọi trước khi mô hình được tải; mọi phiên của analyzer_pool cũng dùng chung analyzer này.
+    """
+    global _face_analyzer
+    with _face_analyzer_lock:
+        _face_analyzer = analyzer
+    analyzer_pool.factory = lambda: analyzer
+
+def prepare_face_analyzer(warm_up=True):
+    """Tải mô hình và (nếu warm_up) chạy thử một lần phát hiện + trích xuất embedding để lần nhận diện đầu tiên không bị chậm"""
+    analyzer = get_face_analyzer()
+    if warm_up:
+        start = time.perf_counter()
+        analyzer.get(np.zeros((480, 640, 3), dtype=np.uint8))
+        analyzer.models['recognition'].get_feat(np.zeros((112, 112, 3), dtype=np.uint8))
+        startup_timings["warmup_seconds"] = round(time.perf_counter() - start, 3)
+    _model_ready.set()
+
+def is_model_ready():
+    """Mô hình đã được tải và warm-up xong"""
+    return _model_ready.is_set()
+
+def model_status():
+    """Trạng thái mô hình: đã sẵn sàng chưa, provider đang dùng, các module và thời gian khởi động"""
+    return {
+        "ready": is_model_ready(),
+        "model_name": FACE_MODEL_NAME,
+        "modules": list(FACE_MODEL_MODULES),
+        "provider": _selected_provider,
+        "timings": dict(startup_timings)
+    }
+
+class AnalyzerPool:
+    """Nhóm các phiên FaceAnalysis dùng chung cho các luồng nhận diện của nhiều camera
+
+    Phiên được tạo dần khi cần, tối đa size phiên (phiên đầu tiên là phiên dùng chung của
+    get_face_analyzer); luồng nào cần mà hết phiên rảnh sẽ chờ.
+    """
 
-# Từ điển lưu embeddings của tất cả người dùng đã đăng ký
-face_database = {}
+    def __init__(self, size):
+        self.size = max(1, size)
+        # Hàm tạo các phiên tiếp theo (mặc định tải thêm một phiên mô hình)
+        self.factory = initialize_face_analyzer
+        self._available = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self):
+        """Mượn một phiên FaceAnalysis trong khối with"""
+        analyzer = self._acquire()
+        try:
+            yield analyzer
+        finally:
+            self._available.put(analyzer)
+
+    def _acquire(self):
+        try:
+            return self._available.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            index = self._created
+            create = index < self.size
+            if create:
+                self._created += 1
+        if create:
+            return get_face_analyzer() if index == 0 else self.factory()
+        return self._available.get()
+
+# Nhóm phiên mô hình cho các camera
+analyzer_pool = AnalyzerPool(MODEL_POOL_SIZE or min(os.cpu_count() or 1, len(CAMERA_SOURCES)))
+
+# Gộp lô embedding giữa các camera (chỉ dùng khi được khởi động, xem EMBED_CROSS_CAMERA_BATCHING)
+embedding_batcher = EmbeddingBatcher(lambda: get_face_analyzer().models['recognition'])
+
+# Gallery lưu embeddings của tất cả người dùng đã đăng ký
+# Không sửa trực tiếp: mỗi lần cập nhật tạo một gallery mới rồi thay thế (copy-on-write),
+# nên luồng stream luôn thấy một phiên bản đầy đủ.
+face_gallery = FaceGallery()
+_gallery_lock = threading.Lock()
+
+# Gallery dùng chung giữa các worker qua file memory-map (None = mỗi tiến trình giữ gallery riêng)
+shared_gallery = SharedGalleryStore() if SHARED_GALLERY_ENABLED else None
+_gallery_version = 0  # Phiên bản gallery dùng chung mà tiến trình này đang dùng
+# Ghi chỉ mục ANN ra đĩa: ngay khi nạp lại toàn bộ, gộp lại (trễ) khi đăng ký/xóa từng người dùng
+index_saver = IndexSaver()
+
+def compute_content_hash(data):
+    """Tính hash nội dung ảnh để phát hiện ảnh đã thay đổi"""
+    return hashlib.sha256(data).hexdigest()
+
+def compute_image_embedding(img):
+    """Trích xuất embedding của khuôn mặt đầu tiên trong ảnh, None nếu không có"""
+    faces = get_face_analyzer().get(img)
+    if faces:
+        return faces[0].normed_embedding
+    return None
+
+def embedding_to_bytes(embedding):
+    """Chuyển embedding thành bytes để lưu vào SQLite"""
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def embedding_from_bytes(data):
+    """Khôi phục embedding từ bytes lưu trong SQLite"""
+    return np.frombuffer(data, dtype=np.float32)
 
 # Load face database từ SQLite
-def load_face_database(user_face_data):
-    """Tải face database từ dữ liệu người dùng"""
+def load_face_database(user_face_data, force_rebuild=False):
+    """Tải face database từ dữ liệu người dùng
+    
+    Embedding được lấy từ bảng face_embeddings; mô hình chỉ chạy lại cho những ảnh
+    có nội dung hoặc model thay đổi (hoặc tất cả nếu force_rebuild=True).
+    """
     face_db = {}
     user_info = {}
+    cache = {} if force_rebuild else get_face_embedding_cache()
+    new_rows = []
+    computed = 0
     
     for user_id, name, image_path in user_face_data:
-        if os.path.exists(image_path):
-            img = cv2.imread(image_path)
-            faces = face_analyzer.get(img)
-            if faces:
-                embedding = faces[0].normed_embedding
-                user_key = f"{user_id}_{name}"
-                
-                if user_key not in face_db:
-                    face_db[user_key] = []
-                    user_info[user_key] = {"name": name, "user_id": user_id}
-                
-                face_db[user_key].append(embedding)
+        if not os.path.exists(image_path):
+            continue
+        
+        with open(image_path, 'rb') as file:
+            data = file.read()
+        content_hash = compute_content_hash(data)
+        
+        cached = cache.get(image_path)
+        if cached and cached[0] == FACE_MODEL_NAME and cached[1] == content_hash:
+            embedding = embedding_from_bytes(cached[2]) if cached[2] is not None else None
+        else:
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            embedding = compute_image_embedding(img) if img is not None else None
+            new_rows.append((image_path, FACE_MODEL_NAME, content_hash,
+                             embedding_to_bytes(embedding) if embedding is not None else None))
+            computed += 1
+        
+        if embedding is not None:
+            user_key = f"{user_id}_{name}"
+            
+            if user_key not in face_db:
+                face_db[user_key] = []
+                user_info[user_key] = {"name": name, "user_id": user_id}
+            
+            face_db[user_key].append(embedding)
+    
+    # Lưu các embedding mới tính vào cache
+    save_face_embeddings(new_rows)
+    if computed:
+        print(f"Đã tính lại embedding cho {computed} ảnh")
     
     # Tính trung bình các embedding cho mỗi người dùng
     averaged_db = {}
     for user_key, embeddings in face_db.items():
         if embeddings:
-            averaged_embedding = np.mean(embeddings, axis=0)
+            # dtype float32: np.mean mặc định trả về float64, gấp đôi bộ nhớ cho mỗi người dùng
+            averaged_embedding = np.mean(embeddings, axis=0, dtype=np.float32)
             averaged_db[user_key] = {
                 "embedding": averaged_embedding,
                 "info": user_info[user_key]
@@ -67,34 +264,218 @@ def load_face_database(user_face_data):
     
     return averaged_db
 
+def get_face_gallery():
+    """Lấy phiên bản gallery hiện tại"""
+    return face_gallery
+
+def set_face_database(face_database):
+    """Thay thế toàn bộ gallery bằng face database dạng dict (kết quả của load_face_database)"""
+    set_face_gallery(FaceGallery.from_face_database(face_database))
+
+def set_face_gallery(gallery):
+    """Thay thế toàn bộ gallery bằng một FaceGallery có sẵn (ví dụ gallery giả khi kiểm thử tải)"""
+    gallery = build_gallery_index(gallery, save=False)
+    index_saver.save(gallery)
+    _update_gallery(lambda _: gallery, replace=True)
+
+def _update_gallery(update, replace=False):
+    """Thay gallery bằng update(gallery hiện tại)
+
+    Với gallery dùng chung, thay đổi được áp dụng lên phiên bản mới nhất (có thể do worker khác công bố)
+    trong lúc giữ khóa ghi, rồi công bố thành phiên bản mới cho mọi worker.
+    """
+    global face_gallery
+    if shared_gallery is None:
+        with _gallery_lock:
+            face_gallery = _compact_gallery(update(face_gallery))
+        return
+    with shared_gallery.lock():
+        if not replace:
+            current = shared_gallery.current()
+            if current is not None and current["version"] > _gallery_version:
+                _adopt_shared_gallery(current["version"])
+        _publish_gallery(update(face_gallery))
+
+def _publish_gallery(gallery):
+    """Công bố gallery thành phiên bản dùng chung mới và chuyển sang bản đã map (phải giữ shared_gallery.lock())"""
+    version = shared_gallery.publish(gallery, get_gallery_generation())
+    _adopt_shared_gallery(version, gallery.index)
+
+def _adopt_shared_gallery(version, index=None):
+    """Map một phiên bản gallery dùng chung và dùng nó làm gallery hiện tại
+
+    index: chỉ mục ANN đã có cho đúng các hàng của phiên bản này (worker vừa công bố); None = gắn từ file đã lưu.
+    """
+    global face_gallery, _gallery_version
+    if version <= _gallery_version:
+        return
+    gallery = shared_gallery.load(version)
+    # Chỉ worker ghi mới lưu chỉ mục ANN ra đĩa, worker đọc chỉ gắn chỉ mục đã lưu
+    gallery = gallery.with_index(index) if index is not None else build_gallery_index(gallery, save=False)
+    # Ma trận float32 đã map được giữ làm bản chính xác để chấm lại ứng viên và công bố phiên bản sau
+    gallery = _compact_gallery(gallery, exact=gallery.matrix)
+    with _gallery_lock:
+        if version > _gallery_version:
+            face_gallery = gallery
+            _gallery_version = version
+
+def _compact_gallery(gallery, exact=None):
+    """Chuyển gallery sang dạng lượng tử hóa (CompactGallery) nếu GALLERY_STORAGE là float16/int8"""
+    if GALLERY_STORAGE == "float32":
+        return gallery
+    return CompactGallery.from_gallery(gallery, GALLERY_STORAGE, exact=exact)
+
+def initialize_face_gallery():
+    """Nạp gallery khi khởi động
+
+    Với gallery dùng chung, worker khởi động đầu tiên tính lại gallery từ CSDL và công bố; các worker sau
+    chỉ map phiên bản đã có nếu nó được tạo từ đúng trạng thái CSDL hiện tại (cùng gallery_generation),
+    rồi theo dõi các phiên bản mới do worker khác công bố.
+    """
+    if shared_gallery is None:
+        set_face_database(load_face_database(get_user_face_data()))
+        return
+    with shared_gallery.lock():
+        current = shared_gallery.current()
+        if current is not None and current["generation"] == get_gallery_generation():
+            _adopt_shared_gallery(current["version"])
+        else:
+            gallery = FaceGallery.from_face_database(load_face_database(get_user_face_data()))
+            gallery = build_gallery_index(gallery, save=False)
+            index_saver.save(gallery)
+            _publish_gallery(gallery)
+    shared_gallery.start(lambda: _gallery_version, _adopt_shared_gallery)
+
+def upsert_gallery_user(user_id, name, embeddings):
+    """Thêm hoặc cập nhật một người dùng trong gallery
+    
+    embeddings là toàn bộ embedding của người dùng; nếu None thì lấy từ cache trong SQLite.
+    """
+    if embeddings is None:
+        embeddings = [embedding_from_bytes(data) for data in get_user_face_embeddings(user_id, FACE_MODEL_NAME)]
+    if not embeddings:
+        remove_gallery_user(user_id)
+        return
+    
+    averaged_embedding = np.mean(embeddings, axis=0, dtype=np.float32)
+    info = {"name": name, "user_id": user_id}
+    
+    def update(gallery):
+        gallery = gallery.with_user(f"{user_id}_{name}", info, averaged_embedding)
+        if gallery.index is None:
+            # Gallery vừa vượt ngưỡng ANN_MIN_GALLERY_SIZE thì xây chỉ mục
+            gallery = build_gallery_index(gallery, save=False)
+        index_saver.schedule(gallery)
+        return gallery
+    _update_gallery(update)
+
+def remove_gallery_user(user_id):
+    """Xóa một người dùng khỏi gallery"""
+    def update(gallery):
+        gallery = gallery.without_user(user_id)
+        if gallery.index is not None:
+            index_saver.schedule(gallery)
+        return gallery
+    _update_gallery(update)
+
+def gallery_status():
+    """Số người dùng và (nếu dùng chung giữa các worker) phiên bản gallery đang dùng"""
+    status = {"users": len(face_gallery), "storage": GALLERY_STORAGE, "shared": shared_gallery is not None}
+    if shared_gallery is not None:
+        status.update(shared_gallery.stats())
+        status["local_version"] = _gallery_version
+    return status
+
 def detect_faces(image):
     """Phát hiện khuôn mặt trong ảnh"""
-    return face_analyzer.get(image)
+    return get_face_analyzer().get(image)
+
+def detect_face_boxes(analyzer, image):
+    """Chỉ chạy mô hình phát hiện (không trích xuất embedding), trả về danh sách Face có bbox, kps"""
+    return detect_in_region(analyzer, image)
+
+def embed_faces(analyzer, image, faces):
+    """Trích xuất embedding (đã chuẩn hóa) cho các khuôn mặt đã phát hiện
+    
+    Mọi khuôn mặt trong frame được căn chỉnh rồi chạy mô hình một lần theo lô; nếu embedding_batcher
+    đang chạy, lô được gộp thêm với khuôn mặt từ các camera khác.
+    """
+    if not faces:
+        return []
+    recognition_model = analyzer.models['recognition']
+    crops = align_faces(image, faces, recognition_model.input_size[0])
+    if embedding_batcher.running:
+        features = embedding_batcher.embed(crops)
+    else:
+        features = embed_crops(recognition_model, crops)
+    for face, feature in zip(faces, features):
+        face.embedding = feature
+    return [face.normed_embedding for face in faces]
 
-def process_frame(frame, face_database):
-    """Xử lý frame để nhận diện khuôn mặt"""
+def process_frame(frame, face_database, analyzer=None, camera_id=None, tracker=None, detector=None, draw=True):
+    """Xử lý frame để nhận diện khuôn mặt
+    face_database là FaceGallery hoặc CompactGallery (hoặc dict dạng cũ, sẽ được chuyển thành FaceGallery).
+    analyzer là phiên FaceAnalysis dùng để nhận diện (mặc định get_face_analyzer()),
+    camera_id được ghi kèm bản ghi điểm danh. Nếu có tracker (FaceTracker), phát hiện và
+    nhận diện chỉ chạy khi cần, danh tính được giữ qua các frame. Nếu có detector
+    (AdaptiveDetector), phát hiện chỉ chạy trong ROI với kích thước đầu vào thích ứng.
+    
+    Trả về (frame đã vẽ, recognized_users) với một phần tử cho mỗi khuôn mặt (kể cả người lạ);
+    nếu draw=False thì không vẽ và frame trả về là None.
+    """
+    analyzer = analyzer or get_face_analyzer()
     # Copy frame để vẽ lên
-    display_frame = frame.copy()
+    display_frame = frame.copy() if draw else None
     recognized_users = []
+    camera = camera_id or ""
+    
+    # Các bước được đo thời gian cho /metrics
+    def detect(image):
+        with STAGE_SECONDS.labels("detect", camera).time():
+            return detector.detect(analyzer, image) if detector is not None else detect_face_boxes(analyzer, image)
+    
+    def embed(image, faces):
+        with STAGE_SECONDS.labels("embed", camera).time():
+            return embed_faces(analyzer, image, faces)
+    
+    def recognize(embeddings):
+        with STAGE_SECONDS.labels("recognize", camera).time():
+            results = face_database.recognize(embeddings)
+        scores = MATCH_SCORE.labels(camera)
+        for _, similarity in results:
+            scores.observe(float(similarity))
+        return results
     
     try:
-        # Phát hiện khuôn mặt trong frame
-        faces = face_analyzer.get(frame)
+        if isinstance(face_database, dict):
+            face_database = FaceGallery.from_face_database(face_database)
         
-        for face in faces:
-            # Lấy embedding của khuôn mặt
-            face_embedding = face.normed_embedding
-
-            # Biến lưu thông tin người được nhận diện và độ tương đồng
-            match_info, max_similarity = recognize_face(face_embedding, face_database)
+        if tracker is not None:
+            tracks = tracker.update(frame, detect, embed, recognize)
+            with STAGE_SECONDS.labels("draw", camera).time():
+                for track in tracks:
+                    left, top, right, bottom = track.bbox.astype(int)
+                    draw_recognition_result(display_frame, left, top, right, bottom,
+                                          track.match_info, track.similarity, recognized_users, camera_id,
+                                          track_id=track.track_id)
+        else:
+            # Phát hiện khuôn mặt trong frame
+            faces = detect(frame)
+            embeddings = embed(frame, faces)
             
-            # Lấy tọa độ khuôn mặt
-            bbox = face.bbox.astype(int)
-            left, top, right, bottom = bbox[0], bbox[1], bbox[2], bbox[3]
+            # So khớp tất cả khuôn mặt trong frame bằng một phép nhân ma trận
+            results = recognize(embeddings)
             
-            # Vẽ kết quả nhận diện lên frame
-            draw_recognition_result(display_frame, left, top, right, bottom, 
-                                  match_info, max_similarity, recognized_users)
+            with STAGE_SECONDS.labels("draw", camera).time():
+                for face, (match_info, max_similarity) in zip(faces, results):
+                    # Lấy tọa độ khuôn mặt
+                    bbox = face.bbox.astype(int)
+                    left, top, right, bottom = bbox[0], bbox[1], bbox[2], bbox[3]
+                    
+                    # Vẽ kết quả nhận diện lên frame
+                    draw_recognition_result(display_frame, left, top, right, bottom, 
+                                          match_info, max_similarity, recognized_users, camera_id)
+        FACES_PER_FRAME.labels(camera).observe(len(recognized_users))
     
     except Exception as e:
         print(f"Lỗi nhận diện: {e}")
@@ -104,6 +485,12 @@ def process_frame(frame, face_database):
 # So sánh embedding với face database
 def recognize_face(face_embedding, face_database):
     """Nhận diện khuôn mặt dựa trên embedding"""
+    if not isinstance(face_database, dict):
+        # FaceGallery hoặc CompactGallery
+        return face_database.recognize([face_embedding])[0]
+    
+    from sklearn.metrics.pairwise import cosine_similarity
+    
     match_info = None
     max_similarity = -1
     
@@ -121,8 +508,10 @@ def recognize_face(face_embedding, face_database):
     return match_info, max_similarity
 
 # Vẽ kết quả nhận diện lên frame
-def draw_recognition_result(frame, left, top, right, bottom, match_info, similarity, recognized_users):
-    """Vẽ kết quả nhận diện lên frame"""
+def draw_recognition_result(frame, left, top, right, bottom, match_info, similarity, recognized_users, camera_id=None,
+                            track_id=None):
+    """Ghi nhận điểm danh, thêm kết quả vào recognized_users và vẽ lên frame (bỏ qua vẽ nếu frame là None)"""
+    event_type = None
     if match_info:
         # Vẽ khung xanh nếu nhận diện được
         color = (0, 255, 0)
@@ -136,19 +525,27 @@ def draw_recognition_result(frame, left, top, right, bottom, match_info, similar
         if can_record_attendance(user_id):
             # event_type = determine_event_type(user_id)
             event_type = "check"
-            log_attendance(name, user_id, event_type)
-            recognized_users.append({
-                "user_id": user_id,
-                "name": name,
-                "event": event_type,
-                "confidence": float(similarity)
-            })
-            update_attendance_status(user_id, event_type, datetime.now())
+            record_attendance(name, user_id, event_type, camera_id)
     else:
         # Vẽ khung đỏ nếu không nhận diện được
         color = (0, 0, 255)
+        name = None
+        user_id = None
         label = f"Unknown ({similarity:.2f})"
     
+    recognized_users.append({
+        "user_id": user_id,
+        "name": name,
+        "bbox": [int(left), int(top), int(right), int(bottom)],
+        "confidence": round(float(similarity), 4),
+        "attendance_logged": event_type is not None,
+        "event": event_type,
+        "track_id": track_id,
+        "camera_id": camera_id
+    })
+    if frame is None:
+        return
+    
     # Vẽ bounding box
     cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
     
@@ -0,0 +1,186 @@
+import numpy as np
+from .config import FACE_RECOGNITION_THRESHOLD
+
+
+def l2_normalize(vectors):
+    """Chuẩn hóa L2 từng hàng (giống sklearn.preprocessing.normalize: hàng 0 giữ nguyên)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Số chuỗi so sánh mỗi lần trong StringTable.find, để giới hạn bộ nhớ tạm
+_FIND_CHUNK_SIZE = 16384
+
+
+def _ranges(starts, lengths):
+    """Nối các khoảng [starts[i], starts[i] + lengths[i]) thành một mảng chỉ số"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets, lengths) + np.arange(int(lengths.sum()))
+
+
+class StringTable:
+    """Danh sách chuỗi lưu liền nhau trong một mảng byte UTF-8 cùng mảng offset
+
+    Chuỗi thứ i là data[offsets[i]:offsets[i + 1]]; không có đối tượng str nào cho từng phần tử
+    cho đến khi được đọc. Giống FaceGallery, đối tượng không bị sửa sau khi tạo.
+    """
+
+    def __init__(self, values=()):
+        encoded = [value.encode("utf-8") for value in values]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=self.offsets[1:])
+        self.data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    @classmethod
+    def from_arrays(cls, data, offsets):
+        table = cls()
+        table.data = data
+        table.offsets = offsets
+        return table
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices):
+        """Trả về bảng mới chỉ gồm các chuỗi ở vị trí indices (theo thứ tự đó)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return StringTable.from_arrays(self.data[_ranges(starts, lengths)], offsets)
+
+    def appended(self, value):
+        """Trả về bảng mới có thêm value ở cuối"""
+        encoded = np.frombuffer(value.encode("utf-8"), dtype=np.uint8)
+        return StringTable.from_arrays(np.concatenate([self.data, encoded]),
+                                       np.append(self.offsets, self.offsets[-1] + len(encoded)))
+
+    def find(self, value):
+        """Vị trí các chuỗi bằng value, so sánh trực tiếp trên mảng byte"""
+        target = np.frombuffer(value.encode("utf-8"), dtype=np.uint8)
+        candidates = np.flatnonzero(np.diff(self.offsets) == len(target))
+        if len(target) == 0 or len(candidates) == 0:
+            return candidates
+        found = []
+        for start in range(0, len(candidates), _FIND_CHUNK_SIZE):
+            chunk = candidates[start:start + _FIND_CHUNK_SIZE]
+            window = self.data[self.offsets[chunk][:, None] + np.arange(len(target))]
+            found.append(chunk[(window == target).all(axis=1)])
+        return np.concatenate(found)
+
+
+class FaceGallery:
+    """Tập embedding đã đăng ký dưới dạng ma trận float32 liên tục
+
+    Mỗi hàng của ma trận là embedding đã chuẩn hóa L2 của một người dùng, song song với
+    danh sách keys/infos. Đối tượng không bị sửa sau khi tạo: các thao tác cập nhật trả về
+    một gallery mới, nên luồng stream có thể dùng một phiên bản mà không cần khóa.
+    """
+
+    def __init__(self, keys=(), infos=(), embeddings=None, dim=512):
+        self.keys = list(keys)
+        self.infos = list(infos)
+        if embeddings is None or len(self.keys) == 0:
+            self.matrix = np.zeros((0, dim), dtype=np.float32)
+        else:
+            self.matrix = np.ascontiguousarray(l2_normalize(np.vstack(embeddings)))
+        self.dim = self.matrix.shape[1]
+        # Chỉ mục ANN tùy chọn (xem ann_index.py); None = quét toàn bộ
+        self.index = None
+
+    @classmethod
+    def from_face_database(cls, face_database):
+        """Tạo gallery từ face database dạng dict {user_key: {"embedding", "info"}}"""
+        keys = list(face_database.keys())
+        infos = [face_database[key]["info"] for key in keys]
+        embeddings = [face_database[key]["embedding"] for key in keys]
+        return cls(keys, infos, embeddings)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def key_table(self):
+        """keys dưới dạng StringTable (để lưu cùng chỉ mục ANN)"""
+        return StringTable(self.keys)
+
+    def match(self, embeddings, top_k=1):
+        """So khớp nhiều embedding cùng lúc bằng một phép nhân ma trận
+
+        Trả về (indices, scores) có kích thước (số khuôn mặt, k), sắp xếp giảm dần theo độ tương đồng.
+        """
+        queries = l2_normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        if len(self) == 0 or len(queries) == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        if self.index is not None:
+            return self.index.search(self.matrix, queries, top_k)
+
+        scores = queries @ self.matrix.T
+        k = min(top_k, len(self))
+        if k == 1:
+            indices = np.argmax(scores, axis=1)[:, None]
+        else:
+            indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(scores, indices, axis=1), axis=1, kind='stable')
+            indices = np.take_along_axis(indices, order, axis=1)
+        return indices, np.take_along_axis(scores, indices, axis=1)
+
+    def recognize(self, embeddings, threshold=FACE_RECOGNITION_THRESHOLD):
+        """Nhận diện nhiều khuôn mặt, trả về danh sách (match_info, similarity) như recognize_face"""
+        indices, scores = self.match(embeddings, top_k=1)
+        results = []
+        for row_indices, row_scores in zip(indices, scores):
+            if len(row_indices) == 0:
+                results.append((None, -1))
+                continue
+            similarity = row_scores[0]
+            match_info = self.infos[row_indices[0]] if similarity > threshold else None
+            results.append((match_info, similarity))
+        return results
+
+    def with_index(self, index):
+        """Trả về gallery dùng chung dữ liệu nhưng với chỉ mục ANN khác (None để quét toàn bộ)"""
+        new = FaceGallery(dim=self.dim)
+        new.keys = self.keys
+        new.infos = self.infos
+        new.matrix = self.matrix
+        new.index = index
+        return new
+
+    def with_user(self, key, info, embedding):
+        """Trả về gallery mới đã thay thế mọi mục của info["user_id"] bằng mục key"""
+        gallery = self.without_user(info["user_id"])
+        row = l2_normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+        new = FaceGallery(dim=row.shape[1])
+        new.keys = gallery.keys + [key]
+        new.infos = gallery.infos + [info]
+        new.matrix = np.ascontiguousarray(np.vstack([gallery.matrix, row])) if len(gallery) else row
+        new.index = gallery.index.appended(row) if gallery.index is not None else None
+        return new
+
+    def without_user(self, user_id):
+        """Trả về gallery mới không còn các mục của user_id"""
+        keep = [i for i, info in enumerate(self.infos) if info["user_id"] != user_id]
+        if len(keep) == len(self.infos):
+            return self
+        new = FaceGallery(dim=self.dim)
+        new.keys = [self.keys[i] for i in keep]
+        new.infos = [self.infos[i] for i in keep]
+        new.matrix = np.ascontiguousarray(self.matrix[keep])
+        new.index = self.index.subset(keep) if self.index is not None else None
+        return new
@@ -0,0 +1,429 @@
+import asyncio
+import http.client
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+import cv2
+import numpy as np
+from .benchmark import StubAnalyzer, synthetic_gallery, synthetic_queries, _git_revision
+
+# Chu kỳ đo độ trễ event loop (giây)
+LAG_PROBE_INTERVAL = 0.01
+# Thời gian tối đa chờ server sẵn sàng (tải mô hình, nạp gallery)
+READY_TIMEOUT_SECONDS = 300
+MJPEG_BOUNDARY = b"--frame"
+
+
+class SyntheticCapture:
+    """Nguồn camera giả không cần file: nền nhiễu cố định với một khối sáng di chuyển qua khung hình
+
+    Khối di chuyển để bộ lọc chuyển động (MotionGate) không bỏ qua mọi frame như với ảnh tĩnh.
+    """
+
+    def __init__(self, width=640, height=480, fps=25, seed=0):
+        from .camera import FramePacer
+        self.width = width
+        self.height = height
+        self._background = np.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+        self._pacer = FramePacer(fps)
+        self._index = 0
+
+    def read(self):
+        self._pacer.wait()
+        frame = self._background.copy()
+        size = self.height // 4
+        left = (self._index * 8) % max(1, self.width - size)
+        frame[self.height // 8:self.height // 8 + size, left:left + size] = 255
+        self._index += 1
+        return True, frame
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class LoadTestAnalyzer(StubAnalyzer):
+    """Analyzer giả cho kiểm thử tải: stream thấy faces khuôn mặt mỗi frame, ảnh đăng ký chỉ có một khuôn mặt"""
+
+    def get(self, img, max_num=0):
+        return super().get(img, max_num)[:1]
+
+
+def summarize_latency(samples):
+    """Thống kê độ trễ (ms): số mẫu, trung bình, p50/p95/p99, lớn nhất"""
+    if not samples:
+        return {"n": 0}
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": int(values.size),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2)
+    }
+
+
+class EventLoopLagMonitor:
+    """Đo độ trễ event loop: ngủ interval giây rồi ghi lại thời gian thức dậy muộn hơn dự kiến"""
+
+    def __init__(self, interval=LAG_PROBE_INTERVAL):
+        self.interval = interval
+        self.samples = []
+
+    def reset(self):
+        self.samples = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+
+class ServerThread:
+    """Chạy app FastAPI bằng uvicorn trong một luồng riêng, kèm bộ đo độ trễ event loop trên cùng loop"""
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        import uvicorn
+        self.host = host
+        self.port = port or _free_port(host)
+        self.server = uvicorn.Server(uvicorn.Config(app, host=self.host, port=self.port, log_level="warning",
+                                                    lifespan="on"))
+        self.lag_monitor = EventLoopLagMonitor()
+        self._thread = None
+
+    def start(self, timeout=30):
+        self._thread = threading.Thread(target=self._run, name="loadtest-server", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("Không khởi động được server")
+            time.sleep(0.05)
+
+    def _run(self):
+        async def serve():
+            monitor = asyncio.create_task(self.lag_monitor.run())
+            try:
+                await self.server.serve()
+            finally:
+                monitor.cancel()
+        asyncio.run(serve())
+
+    def stop(self):
+        self.server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+
+
+def _free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _encode_multipart(fields, files):
+    """Mã hóa form multipart/form-data: fields {tên: giá trị}, files [(tên trường, tên file, bytes)]"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class VideoClient(threading.Thread):
+    """Người xem /video_feed/{camera_id}: đếm frame MJPEG nhận được và khoảng cách giữa các frame"""
+
+    def __init__(self, host, port, camera_id, deadline, name):
+        super().__init__(name=name, daemon=True)
+        self.host = host
+        self.port = port
+        self.camera_id = camera_id
+        self.deadline = deadline
+        self.frames = 0
+        self.first_frame_seconds = None
+        self.gaps = []
+        self.error = None
+        self._first_frame_at = None
+        self._last_frame_at = None
+
+    def run(self):
+        started = time.monotonic()
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        try:
+            connection.request("GET", f"/video_feed/{self.camera_id}")
+            response = connection.getresponse()
+            if response.status != 200:
+                self.error = f"HTTP {response.status}"
+                return
+            tail = b""
+            while time.monotonic() < self.deadline:
+                chunk = response.read1(65536)
+                if not chunk:
+                    self.error = "Stream bị đóng"
+                    break
+                # Giữ lại phần cuối của khối trước để không bỏ sót boundary nằm vắt qua hai khối
+                data = tail + chunk
+                count = data.count(MJPEG_BOUNDARY)
+                tail = data[-(len(MJPEG_BOUNDARY) - 1):]
+                if count:
+                    self._on_frames(count, started)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            connection.close()
+
+    def _on_frames(self, count, started):
+        now = time.monotonic()
+        if self._first_frame_at is None:
+            self._first_frame_at = now
+            self.first_frame_seconds = now - started
+        elif self._last_frame_at is not None:
+            self.gaps.append(now - self._last_frame_at)
+        self._last_frame_at = now
+        self.frames += count
+
+    def report(self):
+        # FPS tính từ frame đầu tiên, không tính thời gian mở camera
+        elapsed = (self._last_frame_at - self._first_frame_at) if self.frames > 1 else 0
+        return {
+            "client": self.name,
+            "camera_id": self.camera_id,
+            "frames": self.frames,
+            "fps": round((self.frames - 1) / elapsed, 2) if elapsed else 0.0,
+            "first_frame_seconds": round(self.first_frame_seconds, 3) if self.first_frame_seconds else None,
+            "frame_gap": summarize_latency(self.gaps),
+            "error": self.error
+        }
+
+
+class RequestClient(threading.Thread):
+    """Client gửi yêu cầu liên tục (đăng ký khuôn mặt hoặc tra cứu điểm danh), ghi độ trễ theo endpoint"""
+
+    def __init__(self, host, port, kind, deadline, name, upload_images=None, think_seconds=0.0):
+        super().__init__(name=name, daemon=True)
+        self.host = host
+        self.port = port
+        self.kind = kind
+        self.deadline = deadline
+        self.upload_images = upload_images or []
+        self.think_seconds = think_seconds
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = 0
+
+    def _requests(self):
+        """Sinh lần lượt (tên endpoint, method, path, body, headers)"""
+        sequence = 0
+        while True:
+            sequence += 1
+            if self.kind == "register":
+                body, content_type = _encode_multipart(
+                    {"user_id": f"{self.name}_{sequence}", "name": f"{self.name}_{sequence}"},
+                    [("face_images", f"face_{i}.jpg", data) for i, data in enumerate(self.upload_images)])
+                yield "POST /register_face", "POST", "/register_face", body, {"Content-Type": content_type}
+            else:
+                today = datetime.now().strftime("%Y-%m-%d")
+                yield "GET /today_attendance", "GET", "/today_attendance", None, {}
+                yield ("GET /attendance_events", "GET",
+                       f"/attendance_events?start_date={today}&end_date={today}&limit=100", None, {})
+                yield ("GET /attendance/summary", "GET",
+                       f"/attendance/summary?start_date={today}&end_date={today}", None, {})
+
+    def run(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            for endpoint, method, path, body, headers in self._requests():
+                if time.monotonic() >= self.deadline:
+                    break
+                start = time.perf_counter()
+                try:
+                    connection.request(method, path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                except Exception:
+                    self.errors += 1
+                    connection.close()
+                    connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                    continue
+                self.latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+                statuses = self.statuses.setdefault(endpoint, {})
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if self.think_seconds:
+                    time.sleep(self.think_seconds)
+        finally:
+            connection.close()
+
+
+def _fetch_json(host, port, path, timeout=10):
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        connection.close()
+
+
+def _wait_until_ready(host, port, timeout=READY_TIMEOUT_SECONDS):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, body = _fetch_json(host, port, "/health/ready")
+        if status == 200:
+            return body
+        if body and body.get("error"):
+            raise RuntimeError(f"Khởi động mô hình thất bại: {body['error']}")
+        time.sleep(0.5)
+    raise RuntimeError("Server không sẵn sàng sau thời gian chờ")
+
+
+def _make_source_factory(source, width, height, fps):
+    """Hàm tạo capture cho một camera: None = nguồn giả SyntheticCapture, còn lại mở như CAMERA_SOURCES"""
+    if source is None:
+        return lambda: SyntheticCapture(width, height, 25 if fps is None else fps)
+    from .camera import ImageSequenceCapture, LoopingVideoCapture, is_image_sequence
+    if is_image_sequence(source):
+        return lambda: ImageSequenceCapture(source, fps)
+    if not os.path.isfile(source):
+        raise ValueError(f"Không tìm thấy nguồn '{source}'")
+    return lambda: LoopingVideoCapture(source, fps)
+
+
+def run_load_test(source=None, cameras=1, viewers=1, registrations=0, queries=1, duration=30.0, stub=True,
+                  faces=1, gallery_size=1000, upload_count=3, think_seconds=0.0, width=640, height=480, fps=None,
+                  storage="float32"):
+    """Chạy kiểm thử tải toàn bộ app trong thư mục tạm (CSDL, ảnh đăng ký, log điểm danh không ảnh hưởng dữ liệu thật)
+
+    source: file video hoặc chuỗi ảnh (thư mục/mẫu glob) phát lặp lại, None = nguồn giả sinh frame.
+    viewers là số người xem video mỗi camera; registrations/queries là số client gửi liên tục
+    /register_face và các API tra cứu điểm danh. stub=True dùng analyzer giả (không cần mô hình,
+    faces khuôn mặt mỗi frame); stub=False tải mô hình thật (cần file mô hình đã tải sẵn).
+    storage="float16"/"int8": stream và đăng ký chạy trên gallery lượng tử hóa (như GALLERY_STORAGE).
+    """
+    factory = _make_source_factory(source, width, height, fps)
+    probe = factory()
+    success, sample_frame = probe.read()
+    probe.release()
+    if not success:
+        raise ValueError("Không đọc được frame từ nguồn")
+    success, encoded = cv2.imencode('.jpg', sample_frame)
+    upload_images = [encoded.tobytes()] * upload_count
+
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="attendance_loadtest_")
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+    server = None
+    try:
+        os.chdir(work_dir)
+        os.makedirs("attendance_logs", exist_ok=True)
+        os.makedirs("dataset", exist_ok=True)
+        from .camera import CameraManager
+        from .database import close_connection
+        from .face_recognition import set_face_analyzer, set_face_gallery, get_face_gallery
+        close_connection()
+
+        # Đăng ký nguồn trước khi import main để mỗi camera có hub riêng
+        camera_manager = CameraManager.get_instance()
+        camera_ids = camera_manager.camera_ids[:cameras]
+        camera_ids += [f"loadtest{i}" for i in range(len(camera_ids), cameras)]
+        for camera_id in camera_ids:
+            camera_manager.register_source(camera_id, factory)
+
+        gallery = synthetic_gallery(gallery_size) if gallery_size else None
+        if stub:
+            if gallery is not None:
+                embeddings = synthetic_queries(gallery, max(1, faces))
+            else:
+                embeddings = np.random.default_rng(2).standard_normal((max(1, faces), 512)).astype(np.float32)
+            set_face_analyzer(LoadTestAnalyzer(faces, embeddings, sample_frame.shape[:2]))
+
+        import main
+        for camera_id in camera_ids:
+            if camera_id not in main.camera_hubs:
+                main.camera_hubs[camera_id] = main.make_camera_hub(camera_id)
+
+        server = ServerThread(main.app)
+        server.start()
+        ready = _wait_until_ready(server.host, server.port)
+        if storage != "float32":
+            from .compact_gallery import CompactGallery
+            gallery = CompactGallery.from_gallery(gallery if gallery is not None else get_face_gallery(), storage)
+        if gallery is not None:
+            # Thay gallery rỗng (CSDL tạm) bằng gallery giả để khuôn mặt trong stream khớp người dùng
+            set_face_gallery(gallery)
+        print(f"Server sẵn sàng tại http://{server.host}:{server.port} "
+              f"(provider {ready.get('provider')}, {len(camera_ids)} camera, gallery {gallery_size} {storage})")
+
+        deadline = time.monotonic() + duration
+        clients = []
+        for camera_id in camera_ids:
+            clients += [VideoClient(server.host, server.port, camera_id, deadline, f"viewer_{camera_id}_{i}")
+                        for i in range(viewers)]
+        clients += [RequestClient(server.host, server.port, "register", deadline, f"register{i}",
+                                  upload_images, think_seconds) for i in range(registrations)]
+        clients += [RequestClient(server.host, server.port, "query", deadline, f"query{i}",
+                                  think_seconds=think_seconds) for i in range(queries)]
+        server.lag_monitor.reset()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join(timeout=duration + 60)
+        lag_samples = list(server.lag_monitor.samples)
+        _, stream_stats = _fetch_json(server.host, server.port, "/video_feed/stats")
+        _, writer_stats = _fetch_json(server.host, server.port, "/attendance_writer/stats")
+    finally:
+        if server is not None:
+            server.stop()
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies = {}
+    statuses = {}
+    errors = 0
+    for client in clients:
+        if isinstance(client, RequestClient):
+            errors += client.errors
+            for endpoint, samples in client.latencies.items():
+                latencies.setdefault(endpoint, []).extend(samples)
+            for endpoint, counts in client.statuses.items():
+                for status, count in counts.items():
+                    statuses.setdefault(endpoint, {}).setdefault(str(status), 0)
+                    statuses[endpoint][str(status)] += count
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {
+            "source": source or "synthetic", "cameras": cameras, "viewers_per_camera": viewers,
+            "registration_clients": registrations, "query_clients": queries, "duration_seconds": duration,
+            "stub_analyzer": stub, "faces_per_frame": faces if stub else None, "gallery_size": gallery_size,
+            "gallery_storage": storage, "frame_size": list(sample_frame.shape[:2])
+        },
+        "video_clients": [client.report() for client in clients if isinstance(client, VideoClient)],
+        "endpoints": {endpoint: {**summarize_latency(samples), "status": statuses.get(endpoint, {}),
+                                 "requests_per_second": round(len(samples) / duration, 2)}
+                      for endpoint, samples in sorted(latencies.items())},
+        "request_errors": errors,
+        "event_loop_lag": summarize_latency(lag_samples),
+        "pipelines": stream_stats,
+        "attendance_writer": writer_stats
+    }
@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+from .config import (MOTION_DOWNSCALE_WIDTH, MOTION_PIXEL_THRESHOLD, MOTION_MIN_CHANGED_RATIO,
+                     MOTION_FORCE_DETECT_INTERVAL)
+
+
+class MotionGate:
+    """Bộ lọc chuyển động đặt trước bước phát hiện khuôn mặt
+
+    So sánh frame thu nhỏ (ảnh xám, làm mờ) với frame được nhận diện gần nhất trong vùng ROI. Nếu tỉ lệ
+    điểm ảnh thay đổi nhỏ hơn min_changed_ratio thì bỏ qua nhận diện và dùng lại chú thích (khung, nhãn)
+    của lần nhận diện trước. Cứ force_interval frame bị bỏ qua liên tiếp thì bắt buộc nhận diện lại một lần.
+    """
+
+    def __init__(self, roi=None, pixel_threshold=MOTION_PIXEL_THRESHOLD, min_changed_ratio=MOTION_MIN_CHANGED_RATIO,
+                 force_interval=MOTION_FORCE_DETECT_INTERVAL, downscale_width=MOTION_DOWNSCALE_WIDTH):
+        """roi: (left, top, right, bottom) theo tỉ lệ 0..1 của frame, None = toàn frame"""
+        self.roi = roi
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.force_interval = force_interval
+        self.downscale_width = downscale_width
+        self._reference = None
+        self._pending = None
+        self._annotation_mask = None
+        self._annotation_pixels = None
+        self._annotated = False
+        self._last_results = []
+        self._skipped_in_row = 0
+        self.frames = 0
+        self.skipped = 0
+        self.last_changed_ratio = 0.0
+
+    def _signature(self, frame):
+        """Ảnh xám thu nhỏ, đã làm mờ của vùng ROI"""
+        height, width = frame.shape[:2]
+        if self.roi is not None:
+            left, top, right, bottom = self.roi
+            frame = frame[int(top * height):int(bottom * height), int(left * width):int(right * width)]
+            height, width = frame.shape[:2]
+        scale = min(1.0, self.downscale_width / max(1, width))
+        small = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_process(self, frame, draw=True):
+        """True nếu frame cần được nhận diện, False nếu có thể dùng lại kết quả trước
+        
+        draw=True mà lần nhận diện trước không vẽ (không có người xem video) thì phải nhận diện lại để có chú thích.
+        """
+        self.frames += 1
+        signature = self._signature(frame)
+        if self._reference is None or self._reference.shape != signature.shape or (draw and not self._annotated):
+            self._pending = signature
+            return True
+
+        diff = cv2.absdiff(signature, self._reference)
+        self.last_changed_ratio = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+        if self.last_changed_ratio >= self.min_changed_ratio or self._skipped_in_row >= self.force_interval:
+            self._pending = signature
+            return True
+
+        self._skipped_in_row += 1
+        self.skipped += 1
+        return False
+
+    def remember(self, frame, display_frame, recognized_users):
+        """Lưu frame vừa nhận diện làm mốc so sánh, giữ lại kết quả và phần chú thích đã vẽ (nếu có)"""
+        self._reference = self._pending
+        self._skipped_in_row = 0
+        self._last_results = recognized_users
+        self._annotated = display_frame is not None
+        mask = np.any(display_frame != frame, axis=2) if display_frame is not None else None
+        if mask is not None and mask.any():
+            self._annotation_mask = mask[..., None]
+            self._annotation_pixels = display_frame
+        else:
+            self._annotation_mask = None
+            self._annotation_pixels = None
+
+    def overlay(self, frame):
+        """Vẽ lại chú thích của lần nhận diện trước lên frame bị bỏ qua"""
+        if self._annotation_mask is None or self._annotation_pixels.shape != frame.shape:
+            return frame
+        display_frame = frame.copy()
+        np.copyto(display_frame, self._annotation_pixels, where=self._annotation_mask)
+        return display_frame
+
+    def last_results(self):
+        """Kết quả của lần nhận diện trước, dùng cho frame bị bỏ qua (không ghi nhận điểm danh lần nữa)"""
+        return [{**user, "attendance_logged": False, "event": None} for user in self._last_results]
+
+    def stats(self):
+        """Số frame, số frame bỏ qua và tỉ lệ bỏ qua"""
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / self.frames, 4) if self.frames else 0.0,
+            "last_changed_ratio": round(self.last_changed_ratio, 4)
+        }
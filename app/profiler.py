@@ -0,0 +1,102 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from .config import PROFILER_INTERVAL_MS, PROFILER_MAX_SECONDS
+
+
+class SamplingProfiler:
+    """Profiler lấy mẫu: định kỳ chụp call stack của mọi luồng, bật/tắt được khi ứng dụng đang chạy
+
+    Chi phí chỉ phát sinh khi đang bật (một luồng đọc sys._current_frames() mỗi interval_ms), và
+    profiler tự tắt sau max_seconds để không bị quên bật trên môi trường thật.
+    """
+
+    def __init__(self):
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.interval = PROFILER_INTERVAL_MS / 1000
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms=PROFILER_INTERVAL_MS, max_seconds=PROFILER_MAX_SECONDS):
+        """Bắt đầu lấy mẫu (xóa kết quả lần trước)"""
+        if self.running:
+            return
+        with self._lock:
+            self._stacks.clear()
+        self.samples = 0
+        self.interval = max(0.001, interval_ms / 1000)
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(max_seconds,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Dừng lấy mẫu, giữ lại kết quả để xem"""
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self, max_seconds):
+        own_id = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + max_seconds
+        while not self._stop_event.wait(self.interval):
+            if time.monotonic() > deadline:
+                break
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            samples = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                samples.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(samples)
+                self.samples += 1
+        self.stopped_at = time.time()
+
+    def collapsed(self):
+        """Kết quả dạng collapsed stack (mỗi dòng "luồng;hàm;hàm... số mẫu"), dùng được với flamegraph.pl/speedscope"""
+        with self._lock:
+            items = sorted(self._stacks.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def top_functions(self, limit=30):
+        """Các hàm xuất hiện ở đỉnh stack nhiều nhất (thời gian tự thân)"""
+        own = Counter()
+        with self._lock:
+            for stack, count in self._stacks.items():
+                own[stack.rsplit(";", 1)[-1]] += count
+        total = sum(own.values()) or 1
+        return [{"function": name, "samples": count, "ratio": round(count / total, 4)}
+                for name, count in own.most_common(limit)]
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.samples,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at
+        }
+
+
+profiler = SamplingProfiler()
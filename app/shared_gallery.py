@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from .config import (FACE_MODEL_NAME, SHARED_GALLERY_DIR, SHARED_GALLERY_POLL_SECONDS, SHARED_GALLERY_KEEP_VERSIONS)
+from .gallery import FaceGallery
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class SharedGalleryStore:
+    """Gallery dùng chung giữa các worker (tiến trình) qua file embedding được memory-map chỉ đọc
+
+    Mỗi phiên bản gồm gallery_<version>.npy (ma trận float32) và gallery_<version>.json (keys, user_id,
+    name); file CURRENT trỏ tới phiên bản mới nhất và được thay thế nguyên tử. Các worker map cùng một
+    file nên trang dữ liệu nằm một lần trong page cache của hệ điều hành, bộ nhớ không tăng theo số
+    worker. Worker ghi (đăng ký, xóa người dùng) giữ khóa file trong lúc tạo phiên bản mới; các worker
+    khác kiểm tra CURRENT mỗi poll_seconds giây và chuyển sang phiên bản mới.
+    """
+
+    def __init__(self, directory=SHARED_GALLERY_DIR, poll_seconds=SHARED_GALLERY_POLL_SECONDS,
+                 keep_versions=SHARED_GALLERY_KEEP_VERSIONS):
+        self.directory = directory
+        self.poll_seconds = poll_seconds
+        self.keep_versions = max(1, keep_versions)
+        self._current_path = os.path.join(directory, "CURRENT")
+        self._lock_path = os.path.join(directory, "gallery.lock")
+        self._thread_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.published = 0
+        self.reloads = 0
+
+    def _paths(self, version):
+        base = os.path.join(self.directory, f"gallery_{version:08d}")
+        return base + ".npy", base + ".json"
+
+    @contextmanager
+    def lock(self):
+        """Khóa ghi dùng chung giữa các tiến trình (và các luồng trong cùng tiến trình)"""
+        with self._thread_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._lock_path, "a+") as file:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+                else:
+                    file.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            continue  # LK_LOCK chỉ thử lại trong 10 giây
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        file.seek(0)
+                        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read_current(self):
+        try:
+            with open(self._current_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def current(self):
+        """Thông tin phiên bản mới nhất (version, generation, model_name, users) hoặc None nếu chưa có/khác model"""
+        current = self._read_current()
+        return current if current and current.get("model_name") == FACE_MODEL_NAME else None
+
+    def load(self, version):
+        """Map chỉ đọc ma trận của một phiên bản và tạo FaceGallery (chưa gắn chỉ mục ANN)"""
+        matrix_path, meta_path = self._paths(version)
+        with open(meta_path) as file:
+            meta = json.load(file)
+        gallery = FaceGallery(dim=meta["dim"])
+        gallery.keys = meta["keys"]
+        gallery.infos = [{"name": name, "user_id": user_id} for user_id, name in zip(meta["user_ids"], meta["names"])]
+        if gallery.keys:
+            # np.asarray bỏ lớp np.memmap nhưng vẫn dùng chung vùng nhớ đã map
+            gallery.matrix = np.asarray(np.load(matrix_path, mmap_mode="r"))
+        return gallery
+
+    def publish(self, gallery, generation):
+        """Ghi gallery thành phiên bản mới và trỏ CURRENT tới nó (phải giữ lock()), trả về số phiên bản
+
+        generation là bộ đếm thay đổi của CSDL (get_gallery_generation) tại thời điểm tạo gallery.
+        """
+        current = self._read_current()
+        version = (current["version"] if current else 0) + 1
+        matrix_path, meta_path = self._paths(version)
+        np.save(matrix_path, np.ascontiguousarray(gallery.matrix, dtype=np.float32))
+        with open(meta_path, "w") as file:
+            json.dump({"dim": gallery.dim, "keys": list(gallery.keys),
+                       "user_ids": [info["user_id"] for info in gallery.infos],
+                       "names": [info["name"] for info in gallery.infos]}, file, ensure_ascii=False)
+        tmp_path = self._current_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"version": version, "generation": generation, "model_name": FACE_MODEL_NAME,
+                       "users": len(gallery)}, file)
+        os.replace(tmp_path, self._current_path)
+        self.published += 1
+        self._prune(version)
+        return version
+
+    def _prune(self, version):
+        """Xóa các phiên bản cũ; worker đang map file cũ vẫn đọc được (trên Windows file đang map không xóa được, bỏ qua)"""
+        for name in os.listdir(self.directory):
+            if not name.startswith("gallery_") or not name.endswith((".npy", ".json")):
+                continue
+            try:
+                old = int(name[len("gallery_"):].split(".")[0])
+            except ValueError:
+                continue
+            if old <= version - self.keep_versions:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def start(self, get_version, on_change):
+        """Khởi động luồng theo dõi: khi CURRENT trỏ tới phiên bản khác get_version() thì gọi on_change(version)"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(get_version, on_change),
+                                        name="shared-gallery-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self, get_version, on_change):
+        # CURRENT chỉ vài chục byte nên đọc lại mỗi chu kỳ (không dựa vào mtime, có thể thô trên một số hệ thống file)
+        while not self._stop_event.wait(self.poll_seconds):
+            current = self.current()
+            if current is None or current["version"] == get_version():
+                continue
+            try:
+                start = time.perf_counter()
+                on_change(current["version"])
+                self.reloads += 1
+                print(f"Đã chuyển sang gallery dùng chung phiên bản {current['version']} "
+                      f"({current['users']} người dùng, {time.perf_counter() - start:.2f}s)")
+            except Exception as e:
+                # Ví dụ phiên bản vừa bị xóa vì có phiên bản mới hơn: lần kiểm tra sau sẽ thử lại
+                print(f"Lỗi nạp gallery dùng chung: {e}")
+
+    def stats(self):
+        current = self.current()
+        return {
+            "directory": self.directory,
+            "version": current["version"] if current else None,
+            "generation": current["generation"] if current else None,
+            "published": self.published,
+            "reloads": self.reloads,
+            "watching": self._thread is not None
+        }
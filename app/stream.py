@@ -0,0 +1,299 @@
+import queue
+import threading
+import time
+from collections import deque
+import cv2
+from .metrics import STAGE_SECONDS
+from .config import STREAM_QUEUE_SIZE, CAMERA_STALE_SECONDS, RESULT_HISTORY_SIZE
+
+
+class DropOldestQueue:
+    """Hàng đợi có giới hạn, khi đầy thì bỏ phần tử cũ nhất thay vì chặn bên ghi"""
+
+    def __init__(self, maxsize=STREAM_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        """Thêm phần tử, bỏ phần tử cũ nếu hàng đợi đầy"""
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Lấy phần tử, ném queue.Empty nếu hết thời gian chờ"""
+        return self._queue.get(timeout=timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class RateCounter:
+    """Đo tần suất sự kiện (FPS) trên cửa sổ trượt"""
+
+    def __init__(self, window_seconds=2.0):
+        self.window_seconds = window_seconds
+        self.total = 0
+        self._timestamps = deque()
+        self._lock = threading.Lock()
+
+    def tick(self):
+        now = time.monotonic()
+        with self._lock:
+            self.total += 1
+            self._timestamps.append(now)
+            cutoff = now - self.window_seconds
+            while self._timestamps and self._timestamps[0] < cutoff:
+                self._timestamps.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            recent = [t for t in self._timestamps if t >= now - self.window_seconds]
+        return len(recent) / self.window_seconds
+
+
+class FramePipeline:
+    """Pipeline stream gồm 3 luồng: đọc camera -> nhận diện -> mã hóa JPEG
+
+    Các luồng nối với nhau bằng hàng đợi có giới hạn và chỉ giữ frame mới nhất, nên khi nhận diện
+    chậm thì frame cũ bị bỏ thay vì dồn lại; độ trễ tối đa xấp xỉ thời gian một lần nhận diện.
+    """
+
+    def __init__(self, capture, process_fn, name="default"):
+        """capture: đối tượng có read() như cv2.VideoCapture
+        
+        process_fn(frame, draw) -> (frame đã vẽ hoặc None nếu draw=False, recognized_users)
+        """
+        self.name = name
+        self.capture = capture
+        self.process_fn = process_fn
+        # False khi không có người xem video: bỏ qua bước vẽ và mã hóa JPEG, chỉ phát kết quả
+        self.render = True
+        self._results = deque(maxlen=RESULT_HISTORY_SIZE)
+        self._results_lock = threading.Lock()
+        self._results_sequence = 0
+        self._inference_queue = DropOldestQueue()
+        self._encode_queue = DropOldestQueue()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._frame_condition = threading.Condition()
+        self._latest_part = None
+        self._latest_sequence = 0
+        self.capture_rate = RateCounter()
+        self.inference_rate = RateCounter()
+        self.encode_rate = RateCounter()
+        self.last_inference_seconds = 0.0
+        self.last_frame_time = None
+        self._capture_seconds = STAGE_SECONDS.labels("capture", name)
+        self._encode_seconds = STAGE_SECONDS.labels("encode", name)
+
+    @property
+    def running(self):
+        return not self._stop_event.is_set()
+
+    def start(self):
+        """Khởi động các luồng của pipeline"""
+        for target, name in ((self._capture_loop, "capture"),
+                             (self._inference_loop, "inference"),
+                             (self._encode_loop, "encode")):
+            thread = threading.Thread(target=target, name=f"stream-{self.name}-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Dừng pipeline và chờ các luồng kết thúc"""
+        self._stop_event.set()
+        with self._frame_condition:
+            self._frame_condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=5)
+        self._threads = []
+
+    def _capture_loop(self):
+        """Đọc camera liên tục, chỉ giữ frame mới nhất cho luồng nhận diện"""
+        while self.running:
+            start = time.perf_counter()
+            success, frame = self.capture.read()
+            self._capture_seconds.observe(time.perf_counter() - start)
+            if not success:
+                print(f"Không đọc được frame từ camera '{self.name}', dừng pipeline")
+                self._stop_event.set()
+                break
+            self.capture_rate.tick()
+            self.last_frame_time = time.monotonic()
+            self._inference_queue.put(frame)
+        with self._frame_condition:
+            self._frame_condition.notify_all()
+
+    def _inference_loop(self):
+        """Nhận diện frame mới nhất; frame đến trong lúc đang bận sẽ bị bỏ"""
+        while self.running:
+            try:
+                frame = self._inference_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            render = self.render
+            try:
+                processed_frame, recognized_users = self.process_fn(frame, render)
+            except Exception as e:
+                print(f"Lỗi nhận diện: {e}")
+                continue
+            self.last_inference_seconds = time.perf_counter() - start
+            self.inference_rate.tick()
+            self._publish_results(recognized_users)
+            if render and processed_frame is not None:
+                self._encode_queue.put(processed_frame)
+
+    def _publish_results(self, recognized_users):
+        """Lưu kết quả nhận diện của frame vào lịch sử ngắn cho các client nhận sự kiện"""
+        with self._results_lock:
+            self._results_sequence += 1
+            self._results.append((self._results_sequence, time.time(), recognized_users))
+
+    def results_since(self, last_sequence):
+        """Các kết quả (sequence, timestamp, recognized_users) mới hơn last_sequence
+        
+        Chỉ giữ RESULT_HISTORY_SIZE frame gần nhất; client đọc quá chậm sẽ bỏ lỡ các frame cũ hơn.
+        """
+        with self._results_lock:
+            if self._results_sequence <= last_sequence:
+                return []
+            return [item for item in self._results if item[0] > last_sequence]
+
+    def _encode_loop(self):
+        """Mã hóa JPEG và phát frame mới nhất cho người xem"""
+        while self.running:
+            try:
+                frame = self._encode_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._encode_seconds.time():
+                success, buffer = cv2.imencode('.jpg', frame)
+            if not success:
+                continue
+            # Tạo sẵn một phần multipart duy nhất, dùng chung (không sao chép) cho mọi người xem
+            part = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n'
+            self.encode_rate.tick()
+            with self._frame_condition:
+                self._latest_part = part
+                self._latest_sequence += 1
+                self._frame_condition.notify_all()
+
+    def wait_for_frame(self, last_sequence, timeout=1.0):
+        """Chờ frame mới hơn last_sequence
+
+        Trả về (sequence, phần multipart JPEG) hoặc None nếu hết giờ/đã dừng. Người xem chậm
+        chỉ nhận frame mới nhất, các frame ở giữa bị bỏ qua mà không làm chậm pipeline.
+        """
+        with self._frame_condition:
+            self._frame_condition.wait_for(
+                lambda: self._latest_sequence > last_sequence or not self.running, timeout=timeout)
+            if self._latest_sequence > last_sequence:
+                return self._latest_sequence, self._latest_part
+        return None
+
+    def healthy(self):
+        """Pipeline đang chạy và camera vẫn trả về frame gần đây"""
+        return (self.running and self.last_frame_time is not None
+                and time.monotonic() - self.last_frame_time < CAMERA_STALE_SECONDS)
+
+    def stats(self):
+        """Thống kê FPS và số frame bị bỏ của từng giai đoạn"""
+        return {
+            "running": self.running,
+            "healthy": self.healthy(),
+            "capture_fps": round(self.capture_rate.rate(), 2),
+            "inference_fps": round(self.inference_rate.rate(), 2),
+            "encode_fps": round(self.encode_rate.rate(), 2),
+            "frames_captured": self.capture_rate.total,
+            "frames_processed": self.inference_rate.total,
+            "frames_encoded": self.encode_rate.total,
+            "rendering": self.render,
+            "dropped_before_inference": self._inference_queue.dropped,
+            "dropped_before_encode": self._encode_queue.dropped,
+            "last_inference_ms": round(self.last_inference_seconds * 1000, 1),
+        }
+
+
+class BroadcastHub:
+    """Chia sẻ một FramePipeline cho nhiều người xem
+
+    Camera chỉ được đọc và nhận diện một lần dù có bao nhiêu người xem. Pipeline khởi động khi
+    người xem đầu tiên kết nối và camera được giải phóng khi người xem cuối cùng rời đi. Client chỉ
+    nhận kết quả (video=False) cũng giữ pipeline chạy, nhưng khi không còn người xem video thì pipeline
+    bỏ qua bước vẽ và mã hóa JPEG.
+    """
+
+    def __init__(self, open_capture, release_capture, process_fn, name="default"):
+        """open_capture() -> capture; release_capture() giải phóng capture; process_fn như FramePipeline"""
+        self.name = name
+        self.open_capture = open_capture
+        self.release_capture = release_capture
+        self.process_fn = process_fn
+        self.pipeline = None
+        self.subscribers = 0
+        self.event_subscribers = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, video=True):
+        """Đăng ký một người xem video (hoặc client chỉ nhận kết quả nếu video=False), trả về pipeline đang chạy"""
+        with self._lock:
+            if self.pipeline is not None and not self.pipeline.running:
+                # Pipeline đã tự dừng (ví dụ mất camera): mở lại từ đầu
+                self._stop_pipeline()
+            if self.pipeline is None:
+                # Chỉ tăng số người xem sau khi mở được camera: nếu open_capture lỗi, hub vẫn ở trạng thái rảnh
+                pipeline = FramePipeline(self.open_capture(), self.process_fn, self.name)
+                pipeline.render = video or self.subscribers > 0
+                pipeline.start()
+                self.pipeline = pipeline
+            if video:
+                self.subscribers += 1
+            else:
+                self.event_subscribers += 1
+            self.pipeline.render = self.subscribers > 0
+            return self.pipeline
+
+    def unsubscribe(self, video=True):
+        """Hủy đăng ký, dừng pipeline nếu không còn ai xem hoặc nhận kết quả"""
+        with self._lock:
+            if video:
+                self.subscribers = max(0, self.subscribers - 1)
+            else:
+                self.event_subscribers = max(0, self.event_subscribers - 1)
+            if self.subscribers == 0 and self.event_subscribers == 0:
+                self._stop_pipeline()
+            elif self.pipeline is not None:
+                self.pipeline.render = self.subscribers > 0
+
+    def close(self):
+        """Dừng pipeline bất kể số người xem (dùng khi tắt ứng dụng)"""
+        with self._lock:
+            self.subscribers = 0
+            self.event_subscribers = 0
+            self._stop_pipeline()
+
+    def _stop_pipeline(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+            self.release_capture()
+
+    def stats(self):
+        """Thống kê số người xem, số client nhận kết quả và pipeline hiện tại"""
+        pipeline = self.pipeline
+        return {
+            "subscribers": self.subscribers,
+            "event_subscribers": self.event_subscribers,
+            "pipeline": pipeline.stats() if pipeline is not None else None
+        }
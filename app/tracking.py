@@ -0,0 +1,158 @@
+import itertools
+import numpy as np
+from .config import TRACK_DETECT_INTERVAL, TRACK_REVERIFY_INTERVAL, TRACK_IOU_THRESHOLD, TRACK_MAX_MISSED
+
+
+def bbox_iou(box_a, box_b):
+    """Tính IoU của hai bounding box dạng [left, top, right, bottom]"""
+    left = max(box_a[0], box_b[0])
+    top = max(box_a[1], box_b[1])
+    right = min(box_a[2], box_b[2])
+    bottom = min(box_a[3], box_b[3])
+    intersection = max(0.0, right - left) * max(0.0, bottom - top)
+    area_a = max(0.0, box_a[2] - box_a[0]) * max(0.0, box_a[3] - box_a[1])
+    area_b = max(0.0, box_b[2] - box_b[0]) * max(0.0, box_b[3] - box_b[1])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class FaceTrack:
+    """Một khuôn mặt được theo dõi qua nhiều frame, giữ danh tính đã nhận diện"""
+
+    def __init__(self, track_id, bbox, frame_index):
+        self.track_id = track_id
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        # Vị trí phát hiện gần nhất (bbox bị predict() dời đi ở các frame giữa, không dùng để tính vận tốc)
+        self.detected_bbox = self.bbox
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.match_info = None
+        self.similarity = -1
+        self.misses = 0
+        self.last_detected_frame = frame_index
+        self.last_recognized_frame = None
+
+    def predict(self):
+        """Dự đoán vị trí ở frame tiếp theo theo vận tốc hiện tại"""
+        self.bbox = self.bbox + self.velocity
+
+    def update(self, bbox, frame_index):
+        """Cập nhật vị trí theo kết quả phát hiện mới"""
+        bbox = np.asarray(bbox, dtype=np.float32)
+        elapsed = max(1, frame_index - self.last_detected_frame)
+        # Vận tốc được làm mượt để giảm rung
+        self.velocity = 0.5 * self.velocity + 0.5 * (bbox - self.detected_bbox) / elapsed
+        self.bbox = bbox
+        self.detected_bbox = bbox
+        self.misses = 0
+        self.last_detected_frame = frame_index
+
+
+class FaceTracker:
+    """Theo dõi khuôn mặt bằng IoU để bỏ qua phát hiện/nhận diện lặp lại
+
+    Phát hiện chạy mỗi detect_interval frame (hoặc ngay frame sau nếu có track bị mất); nhận diện chỉ
+    chạy cho track mới và khi track quá reverify_interval frame chưa được xác minh lại. Ở các frame
+    giữa, vị trí track được dự đoán và danh tính/độ tương đồng được giữ nguyên.
+    """
+
+    def __init__(self, detect_interval=TRACK_DETECT_INTERVAL, reverify_interval=TRACK_REVERIFY_INTERVAL,
+                 iou_threshold=TRACK_IOU_THRESHOLD, max_missed=TRACK_MAX_MISSED):
+        self.detect_interval = max(1, detect_interval)
+        self.reverify_interval = reverify_interval
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self.frame_index = 0
+        self._last_detection_frame = None
+        self._lost_tracks = False
+        self._track_ids = itertools.count(1)
+        self.detections = 0
+        self.recognitions = 0
+
+    def _should_detect(self):
+        if self._last_detection_frame is None or self._lost_tracks:
+            return True
+        return self.frame_index - self._last_detection_frame >= self.detect_interval
+
+    def update(self, frame, detect_fn, embed_fn, recognize_fn):
+        """Xử lý một frame và trả về các track đang hiển thị
+
+        detect_fn(frame) -> danh sách khuôn mặt có thuộc tính bbox
+        embed_fn(frame, faces) -> danh sách embedding tương ứng
+        recognize_fn(embeddings) -> danh sách (match_info, similarity)
+        """
+        self.frame_index += 1
+        if not self._should_detect():
+            for track in self.tracks:
+                track.predict()
+            return [track for track in self.tracks if track.misses == 0]
+
+        faces = detect_fn(frame)
+        self.detections += 1
+        self._last_detection_frame = self.frame_index
+        matched_faces = self._associate(faces)
+
+        # Chỉ nhận diện track mới hoặc track đến hạn xác minh lại
+        to_recognize = [(track, face) for track, face in matched_faces
+                        if track.last_recognized_frame is None
+                        or self.frame_index - track.last_recognized_frame >= self.reverify_interval]
+        if to_recognize:
+            embeddings = embed_fn(frame, [face for _, face in to_recognize])
+            results = recognize_fn(embeddings)
+            self.recognitions += len(to_recognize)
+            for (track, _), (match_info, similarity) in zip(to_recognize, results):
+                track.match_info = match_info
+                track.similarity = similarity
+                track.last_recognized_frame = self.frame_index
+
+        return [track for track in self.tracks if track.misses == 0]
+
+    def _associate(self, faces):
+        """Ghép khuôn mặt vừa phát hiện với track hiện có theo IoU (tham lam), tạo track cho phần còn lại"""
+        for track in self.tracks:
+            track.predict()
+
+        pairs = []
+        for track_index, track in enumerate(self.tracks):
+            for face_index, face in enumerate(faces):
+                iou = bbox_iou(track.bbox, face.bbox)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, track_index, face_index))
+        pairs.sort(reverse=True)
+
+        matched_tracks = set()
+        matched_face_indices = set()
+        matched_faces = []
+        for _, track_index, face_index in pairs:
+            if track_index in matched_tracks or face_index in matched_face_indices:
+                continue
+            matched_tracks.add(track_index)
+            matched_face_indices.add(face_index)
+            track = self.tracks[track_index]
+            track.update(faces[face_index].bbox, self.frame_index)
+            matched_faces.append((track, faces[face_index]))
+
+        # Track không được ghép bị tính là mất một lần, quá max_missed thì xóa
+        self._lost_tracks = False
+        for track_index, track in enumerate(self.tracks):
+            if track_index not in matched_tracks:
+                track.misses += 1
+                self._lost_tracks = True
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_missed]
+
+        for face_index, face in enumerate(faces):
+            if face_index not in matched_face_indices:
+                track = FaceTrack(next(self._track_ids), face.bbox, self.frame_index)
+                self.tracks.append(track)
+                matched_faces.append((track, face))
+
+        return matched_faces
+
+    def stats(self):
+        """Số frame, số lần phát hiện và số khuôn mặt đã nhận diện"""
+        return {
+            "frames": self.frame_index,
+            "detections": self.detections,
+            "recognitions": self.recognitions,
+            "active_tracks": len(self.tracks)
+        }
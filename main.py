@@ -1,34 +1,92 @@
 import cv2
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from typing import List, Optional
 from contextlib import asynccontextmanager
 from datetime import datetime
 import os
+import shutil
+import tempfile
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
-from app.config import DATASET_DIR
-from app.database import setup_database, check_user_exists, add_user, add_face_image, get_all_users, get_user_face_images, get_user_face_data
-from app.face_recognition import face_analyzer, face_database, load_face_database, process_frame
+_import_started = time.perf_counter()
+from app.config import (DATASET_DIR, FACE_MODEL_NAME, MODEL_WARMUP, EMBED_CROSS_CAMERA_BATCHING,
+                        PROFILER_INTERVAL_MS, PROFILER_MAX_SECONDS, DEFAULT_CAMERA_ID, TRACKING_ENABLED,
+                        REGISTRATION_WORKERS, MAX_CONCURRENT_REGISTRATIONS, MOTION_GATING_ENABLED, MOTION_ROI,
+                        EVENT_POLL_INTERVAL_SECONDS, EVENT_HEARTBEAT_SECONDS,
+                        DETECTION_ROI, DETECTION_MODE, DETECTION_DEFAULT_MODE)
+from app.database import (setup_database, check_user_exists, add_user, add_face_images, get_all_users, get_user_face_images,
+                          get_user_face_data, get_user, delete_user, save_face_embeddings, transaction)
+from app.face_recognition import (get_face_analyzer, analyzer_pool, load_face_database, process_frame, get_face_gallery, set_face_database,
+                                  upsert_gallery_user, remove_gallery_user, compute_content_hash, embedding_to_bytes,
+                                  prepare_face_analyzer, model_status, startup_timings, embedding_batcher,
+                                  initialize_face_gallery, gallery_status, shared_gallery, index_saver)
 from app.camera import CameraManager
-from app.attendance import get_attendance_records
+from app.stream import BroadcastHub
+from app.tracking import FaceTracker
+from app.motion import MotionGate
+from app.detection import AdaptiveDetector
+from app.attendance import (get_attendance_records, attendance_writer, query_attendance, migrate_attendance_csv,
+                            export_attendance, decode_cursor, get_attendance_summary_records)
+from app.bulk_import import start_import_job, extract_archive, import_jobs
+from app.metrics import registry
+from app.profiler import profiler
+startup_timings["import_seconds"] = round(time.perf_counter() - _import_started, 3)
+
+# Trạng thái khởi động nền (tải mô hình, warm-up, nạp gallery)
+startup_state = {"gallery_loaded": False, "error": None}
+
+def initialize_recognition(startup_started):
+    """Tải mô hình, warm-up và nạp gallery; chạy nền để server nhận request ngay khi khởi động"""
+    try:
+        prepare_face_analyzer(warm_up=MODEL_WARMUP)
+        start = time.perf_counter()
+        initialize_face_gallery()
+        startup_timings["gallery_load_seconds"] = round(time.perf_counter() - start, 3)
+        startup_state["gallery_loaded"] = True
+        print(f"Đã tải {len(get_face_gallery())} người dùng vào CSDL")
+    except Exception as e:
+        startup_state["error"] = str(e)
+        print(f"Khởi động mô hình thất bại: {e}")
+    finally:
+        startup_timings["startup_seconds"] = round(time.perf_counter() - startup_started, 3)
+        print(f"Thời gian khởi động: {startup_timings}")
 
 # Tạo context manager để tải face database khi khởi động ứng dụng
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Tải face database khi khởi động ứng dụng và giải phóng tài nguyên khi đóng"""
-    global face_database
+    """Khởi tạo CSDL, tải mô hình và face database (chạy nền) khi khởi động ứng dụng và giải phóng tài nguyên khi đóng"""
+    startup_started = time.perf_counter()
     setup_database()
-    user_face_data = get_user_face_data()
-    face_database = load_face_database(user_face_data)
-    print(f"Đã tải {len(face_database)} người dùng vào CSDL")
+    imported_events = migrate_attendance_csv()
+    if imported_events:
+        print(f"Đã nhập {imported_events} bản ghi điểm danh từ file CSV")
+    attendance_writer.start()
+    if EMBED_CROSS_CAMERA_BATCHING:
+        embedding_batcher.start()
+    # Theo dõi tiến trình bằng /health/ready
+    asyncio.get_running_loop().run_in_executor(None, initialize_recognition, startup_started)
     
     yield  # Ứng dụng hoạt động
 
-    # Giải phóng tài nguyên camera khi ứng dụng đóng
+    # Dừng pipeline stream và giải phóng tài nguyên camera khi ứng dụng đóng
+    for hub in camera_hubs.values():
+        hub.close()
     camera_manager = CameraManager.get_instance()
-    camera_manager.release_camera()
+    camera_manager.release_all()
+    registration_executor.shutdown(wait=True)
+    embedding_batcher.stop()
+    if shared_gallery is not None:
+        shared_gallery.stop()
+    # Ghi nốt chỉ mục ANN còn chờ (sau các lần đăng ký/xóa gần nhất)
+    index_saver.flush()
+    # Ghi nốt các bản ghi điểm danh còn trong hàng đợi
+    attendance_writer.stop()
     print("Ứng dụng đang tắt: Đã giải phóng tài nguyên camera")
 
 # Thêm CORS middleware: giúp kiểm soát quyền truy cập tài nguyên giữa các trang web có nguồn gốc khác nhau
@@ -43,6 +101,120 @@ app.add_middleware(
     allow_methods=["*"], # Cho phép tất cả phương thức HTTP (GET, POST, PUT, DELETE...)
     allow_headers=["*"], # Cho phép tất cả các headers được gửi trong request
 )
+def reserve_image_paths(user_folder, name, count):
+    """Giữ chỗ count file ảnh name_XXXX.jpg tiếp theo trong thư mục người dùng
+    
+    Mỗi file được tạo rỗng bằng O_CREAT | O_EXCL nên hai yêu cầu đồng thời cho cùng người dùng
+    (thêm ảnh, đăng ký trùng) không bao giờ nhận cùng một tên file và ghi đè ảnh của nhau.
+    """
+    paths = []
+    sequence_number = 1
+    while len(paths) < count:
+        image_path = os.path.join(user_folder, f"{name}_{sequence_number:04d}.jpg")
+        sequence_number += 1
+        try:
+            os.close(os.open(image_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            continue
+        paths.append(image_path)
+    return paths
+
+# Luồng xử lý ảnh đăng ký (giải mã, phát hiện/trích xuất embedding, ghi file) để không chặn event loop
+registration_executor = ThreadPoolExecutor(max_workers=REGISTRATION_WORKERS, thread_name_prefix="registration")
+# Giới hạn số yêu cầu đăng ký được xử lý đồng thời, các yêu cầu khác phải chờ
+registration_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REGISTRATIONS)
+
+def analyze_face_image(contents):
+    """Giải mã và kiểm tra một ảnh đăng ký, trả về (ảnh, embedding, None) hoặc (None, None, lý do từ chối)"""
+    nparr = np.frombuffer(contents, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    if img is None:
+        return None, None, "undecodable"
+    
+    # Phát hiện khuôn mặt
+    faces = get_face_analyzer().get(img)
+    
+    if not faces:
+        return None, None, "no_face"
+    
+    if len(faces) > 1:
+        return None, None, "multiple_faces"  # Bỏ qua những bức ảnh có nhiều hơn 1 khuôn mặt
+    
+    return img, faces[0].normed_embedding, None
+
+def write_face_image(image_path, img):
+    """Ghi ảnh ra đĩa, trả về hash nội dung hoặc None nếu lỗi"""
+    success, buffer = cv2.imencode('.jpg', img)
+    if not success:
+        print(f"Lỗi: Không thể lưu ảnh tại {image_path}")
+        os.remove(image_path)  # Bỏ file đã giữ chỗ
+        return None
+    data = buffer.tobytes()
+    with open(image_path, 'wb') as file:
+        file.write(data)
+    return compute_content_hash(data)
+
+def store_face_images(user_id, saved_images, new_user_name=None):
+    """Lưu người dùng mới (nếu có), đường dẫn ảnh và embedding trong một transaction
+    
+    Nếu ghi CSDL thất bại, các file ảnh vừa ghi sẽ bị xóa để không để lại dữ liệu dở dang.
+    """
+    try:
+        with transaction():
+            if new_user_name is not None:
+                add_user(user_id, new_user_name)
+            add_face_images([(user_id, image_path) for image_path, _, _ in saved_images])
+            # Lưu embedding (tái sử dụng kết quả vừa tính) vào cache
+            save_face_embeddings([(image_path, FACE_MODEL_NAME, content_hash, embedding_to_bytes(embedding))
+                                  for image_path, embedding, content_hash in saved_images])
+    except Exception:
+        for image_path, _, _ in saved_images:
+            if os.path.exists(image_path):
+                os.remove(image_path)
+        raise
+
+async def save_face_images(user_id, name, face_images, user_folder):
+    """Xử lý đồng thời các ảnh và ghi ảnh hợp lệ ra đĩa (chưa ghi CSDL, xem store_face_images)
+    
+    Trả về (danh sách (đường dẫn, embedding, hash) đã ghi, danh sách ảnh bị từ chối kèm lý do).
+    """
+    loop = asyncio.get_running_loop()
+    contents_list = [await face_image.read() for face_image in face_images]
+    
+    # Phân tích tất cả ảnh song song trong thread pool
+    results = await asyncio.gather(*[
+        loop.run_in_executor(registration_executor, analyze_face_image, contents)
+        for contents in contents_list
+    ])
+    
+    rejected = []
+    valid = []
+    for face_image, (img, embedding, reason) in zip(face_images, results):
+        if reason is not None:
+            rejected.append({"filename": face_image.filename, "reason": reason})
+            continue
+        valid.append((face_image, img, embedding))
+    
+    # Tên file theo cấu trúc name_0001.jpg (theo thứ tự ảnh được gửi lên), giữ chỗ trước khi ghi
+    image_paths = await loop.run_in_executor(registration_executor, reserve_image_paths, user_folder, name, len(valid))
+    accepted = [(face_image, image_path, img, embedding)
+                for (face_image, img, embedding), image_path in zip(valid, image_paths)]
+    
+    written = await asyncio.gather(*[
+        loop.run_in_executor(registration_executor, write_face_image, image_path, img)
+        for _, image_path, img, _ in accepted
+    ])
+    
+    saved_images = []
+    for (face_image, image_path, _, embedding), content_hash in zip(accepted, written):
+        if content_hash is not None:
+            saved_images.append((image_path, embedding, content_hash))
+        else:
+            rejected.append({"filename": face_image.filename, "reason": "write_failed"})
+    
+    return saved_images, rejected
+
 # API endpoints
 @app.post("/register_face", 
     summary="Đăng ký khuôn mặt người dùng mới",
@@ -59,6 +231,11 @@ async def register_face(
     if not face_images:
         return JSONResponse(status_code=400, content={"error": "Không có ảnh nào được chọn"})
     
+    async with registration_semaphore:
+        return await _register_face(user_id, name, face_images)
+
+async def _register_face(user_id, name, face_images):
+    """Phần xử lý của register_face, chạy bên trong giới hạn số đăng ký đồng thời"""
     try:
         # Kiểm tra id đã tồn tại hay chưa
         if check_user_exists(user_id):
@@ -67,67 +244,168 @@ async def register_face(
                 content={"error": f"ID người dùng '{user_id}' đã tồn tại. Vui lòng chọn ID khác."}
             )
         
-        # Thêm người dùng mới
-        add_user(user_id, name)
-        
         # Tạo thư mục người dùng
         user_folder = os.path.join(DATASET_DIR, f"{user_id}_{name}")
         os.makedirs(user_folder, exist_ok=True)
         
-        saved_images = []
-        sequence_number = 1
-        
-        # Xử lý từng ảnh
-        for face_image in face_images:
-            contents = await face_image.read()
-            nparr = np.frombuffer(contents, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if img is None:
-                continue
-            
-            # Phát hiện khuôn mặt
-            faces = face_analyzer.get(img)
-            
-            if not faces:
-                continue
-            
-            if len(faces) > 1:
-                continue  # Bỏ qua những bức ảnh có nhiều hơn 1 khuôn mặt
-            
-            # Tạo tên file theo cấu trúc name_0001.jpg
-            image_filename = f"{name}_{sequence_number:04d}.jpg"
-            sequence_number += 1
-            
-            image_path = os.path.join(user_folder, image_filename)
-            success = cv2.imwrite(image_path, img)
-            if not success:
-                print(f"Lỗi: Không thể lưu ảnh tại {image_path}")
-                continue
-            
-            # Lưu đường dẫn vào database
-            add_face_image(user_id, image_path)
-            saved_images.append(image_path)
+        saved_images, rejected = await save_face_images(user_id, name, face_images, user_folder)
         
         # Nếu không có ảnh nào hợp lệ, trả về lỗi
         if not saved_images:
-            return JSONResponse(status_code=400, content={"error": "Không có ảnh hợp lệ"})
+            return JSONResponse(status_code=400, content={"error": "Không có ảnh hợp lệ", "rejected": rejected})
         
-        # Cập nhật face database
-        global face_database
-        user_face_data = get_user_face_data()
-        face_database = load_face_database(user_face_data)
+        # Thêm người dùng mới cùng toàn bộ ảnh trong một transaction
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(registration_executor, store_face_images, user_id, saved_images, name)
+        
+        # Cập nhật face database cho riêng người dùng này
+        await loop.run_in_executor(
+            registration_executor, upsert_gallery_user, user_id, name, [embedding for _, embedding, _ in saved_images])
         
         return {
             "message": "Đăng ký thành công", 
             "user_id": user_id,
             "name": name,
-            "image_count": len(saved_images)
+            "image_count": len(saved_images),
+            "rejected": rejected
         }
         
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Đăng ký thất bại: {str(e)}"})
 
+@app.post("/user/{user_id}/faces",
+    summary="Thêm ảnh khuôn mặt cho người dùng",
+    description="Thêm ảnh khuôn mặt mới cho người dùng đã đăng ký. Embedding của người dùng được cập nhật ngay mà không cần tải lại toàn bộ CSDL.",
+    response_description="Số lượng ảnh hợp lệ đã được thêm"
+)
+async def add_user_faces(
+    user_id: str,
+    face_images: List[UploadFile] = File(..., description="Danh sách các ảnh khuôn mặt bổ sung")
+):
+    """Thêm ảnh khuôn mặt cho người dùng đã tồn tại"""
+    if not face_images:
+        return JSONResponse(status_code=400, content={"error": "Không có ảnh nào được chọn"})
+    
+    try:
+        user = get_user(user_id)
+        if user is None:
+            return JSONResponse(status_code=404, content={"error": f"Không tìm thấy người dùng '{user_id}'"})
+        
+        name = user["name"]
+        user_folder = os.path.join(DATASET_DIR, f"{user_id}_{name}")
+        os.makedirs(user_folder, exist_ok=True)
+        
+        async with registration_semaphore:
+            saved_images, rejected = await save_face_images(user_id, name, face_images, user_folder)
+            if not saved_images:
+                return JSONResponse(status_code=400, content={"error": "Không có ảnh hợp lệ", "rejected": rejected})
+            
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(registration_executor, store_face_images, user_id, saved_images)
+            
+            # Tính lại embedding trung bình từ cache (gồm cả ảnh cũ và ảnh mới)
+            await loop.run_in_executor(registration_executor, upsert_gallery_user, user_id, name, None)
+        
+        return {
+            "message": "Thêm ảnh thành công",
+            "user_id": user_id,
+            "name": name,
+            "image_count": len(saved_images),
+            "rejected": rejected
+        }
+    
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"Thêm ảnh thất bại: {str(e)}"})
+
+@app.delete("/user/{user_id}",
+    summary="Xóa người dùng",
+    description="Xóa người dùng, ảnh khuôn mặt và embedding của người dùng khỏi hệ thống. Lịch sử điểm danh được giữ lại.",
+    response_description="Xác nhận người dùng đã bị xóa"
+)
+async def remove_user(user_id: str):
+    """Xóa người dùng khỏi hệ thống"""
+    user = get_user(user_id)
+    if user is None:
+        return JSONResponse(status_code=404, content={"error": f"Không tìm thấy người dùng '{user_id}'"})
+    
+    # Cập nhật gallery (có thể ghi lại chỉ mục ANN) và xóa file trong thread pool để không chặn stream
+    loop = asyncio.get_running_loop()
+    image_paths = await loop.run_in_executor(registration_executor, delete_user_data, user_id, user["name"])
+    
+    return {"message": "Xóa người dùng thành công", "user_id": user_id, "image_count": len(image_paths)}
+
+def delete_user_data(user_id, name):
+    """Gỡ người dùng khỏi gallery, xóa khỏi CSDL và xóa ảnh trên đĩa, trả về danh sách ảnh đã xóa"""
+    # Gỡ khỏi face database trước để stream ngừng nhận diện người này ngay
+    remove_gallery_user(user_id)
+    image_paths = delete_user(user_id)
+    for image_path in image_paths:
+        if os.path.exists(image_path):
+            os.remove(image_path)
+    shutil.rmtree(os.path.join(DATASET_DIR, f"{user_id}_{name}"), ignore_errors=True)
+    return image_paths
+
+def reload_gallery():
+    """Tải lại toàn bộ gallery từ SQLite (embedding lấy từ cache nên chỉ ảnh mới mới phải nhận diện)"""
+    set_face_database(load_face_database(get_user_face_data()))
+    print(f"Đã tải lại {len(get_face_gallery())} người dùng vào gallery")
+
+@app.post("/bulk_import",
+    summary="Nhập hàng loạt người dùng",
+    description="Nhận file zip hoặc đường dẫn thư mục trên server có cấu trúc {user_id}_{name}/*.jpg. Ảnh được xử lý song song bằng nhiều tiến trình và ghi vào CSDL theo lô; gallery được tải lại một lần khi hoàn tất. Gửi lại cùng dữ liệu sẽ tiếp tục phần còn dở.",
+    response_description="Mã và tiến độ của lượt nhập"
+)
+async def bulk_import(
+    archive: Optional[UploadFile] = File(None, description="File zip chứa các thư mục {user_id}_{name}"),
+    directory: Optional[str] = Form(None, description="Đường dẫn thư mục trên server")
+):
+    """Bắt đầu nhập hàng loạt chạy nền"""
+    if archive is None and not directory:
+        return JSONResponse(status_code=400, content={"error": "Cần gửi file zip hoặc đường dẫn thư mục"})
+    
+    staging_dir = None
+    if archive is not None:
+        staging_dir = tempfile.mkdtemp(prefix="bulk_import_")
+        archive_path = os.path.join(staging_dir, "upload.zip")
+        with open(archive_path, 'wb') as file:
+            while chunk := await archive.read(1024 * 1024):
+                file.write(chunk)
+        try:
+            root = await asyncio.get_running_loop().run_in_executor(
+                None, extract_archive, archive_path, os.path.join(staging_dir, "data"))
+        except Exception as e:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return JSONResponse(status_code=400, content={"error": f"File zip không hợp lệ: {str(e)}"})
+    else:
+        if not os.path.isdir(directory):
+            return JSONResponse(status_code=400, content={"error": f"Không tìm thấy thư mục '{directory}'"})
+        root = directory
+    
+    job = start_import_job(root, on_complete=lambda job: reload_gallery(), cleanup_path=staging_dir)
+    return job.progress()
+
+@app.get("/bulk_import/{job_id}",
+    summary="Tiến độ nhập hàng loạt",
+    description="Trả về tiến độ, tốc độ xử lý (ảnh/giây) và số ảnh bị loại theo lý do của một lượt nhập.",
+    response_description="Tiến độ lượt nhập"
+)
+async def bulk_import_progress(job_id: str):
+    """Tiến độ nhập hàng loạt"""
+    job = import_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Không tìm thấy lượt nhập '{job_id}'"})
+    return job.progress()
+
+@app.post("/gallery/reload",
+    summary="Tải lại gallery",
+    description="Tải lại toàn bộ người dùng từ CSDL vào gallery, ví dụ sau khi nhập hàng loạt bằng dòng lệnh.",
+    response_description="Số người dùng trong gallery"
+)
+async def gallery_reload():
+    """Tải lại gallery từ CSDL"""
+    await asyncio.get_running_loop().run_in_executor(None, reload_gallery)
+    return {"user_count": len(get_face_gallery())}
+
 @app.get("/users",
     summary="Lấy danh sách người dùng",
     description="Trả về danh sách tất cả người dùng đã đăng ký trong hệ thống.",
@@ -148,6 +426,29 @@ async def get_user_faces(user_id: str):
     face_images = get_user_face_images(user_id)
     return {"user_id": user_id, "face_images": face_images}
 
+# Phải khai báo trước /attendance/{date} để "summary" không bị hiểu là một ngày
+@app.get("/attendance/summary",
+    summary="Tổng hợp điểm danh theo ngày",
+    description="Trả về giờ xuất hiện đầu tiên, cuối cùng và số lần ghi nhận của từng người dùng mỗi ngày trong khoảng start_date..end_date (YYYY-MM-DD, mặc định hôm nay), có thể lọc theo user_id. Dữ liệu được tính sẵn khi ghi điểm danh nên không phải quét lại log.",
+    response_description="Danh sách dòng tổng hợp theo ngày và người dùng"
+)
+async def get_attendance_summary(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    user_id: Optional[str] = None
+):
+    """Lấy tổng hợp điểm danh theo ngày"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    start_date = start_date or today
+    end_date = end_date or start_date
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Ngày phải có định dạng YYYY-MM-DD"})
+    records = get_attendance_summary_records(start_date, end_date, user_id)
+    return {"start_date": start_date, "end_date": end_date, "records": records}
+
 @app.get("/attendance/{date}",
     summary="Lấy dữ liệu điểm danh theo ngày",
     description="Trả về dữ liệu điểm danh của tất cả người dùng trong ngày được chỉ định, định dạng YYYY-MM-DD.",
@@ -169,31 +470,225 @@ async def get_today_attendance():
     today = datetime.now().strftime("%Y-%m-%d")
     return {"date": today, "records": records}
 
+# Bộ lọc chuyển động và bộ phát hiện của từng camera (để báo cáo thống kê)
+motion_gates = {}
+camera_detectors = {}
+
+def make_camera_processor(camera_id):
+    """Tạo hàm nhận diện cho một camera, mượn phiên mô hình từ nhóm dùng chung"""
+    # Mỗi camera có tracker riêng (chỉ luồng nhận diện của camera đó dùng)
+    tracker = FaceTracker() if TRACKING_ENABLED else None
+    gate = MotionGate(roi=MOTION_ROI.get(camera_id)) if MOTION_GATING_ENABLED else None
+    if gate is not None:
+        motion_gates[camera_id] = gate
+    detector = AdaptiveDetector(roi=DETECTION_ROI.get(camera_id),
+                                mode=DETECTION_MODE.get(camera_id, DETECTION_DEFAULT_MODE))
+    camera_detectors[camera_id] = detector
+    
+    def process(frame, draw=True):
+        # Khung hình không đổi: dùng lại kết quả và chú thích cũ, không gọi mô hình
+        if gate is not None and not gate.should_process(frame, draw):
+            return (gate.overlay(frame) if draw else None), gate.last_results()
+        with analyzer_pool.session() as analyzer:
+            display_frame, recognized_users = process_frame(frame, get_face_gallery(), analyzer=analyzer,
+                                                            camera_id=camera_id, tracker=tracker, detector=detector,
+                                                            draw=draw)
+        if gate is not None:
+            gate.remember(frame, display_frame, recognized_users)
+        return display_frame, recognized_users
+    return process
+
+def make_camera_hub(camera_id):
+    """Tạo hub chia sẻ một pipeline (đọc camera -> nhận diện -> mã hóa JPEG) cho mọi người xem camera"""
+    camera_manager = CameraManager.get_instance()
+    return BroadcastHub(
+        lambda: camera_manager.get_camera(camera_id),
+        lambda: camera_manager.release_camera(camera_id),
+        make_camera_processor(camera_id),
+        name=camera_id
+    )
+
+# Mỗi camera có một hub (luồng đọc và luồng nhận diện riêng)
+camera_hubs = {camera_id: make_camera_hub(camera_id) for camera_id in CameraManager.get_instance().camera_ids}
+
+@app.get("/attendance_events",
+    summary="Tra cứu điểm danh theo khoảng ngày",
+    description="Trả về bản ghi điểm danh trong khoảng ngày (YYYY-MM-DD), có thể lọc theo user_id. Kết quả được phân trang: truyền next_cursor của trang trước vào cursor để lấy trang tiếp theo.",
+    response_description="Danh sách bản ghi điểm danh và cursor của trang tiếp theo"
+)
+async def get_attendance_events_page(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Tra cứu điểm danh theo khoảng ngày với phân trang keyset"""
+    try:
+        records, next_cursor = query_attendance(start_date, end_date, user_id, cursor, limit)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Cursor không hợp lệ"})
+    return {"start_date": start_date, "end_date": end_date, "user_id": user_id,
+            "records": records, "next_cursor": next_cursor}
+
+@app.get("/user/{user_id}/attendance",
+    summary="Lịch sử điểm danh của người dùng",
+    description="Trả về lịch sử điểm danh của một người dùng, có thể giới hạn theo khoảng ngày, phân trang bằng cursor.",
+    response_description="Danh sách bản ghi điểm danh của người dùng và cursor của trang tiếp theo"
+)
+async def get_user_attendance(
+    user_id: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Lịch sử điểm danh của một người dùng"""
+    try:
+        records, next_cursor = query_attendance(start_date, end_date, user_id, cursor, limit)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Cursor không hợp lệ"})
+    return {"user_id": user_id, "records": records, "next_cursor": next_cursor}
+
+@app.get("/attendance_export",
+    summary="Xuất dữ liệu điểm danh",
+    description="Xuất điểm danh trong khoảng ngày (YYYY-MM-DD) dạng CSV hoặc NDJSON, có thể lọc theo user_id và nén gzip. Dữ liệu được stream nên bộ nhớ không phụ thuộc số bản ghi. Mỗi dòng có cột cursor; nếu tải bị gián đoạn, gọi lại với cursor của dòng cuối cùng đã nhận để tải tiếp.",
+    response_description="File CSV/NDJSON (hoặc .gz) được stream"
+)
+async def attendance_export(
+    start_date: str,
+    end_date: str,
+    user_id: Optional[str] = None,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    cursor: Optional[str] = None
+):
+    """Xuất điểm danh theo khoảng ngày"""
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Ngày (YYYY-MM-DD) hoặc cursor không hợp lệ"})
+    
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"attendance_{start_date}_{end_date}.{format}"
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        export_attendance(start_date, end_date, user_id, format, gzip, cursor),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/attendance_writer/stats",
+    summary="Thống kê bộ ghi điểm danh",
+    description="Trả về số bản ghi đang chờ trong hàng đợi, số lần ghi và thời gian ghi (ms) của bộ ghi điểm danh nền.",
+    response_description="Thống kê bộ ghi điểm danh"
+)
+async def attendance_writer_stats():
+    """Thống kê bộ ghi điểm danh"""
+    return attendance_writer.stats()
+
 # Generator để stream video
-def generate_frames():
+def generate_frames(camera_id=DEFAULT_CAMERA_ID):
     """Generator để stream video"""
-    camera_manager = CameraManager.get_instance()
-    cap = camera_manager.get_camera()
+    hub = camera_hubs[camera_id]
+    pipeline = hub.subscribe()
     
     try:
+        sequence = 0
         while True:
-            success, frame = cap.read()
-            if not success:
-                break
-            
-            # Xử lý frame cho nhận diện
-            processed_frame, _ = process_frame(frame, face_database)
-            
-            # Chuyển đổi frame thành JPEG
-            _, buffer = cv2.imencode('.jpg', processed_frame)
-            frame_bytes = buffer.tobytes()
+            result = pipeline.wait_for_frame(sequence)
+            if result is None:
+                if not pipeline.running:
+                    break
+                continue
+            sequence, frame_part = result
             
-            # Yield frame cho streaming
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            # Yield frame cho streaming (cùng một bytes object cho mọi người xem)
+            yield frame_part
     
     except Exception as e:
         print(f"Lỗi stream: {e}")
+    finally:
+        hub.unsubscribe()
+
+async def generate_events(camera_ids, user_ids=None):
+    """Generator Server-Sent Events: phát kết quả nhận diện (không có video) của các camera được chọn
+    
+    Chỉ gửi frame có khuôn mặt (sau khi lọc theo user_ids), cộng một frame rỗng khi khuôn mặt vừa rời đi.
+    """
+    loop = asyncio.get_running_loop()
+    hubs = {camera_id: camera_hubs[camera_id] for camera_id in camera_ids}
+    pipelines = {}
+    for camera_id, hub in hubs.items():
+        # Mở camera có thể chặn, chạy ngoài event loop
+        pipelines[camera_id] = await loop.run_in_executor(None, hub.subscribe, False)
+    sequences = {camera_id: 0 for camera_id in hubs}
+    had_faces = {camera_id: False for camera_id in hubs}
+    last_sent = time.monotonic()
+    
+    try:
+        while True:
+            for camera_id, hub in hubs.items():
+                pipeline = pipelines[camera_id]
+                if hub.pipeline is not pipeline and hub.pipeline is not None:
+                    # Pipeline đã được mở lại (ví dụ sau khi mất camera): đọc từ đầu
+                    pipeline = pipelines[camera_id] = hub.pipeline
+                    sequences[camera_id] = 0
+                for sequence, timestamp, recognized_users in pipeline.results_since(sequences[camera_id]):
+                    sequences[camera_id] = sequence
+                    faces = [user for user in recognized_users if not user_ids or user["user_id"] in user_ids]
+                    if not faces and not had_faces[camera_id]:
+                        continue
+                    had_faces[camera_id] = bool(faces)
+                    payload = json.dumps({"camera_id": camera_id, "sequence": sequence,
+                                          "timestamp": timestamp, "faces": faces}, ensure_ascii=False)
+                    yield f"event: recognition\ndata: {payload}\n\n"
+                    last_sent = time.monotonic()
+            
+            if time.monotonic() - last_sent >= EVENT_HEARTBEAT_SECONDS:
+                # Dòng chú thích giữ kết nối; đồng thời mở lại camera đã tự dừng
+                for camera_id, hub in hubs.items():
+                    if not pipelines[camera_id].running:
+                        await loop.run_in_executor(None, hub.unsubscribe, False)
+                        pipelines[camera_id] = await loop.run_in_executor(None, hub.subscribe, False)
+                        sequences[camera_id] = 0
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(EVENT_POLL_INTERVAL_SECONDS)
+    finally:
+        for hub in hubs.values():
+            await loop.run_in_executor(None, hub.unsubscribe, False)
+
+@app.get("/events",
+    summary="Luồng kết quả nhận diện (Server-Sent Events)",
+    description="Phát kết quả nhận diện dạng JSON (camera_id, sequence, timestamp, faces: bbox, user_id, name, confidence, attendance_logged, event, track_id) theo thời gian thực, không kèm video. Có thể chọn camera (camera_id, lặp lại để chọn nhiều camera, mặc định tất cả) và chỉ nhận kết quả của một số người dùng (user_id, lặp lại được). Khi không có ai xem video, camera bỏ qua bước vẽ và mã hóa JPEG.",
+    response_description="Luồng text/event-stream, mỗi sự kiện 'recognition' là một frame có khuôn mặt",
+    responses={
+        200: {
+            "content": {"text/event-stream": {}},
+            "description": "Luồng sự kiện nhận diện"
+        }
+    }
+)
+async def recognition_events(
+    camera_id: Optional[List[str]] = Query(None),
+    user_id: Optional[List[str]] = Query(None)
+):
+    """Luồng kết quả nhận diện không kèm video"""
+    camera_ids = camera_id or list(camera_hubs)
+    unknown = [name for name in camera_ids if name not in camera_hubs]
+    if unknown:
+        return JSONResponse(status_code=404, content={"error": f"Không tìm thấy camera: {', '.join(unknown)}"})
+    return StreamingResponse(
+        generate_events(camera_ids, set(user_id) if user_id else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Stream video với nhận diện khuôn mặt
 @app.get("/video_feed",
@@ -214,6 +709,156 @@ async def video_feed():
         media_type="multipart/x-mixed-replace; boundary=frame"
     )
 
+@app.get("/video_feed/stats",
+    summary="Thống kê pipeline stream video",
+    description="Trả về số người xem, tình trạng, FPS đọc camera, FPS nhận diện, FPS mã hóa, số frame bị bỏ, tỉ lệ frame được bộ lọc chuyển động bỏ qua, kích thước phát hiện hiện tại và độ trễ phát hiện theo kích thước của từng camera.",
+    response_description="Thống kê pipeline stream theo camera"
+)
+async def video_feed_stats():
+    """Thống kê pipeline stream video"""
+    return {"embedding": embedding_batcher.stats(), "cameras": {
+        camera_id: {**hub.stats(),
+                    "motion": motion_gates[camera_id].stats() if camera_id in motion_gates else None,
+                    "detection": camera_detectors[camera_id].stats() if camera_id in camera_detectors else None}
+        for camera_id, hub in camera_hubs.items()
+    }}
+
+@app.get("/video_feed/{camera_id}",
+    summary="Stream video của một camera",
+    description="Giống /video_feed nhưng cho camera được chỉ định theo tên cấu hình trong CAMERA_SOURCES.",
+    response_description="Luồng video JPEG được phân đoạn",
+    responses={
+        200: {
+            "content": {"multipart/x-mixed-replace": {}},
+            "description": "Luồng video từ camera"
+        }
+    }
+)
+async def camera_video_feed(camera_id: str):
+    """Stream video với nhận diện khuôn mặt của một camera"""
+    if camera_id not in camera_hubs:
+        return JSONResponse(status_code=404, content={"error": f"Không tìm thấy camera '{camera_id}'"})
+    return StreamingResponse(
+        generate_frames(camera_id),
+        media_type="multipart/x-mixed-replace; boundary=frame"
+    )
+
+@app.get("/cameras",
+    summary="Danh sách camera",
+    description="Trả về các camera đã cấu hình cùng tình trạng và FPS hiện tại.",
+    response_description="Danh sách camera"
+)
+async def get_cameras():
+    """Danh sách camera và tình trạng"""
+    camera_manager = CameraManager.get_instance()
+    cameras = []
+    for camera_id, hub in camera_hubs.items():
+        stats = hub.stats()
+        pipeline_stats = stats["pipeline"] or {}
+        cameras.append({
+            "camera_id": camera_id,
+            "source": str(camera_manager.get_source(camera_id)),
+            "active": stats["pipeline"] is not None,
+            "healthy": pipeline_stats.get("healthy", False),
+            "subscribers": stats["subscribers"],
+            "event_subscribers": stats["event_subscribers"],
+            "capture_fps": pipeline_stats.get("capture_fps", 0.0),
+            "inference_fps": pipeline_stats.get("inference_fps", 0.0)
+        })
+    return {"cameras": cameras}
+
+def collect_runtime_metrics():
+    """Số liệu đọc tại thời điểm scrape: pipeline từng camera, bộ lọc chuyển động, gallery, hàng đợi ghi điểm danh"""
+    frames = []
+    dropped = []
+    fps = []
+    viewers = []
+    skipped = []
+    for camera_id, hub in camera_hubs.items():
+        stats = hub.stats()
+        viewers.append(({"camera": camera_id, "kind": "video"}, stats["subscribers"]))
+        viewers.append(({"camera": camera_id, "kind": "events"}, stats["event_subscribers"]))
+        pipeline_stats = stats["pipeline"]
+        if pipeline_stats is not None:
+            for stage, key in (("captured", "frames_captured"), ("processed", "frames_processed"), ("encoded", "frames_encoded")):
+                frames.append(({"camera": camera_id, "stage": stage}, pipeline_stats[key]))
+            for stage, key in (("before_inference", "dropped_before_inference"), ("before_encode", "dropped_before_encode")):
+                dropped.append(({"camera": camera_id, "stage": stage}, pipeline_stats[key]))
+            for stage, key in (("capture", "capture_fps"), ("inference", "inference_fps"), ("encode", "encode_fps")):
+                fps.append(({"camera": camera_id, "stage": stage}, pipeline_stats[key]))
+        if camera_id in motion_gates:
+            skipped.append(({"camera": camera_id}, motion_gates[camera_id].skipped))
+    writer_stats = attendance_writer.stats()
+    return [
+        ("attendance_pipeline_frames_total", "counter", "Số frame theo giai đoạn của pipeline hiện tại", frames),
+        ("attendance_pipeline_dropped_frames_total", "counter", "Số frame bị bỏ do giai đoạn sau còn bận", dropped),
+        ("attendance_pipeline_fps", "gauge", "FPS theo giai đoạn", fps),
+        ("attendance_stream_subscribers", "gauge", "Số client đang xem video/nhận sự kiện", viewers),
+        ("attendance_motion_skipped_frames_total", "counter", "Số frame được bộ lọc chuyển động bỏ qua", skipped),
+        ("attendance_gallery_users", "gauge", "Số người dùng trong gallery", [({}, len(get_face_gallery()))]),
+        ("attendance_writer_queue_depth", "gauge", "Số bản ghi điểm danh đang chờ ghi", [({}, writer_stats["queue_depth"])]),
+        ("attendance_model_ready", "gauge", "Mô hình đã sẵn sàng (1) hay chưa (0)", [({}, int(model_status()["ready"]))]),
+    ]
+
+registry.register_collector(collect_runtime_metrics)
+
+@app.get("/metrics",
+    summary="Số liệu Prometheus",
+    description="Xuất số liệu dạng text của Prometheus: histogram thời gian từng giai đoạn (capture, detect, embed, recognize, draw, encode, csv_write, db_write), số khuôn mặt mỗi frame, phân bố độ tương đồng, số frame xử lý/bị bỏ, kích thước gallery và hàng đợi ghi điểm danh.",
+    response_description="Số liệu định dạng Prometheus text exposition",
+    response_class=PlainTextResponse
+)
+async def metrics():
+    """Số liệu cho Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/debug/profiler/start",
+    summary="Bật profiler lấy mẫu",
+    description="Bắt đầu lấy mẫu call stack của mọi luồng mỗi interval_ms mili giây; profiler tự tắt sau max_seconds giây.",
+    response_description="Trạng thái profiler"
+)
+async def start_profiler(
+    interval_ms: float = Query(PROFILER_INTERVAL_MS, gt=0, le=1000),
+    max_seconds: float = Query(PROFILER_MAX_SECONDS, gt=0, le=3600)
+):
+    """Bật profiler lấy mẫu"""
+    profiler.start(interval_ms, max_seconds)
+    return profiler.stats()
+
+@app.post("/debug/profiler/stop",
+    summary="Tắt profiler lấy mẫu",
+    description="Dừng lấy mẫu; kết quả được giữ lại đến lần bật tiếp theo.",
+    response_description="Trạng thái profiler và các hàm tốn thời gian nhất"
+)
+async def stop_profiler():
+    """Tắt profiler lấy mẫu"""
+    await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+    return {**profiler.stats(), "top_functions": profiler.top_functions()}
+
+@app.get("/debug/profiler",
+    summary="Kết quả profiler",
+    description="format=top: các hàm xuất hiện ở đỉnh stack nhiều nhất; format=collapsed: toàn bộ stack dạng collapsed (dùng với flamegraph.pl hoặc speedscope).",
+    response_description="Kết quả lấy mẫu"
+)
+async def profiler_results(format: str = Query("top", pattern="^(top|collapsed)$")):
+    """Xem kết quả profiler"""
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    return {**profiler.stats(), "top_functions": profiler.top_functions()}
+
+@app.get("/health/ready",
+    summary="Kiểm tra sẵn sàng",
+    description="Trả về 200 khi mô hình đã được tải, warm-up và gallery đã được nạp; 503 nếu còn đang khởi động hoặc khởi động lỗi. Kèm provider đang dùng và thời gian import/khởi động từng bước.",
+    response_description="Trạng thái sẵn sàng của mô hình và gallery"
+)
+async def readiness():
+    """Kiểm tra ứng dụng đã sẵn sàng nhận diện chưa"""
+    status = {**model_status(), **startup_state, "users": len(get_face_gallery()), "gallery": gallery_status()}
+    status["ready"] = status["ready"] and startup_state["gallery_loaded"]
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
 @app.get("/",
     summary="API gốc",
     description="Endpoint kiểm tra để xác nhận API đang hoạt động.",
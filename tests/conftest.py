@@ -0,0 +1,13 @@
+import pytest
+
+from app.database import close_connection, setup_database
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """CSDL SQLite trống trong thư mục tạm (DB_PATH là đường dẫn tương đối)"""
+    close_connection()
+    monkeypatch.chdir(tmp_path)
+    setup_database()
+    yield
+    close_connection()
@@ -0,0 +1,18 @@
+from app.bulk_import import ImportJob
+from app.database import fetchall, get_processed_image_paths
+
+
+def test_rejected_images_are_not_cached(database):
+    job = ImportJob("unused")
+    batch = [("1", "An", "src/1_An/a.jpg", "dataset/1_An/a.jpg"),
+             ("1", "An", "src/1_An/b.jpg", "dataset/1_An/b.jpg"),
+             ("2", "Binh", "src/2_Binh/c.jpg", "dataset/2_Binh/c.jpg")]
+    results = [("dataset/1_An/a.jpg", "hash-a", b"\x00" * 8, None),
+               ("dataset/1_An/b.jpg", "hash-b", None, "multiple_faces"),
+               ("dataset/2_Binh/c.jpg", "hash-c", None, "no_face")]
+    job._write_batch(batch, results)
+
+    assert job.accepted == 1
+    assert job.rejected == {"multiple_faces": 1, "no_face": 1}
+    assert [row[0] for row in fetchall("SELECT image_path FROM face_embeddings")] == ["dataset/1_An/a.jpg"]
+    assert get_processed_image_paths() == {"dataset/1_An/a.jpg"}
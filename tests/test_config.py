@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_config(gallery_storage):
+    env = dict(os.environ, GALLERY_STORAGE=gallery_storage)
+    return subprocess.run([sys.executable, "-c", "from app.config import GALLERY_STORAGE; print(GALLERY_STORAGE)"],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_gallery_storage_accepts_known_types():
+    result = import_config(" INT8 ")
+    assert result.returncode == 0
+    assert result.stdout.strip() == "int8"
+
+
+def test_gallery_storage_rejects_unknown_type():
+    result = import_config("int4")
+    assert result.returncode != 0
+    assert "GALLERY_STORAGE không hợp lệ: 'int4'" in result.stderr
@@ -0,0 +1,19 @@
+from app.database import fetchone, import_attendance_events
+
+
+def count_events():
+    return fetchone("SELECT COUNT(*) FROM attendance_events")[0]
+
+
+def test_import_attendance_events_counts_inserted_rows(database):
+    events = [("1", "An", "2024-05-01", "08:00:00", "check_in", "cam1"),
+              ("1", "An", "2024-05-01", "17:00:00", "check_out", "cam1"),
+              ("2", "Binh", "2024-05-01", "08:05:00", "check_in", "")]
+    assert import_attendance_events("2024-05-01.csv", 100, events) == 3
+    assert count_events() == 3
+
+    # Nhập lại file cũ kèm một bản ghi mới: chỉ bản ghi mới được đếm
+    events.append(("2", "Binh", "2024-05-01", "17:05:00", "check_out", ""))
+    assert import_attendance_events("2024-05-01.csv", 120, events) == 1
+    assert count_events() == 4
+    assert import_attendance_events("empty.csv", 0, []) == 0
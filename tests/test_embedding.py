@@ -0,0 +1,117 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.embedding import EmbeddingBatcher
+
+
+class CropRecognition:
+    """Mô hình nhận diện giả: embedding phụ thuộc nội dung ảnh, để phát hiện ghép nhầm kết quả giữa các ảnh"""
+
+    input_size = (112, 112)
+
+    def __init__(self, before_batch=None):
+        self.before_batch = before_batch
+        self.calls = 0
+
+    def get_feat(self, imgs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        self.calls += 1
+        if self.before_batch:
+            self.before_batch()
+        return np.stack([img.astype(np.float32).reshape(8, -1).mean(axis=1) for img in imgs])
+
+
+def make_crops(count, seed):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (112, 112, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def test_batcher_returns_each_camera_its_own_embeddings():
+    model = CropRecognition()
+    batcher = EmbeddingBatcher(lambda: model, batch_size=32, max_wait_ms=50)
+    batcher.start()
+    cameras = {camera: make_crops(camera + 1, seed=camera) for camera in range(4)}
+    results = {}
+    barrier = threading.Barrier(len(cameras))
+
+    def run(camera):
+        barrier.wait()
+        results[camera] = batcher.embed(cameras[camera])
+
+    threads = [threading.Thread(target=run, args=(camera,)) for camera in cameras]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    batcher.stop()
+
+    for camera, crops in cameras.items():
+        expected = [model.get_feat([crop])[0] for crop in crops]
+        np.testing.assert_allclose(np.array(results[camera]), np.array(expected), rtol=1e-6)
+    assert batcher.crops == sum(len(crops) for crops in cameras.values())
+    assert batcher.batches <= len(cameras)
+
+
+def test_embed_after_stop_runs_in_caller_thread():
+    model = CropRecognition()
+    batcher = EmbeddingBatcher(lambda: model)
+    batcher.start()
+    batcher.stop()
+    crops = make_crops(2, seed=0)
+    np.testing.assert_allclose(np.array(batcher.embed(crops)), model.get_feat(crops))
+    assert batcher.batches == 0
+
+
+def test_embed_times_out_and_cancels_request():
+    started = threading.Event()
+    release = threading.Event()
+
+    def block_first_batch():
+        if not started.is_set():
+            started.set()
+            release.wait(timeout=10)
+
+    model = CropRecognition(before_batch=block_first_batch)
+    batcher = EmbeddingBatcher(lambda: model, max_wait_ms=0, result_timeout=0.2)
+    batcher.start()
+    first = {}
+    thread = threading.Thread(target=lambda: first.setdefault("result", batcher.embed(make_crops(1, seed=1))))
+    thread.start()
+    assert started.wait(timeout=5)
+
+    # Luồng gộp lô đang bận với lô đầu: yêu cầu sau quá thời gian chờ và bị hủy
+    with pytest.raises(TimeoutError):
+        batcher.embed(make_crops(1, seed=2))
+    release.set()
+    thread.join(timeout=5)
+    batcher.stop()
+
+    assert len(first["result"]) == 1
+    assert batcher.batches == 1
+    assert batcher.crops == 1
+
+
+def test_embed_faces_batch_matches_single_faces(monkeypatch):
+    # Căn chỉnh khuôn mặt cần insightface (không cần tải mô hình)
+    pytest.importorskip("insightface")
+    from app import face_recognition
+    from app.benchmark import StubAnalyzer
+
+    analyzer = StubAnalyzer(3, np.eye(3, 512, dtype=np.float32))
+    analyzer.models['recognition'] = CropRecognition()
+    image = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    single = [face_recognition.embed_faces(analyzer, image, [face])[0]
+              for face in face_recognition.detect_face_boxes(analyzer, image)]
+
+    batcher = EmbeddingBatcher(lambda: analyzer.models['recognition'])
+    monkeypatch.setattr(face_recognition, "embedding_batcher", batcher)
+    for running in (False, True):
+        if running:
+            batcher.start()
+        faces = face_recognition.detect_face_boxes(analyzer, image)
+        batched = face_recognition.embed_faces(analyzer, image, faces)
+        np.testing.assert_allclose(np.array(batched), np.array(single), rtol=1e-5)
+    batcher.stop()
@@ -0,0 +1,64 @@
+import numpy as np
+
+from app.config import FACE_RECOGNITION_THRESHOLD
+from app.face_recognition import recognize_face
+from app.gallery import FaceGallery
+
+
+def make_face_database(size, dim=512, seed=0):
+    """Face database dạng dict như load_face_database, embedding ngẫu nhiên cố định theo seed"""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((size, dim)).astype(np.float32)
+    return {f"user{i}_Name{i}": {"embedding": embeddings[i], "info": {"name": f"Name{i}", "user_id": f"user{i}"}}
+            for i in range(size)}
+
+
+def assert_same_as_legacy(face_database, queries):
+    """FaceGallery.recognize phải cho cùng kết quả với vòng lặp cosine_similarity cũ của recognize_face"""
+    results = FaceGallery.from_face_database(face_database).recognize(queries)
+    assert len(results) == len(queries)
+    for query, (match_info, similarity) in zip(queries, results):
+        legacy_info, legacy_similarity = recognize_face(query, face_database)
+        assert match_info == legacy_info
+        assert abs(float(similarity) - float(legacy_similarity)) < 1e-5
+
+
+def test_recognize_matches_legacy_loop():
+    face_database = make_face_database(500)
+    rng = np.random.default_rng(1)
+    embeddings = np.array([entry["embedding"] for entry in face_database.values()])
+    rows = rng.integers(0, len(embeddings), 20)
+    # Nửa đầu: ảnh mới của người đã đăng ký (trên ngưỡng); nửa sau: người lạ (dưới ngưỡng)
+    queries = np.concatenate([embeddings[rows[:10]] + 0.3 * rng.standard_normal((10, 512)),
+                              rng.standard_normal((10, 512))]).astype(np.float32)
+    assert_same_as_legacy(face_database, queries)
+
+
+def test_recognize_ties_pick_first_user():
+    face_database = make_face_database(50)
+    # Hai người dùng có cùng embedding: cả hai cách tính đều chọn người đứng trước
+    duplicate = face_database["user7_Name7"]["embedding"].copy()
+    face_database["user30_Name30"]["embedding"] = duplicate
+    results = FaceGallery.from_face_database(face_database).recognize([duplicate])
+    assert results[0][0]["user_id"] == "user7"
+    assert_same_as_legacy(face_database, [duplicate])
+
+
+def test_recognize_threshold_boundary():
+    # at_threshold và các embedding có chuẩn đúng bằng 1 nên độ tương đồng đúng bằng ngưỡng, không sai số làm tròn
+    face_database = {
+        "a_A": {"embedding": np.array([1, 0, 0, 0], dtype=np.float32), "info": {"name": "A", "user_id": "a"}},
+        "b_B": {"embedding": np.array([0, 0, 0, 1], dtype=np.float32), "info": {"name": "B", "user_id": "b"}},
+    }
+    assert FACE_RECOGNITION_THRESHOLD == 0.5
+    at_threshold = np.array([0.5, 0.5, 0.5, -0.5], dtype=np.float32)  # cos với a = 0.5: không nhận
+    above_threshold = np.array([0.75, 0.5, 0.25, 0.25], dtype=np.float32)
+    queries = [at_threshold, above_threshold]
+    results = FaceGallery.from_face_database(face_database).recognize(queries)
+    assert results[0][0] is None
+    assert results[1][0] == {"name": "A", "user_id": "a"}
+    assert_same_as_legacy(face_database, queries)
+
+
+def test_recognize_empty_gallery():
+    assert FaceGallery().recognize(np.ones((2, 512), dtype=np.float32)) == [(None, -1), (None, -1)]
@@ -0,0 +1,17 @@
+import pytest
+
+from app.stream import BroadcastHub
+
+
+def test_subscribe_does_not_count_viewer_when_capture_fails():
+    def open_capture():
+        raise RuntimeError("camera unavailable")
+
+    hub = BroadcastHub(open_capture, lambda: None, lambda frame: (frame, []), name="test")
+    with pytest.raises(RuntimeError):
+        hub.subscribe()
+    with pytest.raises(RuntimeError):
+        hub.subscribe(video=False)
+    assert hub.subscribers == 0
+    assert hub.event_subscribers == 0
+    assert hub.pipeline is None
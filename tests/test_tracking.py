@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.tracking import FaceTracker
+
+
+def test_velocity_converges_to_constant_motion():
+    speed = np.array([4, -2, 4, -2], dtype=np.float32)  # pixel mỗi frame
+    start = np.array([100, 200, 220, 320], dtype=np.float32)
+    tracker = FaceTracker(detect_interval=3, reverify_interval=1000, iou_threshold=0.3, max_missed=2)
+
+    for frame_index in range(1, 59):
+        face = SimpleNamespace(bbox=start + speed * frame_index)
+        tracks = tracker.update(None, lambda frame: [face], lambda frame, faces: [None] * len(faces),
+                                lambda embeddings: [(None, 0.0)] * len(embeddings))
+
+    assert len(tracker.tracks) == 1
+    np.testing.assert_allclose(tracker.tracks[0].velocity, speed, atol=1e-3)
+    # Ở các frame giữa hai lần phát hiện, vị trí dự đoán theo sát khuôn mặt
+    tracks = tracker.update(None, None, None, None)
+    np.testing.assert_allclose(tracks[0].bbox, start + speed * 59, atol=1e-2)